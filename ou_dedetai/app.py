@@ -181,6 +181,9 @@ class App(abc.ABC):
             # thread); also frees any join() the main-thread exit waits on.
             raise SystemExit
         logging.debug(f"Closing {constants.APP_NAME}.")
+        # Otherwise the interpreter waits for background downloads to finish
+        from ou_dedetai import network  # local import to avoid circular dependency
+        network.cancel_prefetches()
         self._exit(reason, intended)
         # Shutdown logos/indexer if we spawned it
         self.logos.end_processes()
@@ -1,18 +1,424 @@
 import abc
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from dataclasses import asdict, dataclass
+import errno
+import hashlib
+import json
+import os
 import queue
 import logging
+import multiprocessing
 import shutil
-import time
+import tarfile
+import threading
 from pathlib import Path
-from typing import List, Optional
+from typing import IO, Callable, Dict, List, Optional
 from typing import Tuple
 from ou_dedetai import constants
 from ou_dedetai import utils
 from ou_dedetai.app import App
 
 
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+"""Bytes handed to the kernel per copy call, progress is reported in between"""
+
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM}
+"""Errors meaning the kernel can't do this copy in-kernel, not that the copy failed"""
+
+
+MANIFEST_NAME = "manifest.json"
+"""Written in a backup once it's complete, lists every file it contains"""
+
+ARCHIVE_INDEX_NAME = "archive.json"
+"""Written in an archive backup once it's complete, lists which chunk has each file"""
+
+ARCHIVE_CHUNK_SIZE = 64 * 1024 * 1024
+"""Uncompressed bytes per archive chunk.
+
+Each chunk is a separately compressed tar, so this is also roughly how much
+has to be decompressed to get a single file back out"""
+
+ARCHIVE_COMPRESSLEVEL = 6
+"""gzip level, 9 is much slower for little gain on Logos resources"""
+
+SQLITE_SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal")
+"""Files SQLite keeps next to a database, only valid together with that exact database"""
+
+
+@dataclass
+class BackupFile:
+    path: str
+    """Path relative to the backup/restore root"""
+    size: int
+    mtime_ns: int
+    sha256: Optional[str] = None
+
+
+def read_manifest(snapshot_dir: Path) -> Optional[Dict[str, BackupFile]]:
+    """Reads the manifest of a backup, keyed by path.
+
+    Returns:
+        None if the backup has no (readable) manifest, for example because
+        it was made by an older version or didn't finish
+    """
+    try:
+        with open(snapshot_dir / MANIFEST_NAME, encoding="utf-8") as f:
+            data = json.load(f)
+        return {entry["path"]: BackupFile(**entry) for entry in data["files"]}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.debug(f"No usable manifest in {snapshot_dir}: {e}")
+        return None
+
+
+def _write_json(path: Path, data: dict) -> None:
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def write_manifest(snapshot_dir: Path, files: List[BackupFile]) -> None:
+    _write_json(snapshot_dir / MANIFEST_NAME, {"files": [asdict(file) for file in files]})
+
+
+@dataclass
+class ArchiveIndex:
+    dirs: List[str]
+    files: List[BackupFile]
+    chunks: Dict[str, List[str]]
+    """Chunk path (relative to the archive) -> paths of the files in it"""
+
+
+def read_archive_index(archive_dir: Path) -> Optional[ArchiveIndex]:
+    try:
+        with open(archive_dir / ARCHIVE_INDEX_NAME, encoding="utf-8") as f:
+            data = json.load(f)
+        return ArchiveIndex(
+            dirs=data["dirs"],
+            files=[BackupFile(**entry) for entry in data["files"]],
+            chunks=data["chunks"],
+        )
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.debug(f"No usable archive index in {archive_dir}: {e}")
+        return None
+
+
+def write_archive_index(archive_dir: Path, index: ArchiveIndex) -> None:
+    _write_json(archive_dir / ARCHIVE_INDEX_NAME, asdict(index))
+
+
+class _HashingReader:
+    def __init__(self, file: IO[bytes], hasher: "hashlib._Hash") -> None:
+        self._file = file
+        self._hasher = hasher
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._file.read(size)
+        self._hasher.update(data)
+        return data
+
+
+def _write_archive_chunk(source_dir: str, chunk_path: str, paths: List[str]) -> Dict[str, str]:
+    """Compresses files into one chunk. Runs in a worker process.
+
+    Returns:
+        sha256 of each file
+    """
+    hashes = {}
+    tmp_path = f"{chunk_path}.part"
+    with tarfile.open(
+        tmp_path, "w:gz", compresslevel=ARCHIVE_COMPRESSLEVEL, dereference=True
+    ) as tar:
+        for path in paths:
+            full_path = os.path.join(source_dir, path)
+            info = tar.gettarinfo(full_path, arcname=path)
+            with open(full_path, "rb") as f:
+                hasher = hashlib.sha256()
+                tar.addfile(info, _HashingReader(f, hasher))
+            hashes[path] = hasher.hexdigest()
+    os.replace(tmp_path, chunk_path)
+    return hashes
+
+
+def _extract_archive_chunk(
+    chunk_path: str,
+    destination_dir: str,
+    files: Dict[str, BackupFile],
+    stage: bool,
+) -> List[str]:
+    """Extracts some files from one chunk. Runs in a worker process.
+
+    Like a plain copy, each file is written next to its destination, hashed on
+    the way and only moved into place if it matches.
+
+    Args:
+        files: the index entries of the files to extract, by path
+        stage: leave the verified files next to their destination instead of
+            moving them into place
+
+    Returns:
+        Destinations of the staged files
+    """
+    staged: List[str] = []
+    try:
+        _extract_members(chunk_path, destination_dir, files, staged if stage else None)
+    except BaseException:
+        for destination in staged:
+            _partial_path(Path(destination)).unlink(missing_ok=True)
+        raise
+    return staged
+
+
+def _extract_members(
+    chunk_path: str,
+    destination_dir: str,
+    files: Dict[str, BackupFile],
+    staged: Optional[List[str]],
+) -> None:
+    with tarfile.open(chunk_path, "r:gz") as tar:
+        for member in tar:
+            if member.name not in files:
+                continue
+            # Rejects absolute paths and paths leaving destination_dir
+            member = tarfile.tar_filter(member, destination_dir)
+            if not member.isfile():
+                tar.extract(member, destination_dir, filter="tar")
+                continue
+            source = tar.extractfile(member)
+            if source is None:
+                raise VerificationError(f"{member.name} can't be read from {chunk_path}")
+            file = files[member.name]
+            destination = Path(destination_dir) / member.name
+            destination.parent.mkdir(parents=True, exist_ok=True)
+
+            def write(tmp_path: Path) -> None:
+                hasher = hashlib.sha256()
+                with open(tmp_path, "wb") as f:
+                    shutil.copyfileobj(_HashingReader(source, hasher), f, COPY_CHUNK_SIZE)
+                if file.sha256 is not None and hasher.hexdigest() != file.sha256:
+                    raise VerificationError(f"{member.name} doesn't match its checksum in the backup")
+                os.chmod(tmp_path, member.mode)
+                # tar only keeps whole seconds, restore the exact time so
+                # restoring only changed files can compare it
+                os.utime(tmp_path, ns=(file.mtime_ns, file.mtime_ns))
+
+            if staged is None:
+                _write_atomically(destination, write)
+            else:
+                _write_partial(destination, write)
+                staged.append(str(destination))
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    # The app has threads running, which fork doesn't get along with
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+
+
+def _plan_chunks(files: List[BackupFile]) -> Dict[str, List[BackupFile]]:
+    """Groups files into chunks of about ARCHIVE_CHUNK_SIZE.
+
+    Files are kept in path order, so files from the same folder end up
+    together and restoring part of the tree opens few chunks.
+    """
+    chunks: Dict[str, List[BackupFile]] = {}
+    current: List[BackupFile] = []
+    current_size = 0
+    for file in sorted(files, key=lambda f: f.path):
+        if current and current_size + file.size > ARCHIVE_CHUNK_SIZE:
+            chunks[f"chunks/{len(chunks):05d}.tar.gz"] = current
+            current, current_size = [], 0
+        current.append(file)
+        current_size += file.size
+    if current:
+        chunks[f"chunks/{len(chunks):05d}.tar.gz"] = current
+    return chunks
+
+
+def extract_archive(
+    archive_dir: Path,
+    destination_dir: Path,
+    index: ArchiveIndex,
+    paths: Optional[List[str]] = None,
+    workers: int = 4,
+    on_progress: Optional[Callable[[int], None]] = None,
+    stage: bool = False,
+) -> List[Path]:
+    """Extracts an archive backup, chunks in parallel.
+
+    Files are verified against the sha256 in the index as they're extracted,
+    a file that doesn't match raises VerificationError and isn't put in place.
+
+    Args:
+        paths: only extract these files (relative to the archive root)
+        on_progress: called with the uncompressed size of each chunk once it's extracted
+        stage: leave every file next to its destination (see _partial_path) for
+            the caller to move into place once all of them are verified.
+            If extraction fails none are left behind
+
+    Returns:
+        Destinations of the staged files
+    """
+    sizes = {f.path: f.size for f in index.files}
+    by_path = {f.path: f for f in index.files}
+    wanted = set(paths) if paths is not None else None
+    if wanted is None:
+        for d in index.dirs:
+            (destination_dir / d).mkdir(parents=True, exist_ok=True)
+    else:
+        missing = wanted - sizes.keys()
+        if missing:
+            raise FileNotFoundError(f"Not in the archive: {', '.join(sorted(missing))}")
+    with _process_pool(workers) as executor:
+        futures = {}
+        for chunk, chunk_paths in index.chunks.items():
+            selected = chunk_paths if wanted is None else [p for p in chunk_paths if p in wanted]
+            if not selected:
+                continue
+            future = executor.submit(
+                _extract_archive_chunk,
+                str(archive_dir / chunk),
+                str(destination_dir),
+                {p: by_path[p] for p in selected},
+                stage,
+            )
+            futures[future] = sum(sizes[p] for p in selected)
+        staged: List[Path] = []
+        try:
+            for future in as_completed(futures):
+                staged.extend(Path(destination) for destination in future.result())
+                if on_progress is not None:
+                    on_progress(futures[future])
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            # Chunks that were already running still finish
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    staged.extend(Path(destination) for destination in future.result())
+            for destination in set(staged):
+                _partial_path(destination).unlink(missing_ok=True)
+            raise
+    return staged
+
+
+class CopyCancelled(Exception):
+    """Raised in copy workers once the copy has been cancelled"""
+
+
+class VerificationError(Exception):
+    """A copied file doesn't match the checksum in the backup's manifest"""
+
+
+def _partial_path(destination: Path) -> Path:
+    """Where destination is written before it's moved into place"""
+    return destination.with_name(f".{destination.name}.partial")
+
+
+def _write_partial(destination: Path, write: Callable[[Path], None]) -> None:
+    """Writes to the partial path of destination, removing it if that fails"""
+    tmp_path = _partial_path(destination)
+    try:
+        write(tmp_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _write_atomically(destination: Path, write: Callable[[Path], None]) -> None:
+    """Writes to a temporary file next to destination, then moves it into place
+
+    Whatever was at destination stays there until the new file is complete.
+    """
+    tmp_path = _partial_path(destination)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _copy_with(
+    copy: Callable[[int, int, int], int],
+    fsrc: int,
+    fdst: int,
+    on_progress: Optional[Callable[[int], None]],
+) -> int:
+    copied = 0
+    while True:
+        count = copy(fsrc, fdst, COPY_CHUNK_SIZE)
+        if count == 0:
+            return copied
+        copied += count
+        if on_progress is not None:
+            on_progress(count)
+
+
+def _copy_userspace(fsrc: int, fdst: int, count: int, hasher: Optional["hashlib._Hash"] = None) -> int:
+    data = os.read(fsrc, count)
+    if hasher is not None:
+        hasher.update(data)
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fdst, view):]
+    return len(data)
+
+
+def copy_file(
+    src: Path,
+    dst: Path,
+    on_progress: Optional[Callable[[int], None]] = None,
+    hasher: Optional["hashlib._Hash"] = None,
+) -> int:
+    """Copies src to dst (including permissions and times) without reading it into python
+
+    Uses copy_file_range, which lets the filesystem clone or copy server side,
+    then sendfile, then plain reads and writes.
+
+    Args:
+        on_progress: called with the number of bytes copied after each chunk
+        hasher: updated with the file's contents. The data then has to pass
+            through python, so only plain reads and writes are used
+
+    Returns:
+        Bytes copied
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        copied = 0
+        copiers: list[Callable[[int, int, int], int]] = []
+        if hasher is not None:
+            copiers.append(lambda i, o, n: _copy_userspace(i, o, n, hasher))
+        else:
+            if hasattr(os, "copy_file_range"):
+                copiers.append(lambda i, o, n: os.copy_file_range(i, o, n))
+            if hasattr(os, "sendfile"):
+                copiers.append(lambda i, o, n: os.sendfile(o, i, None, n))
+            copiers.append(_copy_userspace)
+        for i, copier in enumerate(copiers):
+            try:
+                copied += _copy_with(copier, in_fd, out_fd, on_progress)
+                break
+            except OSError as e:
+                # Only fall back if nothing has been written yet,
+                # otherwise it's a real error (disk full, I/O error...)
+                if copied or i == len(copiers) - 1 or e.errno not in _FALLBACK_ERRNOS:
+                    raise
+                # Either call may have written part of a chunk before failing
+                os.lseek(in_fd, 0, os.SEEK_SET)
+                os.ftruncate(out_fd, 0)
+                os.lseek(out_fd, 0, os.SEEK_SET)
+    shutil.copystat(src, dst)
+    return copied
+
+
 class BackupBase(abc.ABC):
     DATA_DIRS = ['Data', 'Documents', 'Users']
+    COPY_WORKERS = 4
+    """Files copied at once.
+
+    Logos data is mostly many small files, where keeping several requests in
+    flight matters more than raw throughput"""
 
     def __init__(
         self,
@@ -24,8 +430,19 @@ class BackupBase(abc.ABC):
         self._destination_dir: Optional[Path] = None
         self._source_dir: Optional[Path] = None
         self.data_size = 1
-        self.destination_disk_used_init: Optional[int] = None
+        self.workers = self.COPY_WORKERS
         self.q: queue.Queue[int] = queue.Queue()
+        self._copied_bytes = 0
+        self._copied_lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self.hash_files = False
+        """Whether to record each copied file's sha256"""
+        self.verify_files = False
+        """Whether to check copied files against the sha256 they already have"""
+        self._link_sources: Dict[str, Path] = {}
+        """Files that are hardlinked from here instead of copied"""
+        self._hardlinks: Dict[str, str] = {}
+        """Files that are hardlinks of another file being copied, so are linked to its copy"""
         if not self.app.approve(f"Use existing backups folder \"{self.app.conf.backup_dir}\"?"):
             # Reset backup dir.
             # The app will re-prompt next time the backup_dir is accessed
@@ -39,17 +456,119 @@ class BackupBase(abc.ABC):
                 m += f"{m}\n\nTry connecting removable media:\nsnap connect {constants.BINARY_NAME}:removable-media\n"
             self.app.exit(m)
 
-    def _copy_dirs(
-            self,
-            src_dirs: List[str|Path] | Tuple[str|Path],
-            dst_dir: Path|str,
-        ) -> None:
-        # logging.debug("starting _copy_dirs")
-        for src in src_dirs:
-            if not isinstance(src, Path):
-                src = Path(src)
-            logging.debug(f"copying \"{src}\" to \"{dst_dir}/{src.name}\"")
-            shutil.copytree(src, Path(dst_dir) / src.name)
+    def _list_files(self) -> Tuple[List[str], List[BackupFile]]:
+        """Walks the source dirs once.
+
+        Returns:
+            Directories and files, relative to source_dir
+        """
+        # Follow symlinks like copytree did
+        scan = utils.scan_tree(self._get_source_subdirs(), follow_symlinks=True)
+        logging.debug(f"{self.mode} source uses {scan.size} bytes")
+        dirs = [str(d.relative_to(self.source_dir)) for d in scan.dirs]
+        files: List[BackupFile] = []
+        first_links: Dict[Tuple[int, int], str] = {}
+        self._hardlinks = {}
+        for scanned in scan.files:
+            path = str(scanned.path.relative_to(self.source_dir))
+            if scanned.inode is not None:
+                first = first_links.setdefault(scanned.inode, path)
+                if first != path:
+                    self._hardlinks[path] = first
+            files.append(BackupFile(path=path, size=scanned.size, mtime_ns=scanned.mtime_ns))
+        return dirs, files
+
+    def _add_progress(self, count: int) -> None:
+        if self._cancelled.is_set():
+            raise CopyCancelled()
+        with self._copied_lock:
+            self._copied_bytes += count
+
+    def _copy_one(self, file: BackupFile) -> None:
+        if self._cancelled.is_set():
+            raise CopyCancelled()
+        destination = self.destination_dir / file.path
+        link_source = self._link_sources.get(file.path)
+        if link_source is not None:
+            try:
+                self._put_in_place(destination, lambda tmp: os.link(link_source, tmp))
+                self._add_progress(file.size)
+                return
+            except OSError as e:
+                # e.g. different filesystem or too many links, copy it instead
+                logging.debug(f"Couldn't link {link_source}: {e}")
+        expected = file.sha256 if self.verify_files else None
+        hasher = hashlib.sha256() if self.hash_files or expected else None
+
+        def write(tmp_path: Path) -> None:
+            copy_file(self.source_dir / file.path, tmp_path, self._add_progress, hasher)
+            # Checked before the file is moved into place
+            if hasher is not None and expected and hasher.hexdigest() != expected:
+                raise VerificationError(f"{file.path} doesn't match its checksum in the backup")
+
+        self._put_in_place(destination, write)
+        if hasher is not None:
+            file.sha256 = hasher.hexdigest()
+
+    def _put_in_place(self, destination: Path, write: Callable[[Path], None]) -> None:
+        """Writes a copied file, see _write_atomically"""
+        _write_atomically(destination, write)
+
+    def _written_path(self, destination: Path) -> Path:
+        """Where the copy of destination is, it may not be in place yet"""
+        return destination
+
+    def _copy_files(self, dirs: List[str], files: List[BackupFile]) -> None:
+        for d in dirs:
+            (self.destination_dir / d).mkdir(parents=True, exist_ok=True)
+        # Biggest first, so one large file doesn't end up running alone at the end
+        ordered = sorted(
+            (f for f in files if f.path not in self._hardlinks),
+            key=lambda f: f.size,
+            reverse=True,
+        )
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._copy_one, f) for f in ordered]
+            _, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            if not_done:
+                # A copy failed, don't start the rest
+                self._cancelled.set()
+                for future in not_done:
+                    future.cancel()
+        for future in futures:
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is not None and not isinstance(error, CopyCancelled):
+                raise error
+        if self._cancelled.is_set():
+            raise CopyCancelled()
+        self._copy_hardlinks(files)
+        # Directory times change as files are added to them
+        for d in reversed(dirs):
+            shutil.copystat(self.source_dir / d, self.destination_dir / d)
+
+    def _copy_hardlinks(self, files: List[BackupFile]) -> None:
+        """Links files that were hardlinks in the source the same way in the copy"""
+        by_path = {f.path: f for f in files}
+        for path, first in self._hardlinks.items():
+            file = by_path.get(path)
+            if file is None:
+                continue
+            if first not in by_path:
+                # Its first link isn't being copied this time
+                self._copy_one(file)
+                continue
+            destination = self.destination_dir / path
+            try:
+                first_copy = self._written_path(self.destination_dir / first)
+                self._put_in_place(destination, lambda tmp: os.link(first_copy, tmp))
+                self._add_progress(file.size)
+            except OSError as e:
+                logging.debug(f"Couldn't link {destination}: {e}")
+                self._copy_one(file)
+                continue
+            file.sha256 = by_path[first].sha256
 
     def _get_all_backups(self) -> List[str]:
         all_backups = [
@@ -61,27 +580,17 @@ class BackupBase(abc.ABC):
         logging.debug(all_backups)
         return all_backups
 
-    def _get_copy_percentage(self) -> int:
-        disk_used = self._get_dest_disk_used()
-        # This should already be set by run, but in case it isn't
-        if not self.destination_disk_used_init:
-            self.destination_disk_used_init = disk_used
+    def _get_link_sources(self, files: List[BackupFile]) -> Dict[str, Path]:
+        """Files that are unchanged from an earlier copy and can be hardlinked from it"""
+        return {}
 
-        delta = disk_used - self.destination_disk_used_init
-        percent = int(delta * 100 / self.data_size)
-        # logging.debug(f"{percent=}")
-        return percent
+    def _after_copy(self, dirs: List[str], files: List[BackupFile]) -> None:
+        """Called once every file has been copied"""
 
-    def _get_dest_disk_used(self) -> int:
-        return shutil.disk_usage(self.destination_dir).used
-
-    def _get_dir_group_size(
-        self,
-        dirs: List[Path] | Tuple[Path],
-    ) -> int:
-        size = utils.get_folder_group_size(dirs)
-        logging.debug(f"backup {size=}")
-        return size
+    def _get_copy_percentage(self) -> int:
+        with self._copied_lock:
+            copied = self._copied_bytes
+        return int(copied * 100 / max(self.data_size, 1))
 
     def _get_source_subdirs(self) -> List[Path]:
         dirs = [self.source_dir / d for d in self.DATA_DIRS if (self.source_dir / d).is_dir()]
@@ -89,12 +598,12 @@ class BackupBase(abc.ABC):
             self.app.exit(f"there are no files to {self.mode}")
         return dirs
 
-    def _prepare_dest_dir(self) -> None:
-        """Remove existing data."""
-        for d in self.DATA_DIRS:
-            dst = self.destination_dir / d
-            if dst.is_dir():
-                shutil.rmtree(dst)
+    def _get_required_space(self, files: List[BackupFile]) -> int:
+        """Free space needed at the destination"""
+        return sum(
+            f.size for f in files
+            if f.path not in self._link_sources and f.path not in self._hardlinks
+        )
 
     def _run(self) -> None:
         self.app.status(f"Running {self.mode} from {self.source_dir} to {self.destination_dir}") 
@@ -102,29 +611,44 @@ class BackupBase(abc.ABC):
             self.app.exit("source directory not set")
         elif self.destination_dir is None:
             self.app.exit("destination directory not set")
-        src_dirs = self._get_source_subdirs()
+        dirs, files = self._list_files()
+        self.data_size = sum(f.size for f in files)
+        logging.debug(f"{self.mode} {len(files)} files, {self.data_size} bytes")
+        self._link_sources = self._get_link_sources(files)
+        self._verify_disk_space(self._get_required_space(files))
+        self._copied_bytes = 0
+        self._cancelled.clear()
+        errors: List[BaseException] = []
+
+        def copy() -> None:
+            try:
+                self._copy_files(dirs, files)
+            except BaseException as e:
+                errors.append(e)
 
-        self.data_size = self._get_dir_group_size(src_dirs)
-        self._prepare_dest_dir()
-        self.destination_disk_used_init = self._get_dest_disk_used()
-        self._verify_disk_space()
         # logging.debug("starting data copy thread")
-        t = self.app.start_thread(self._copy_dirs, src_dirs, self.destination_dir)
+        t = self.app.start_thread(copy)
         try:
             while t.is_alive():
                 self.app.status("copying…", self._get_copy_percentage())
-                time.sleep(0.5)
+                t.join(0.5)
             print()
         except KeyboardInterrupt:
             print()
+            self._cancelled.set()
+            t.join()
             self.app.exit("user cancelled with Ctrl+C.")
         t.join()
+        if errors:
+            logging.error(f"{self.mode} failed: {errors[0]!r}")
+            self.app.exit(f"{self.mode} failed: {errors[0]}")
+        self._after_copy(dirs, files)
         # logging.debug("finished data copy thread")
         m = f"Finished {self.mode}. {self.data_size} bytes copied."
         self.app.status(m)
 
-    def _verify_disk_space(self) -> None:
-        if not utils.enough_disk_space(self.destination_dir, self.data_size):
+    def _verify_disk_space(self, required_size: int) -> None:
+        if not utils.enough_disk_space(self.destination_dir, required_size):
             try:
                 self.destination_dir.rmdir()
             except OSError:  # folder not empty
@@ -156,14 +680,101 @@ class BackupBase(abc.ABC):
 
 
 class BackupTask(BackupBase):
-    def __init__(self, app: App) -> None:
+    def __init__(self, app: App, archive: bool = False) -> None:
+        """
+        Args:
+            archive: write compressed chunks and an index instead of a plain copy
+        """
         super().__init__(app, 'backup')
         self.description = 'Use'
+        self.hash_files = True
+        self.archive = archive
+        self._archive_chunks: Dict[str, List[BackupFile]] = {}
 
     def run(self) -> None:
         """Run the backup task."""
         self._run()
 
+    def _get_previous_backup(self) -> Optional[Tuple[Path, Dict[str, BackupFile]]]:
+        """The latest complete backup (one with a manifest)"""
+        for backup_dir in reversed(self._get_all_backups()):
+            path = Path(backup_dir)
+            if path == self.destination_dir:
+                continue
+            manifest = read_manifest(path)
+            if manifest is not None:
+                return path, manifest
+        return None
+
+    def _get_link_sources(self, files: List[BackupFile]) -> Dict[str, Path]:
+        if self.archive:
+            return {}
+        previous = self._get_previous_backup()
+        if previous is None:
+            return {}
+        previous_dir, manifest = previous
+        link_sources = {}
+        for file in files:
+            old = manifest.get(file.path)
+            if (
+                old is None
+                or old.sha256 is None
+                or old.size != file.size
+                or old.mtime_ns != file.mtime_ns
+            ):
+                continue
+            old_path = previous_dir / file.path
+            # Make sure the old copy hasn't been touched since
+            try:
+                stat = old_path.stat()
+            except OSError:
+                continue
+            if stat.st_size != old.size or stat.st_mtime_ns != old.mtime_ns:
+                continue
+            file.sha256 = old.sha256
+            link_sources[file.path] = old_path
+        logging.info(f"Linking {len(link_sources)} of {len(files)} unchanged files from {previous_dir}")
+        return link_sources
+
+    def _copy_files(self, dirs: List[str], files: List[BackupFile]) -> None:
+        if not self.archive:
+            super()._copy_files(dirs, files)
+            return
+        self._archive_chunks = _plan_chunks(files)
+        (self.destination_dir / "chunks").mkdir(exist_ok=True)
+        # Compression is CPU bound, so it needs processes rather than threads
+        with _process_pool(self.workers) as executor:
+            futures = {
+                executor.submit(
+                    _write_archive_chunk,
+                    str(self.source_dir),
+                    str(self.destination_dir / name),
+                    [f.path for f in chunk],
+                ): chunk
+                for name, chunk in self._archive_chunks.items()
+            }
+            try:
+                for future in as_completed(futures):
+                    hashes = future.result()
+                    for file in futures[future]:
+                        file.sha256 = hashes[file.path]
+                    self._add_progress(sum(f.size for f in futures[future]))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def _after_copy(self, dirs: List[str], files: List[BackupFile]) -> None:
+        # Written last, so only complete backups are used to link against or restore from
+        if self.archive:
+            write_archive_index(self.destination_dir, ArchiveIndex(
+                dirs=dirs,
+                files=files,
+                chunks={name: [f.path for f in chunk] for name, chunk in self._archive_chunks.items()},
+            ))
+        else:
+            write_manifest(self.destination_dir, files)
+
     def _get_source_dir(self) -> Path:
         if self.app.conf._logos_appdata_dir is None:
             self.app.exit("Cannot backup when product is not installed.")
@@ -186,8 +797,180 @@ class BackupTask(BackupBase):
 
 
 class RestoreTask(BackupBase):
-    def __init__(self, app: App) -> None:
+    def __init__(self, app: App, changed_only: bool = False) -> None:
+        """
+        Args:
+            changed_only: skip files whose size and modification time
+                already match the backup
+        """
         super().__init__(app, 'restore')
+        self.changed_only = changed_only
+        self.verify_files = True
+        self._archive_index: Optional[ArchiveIndex] = None
+        self._backup_dirs: List[str] = []
+        self._backup_paths: set[str] = set()
+        self._staged: set[Path] = set()
+        """Verified files waiting next to their destination"""
+        self._staged_lock = threading.Lock()
+
+    @property
+    def archive_index(self) -> Optional[ArchiveIndex]:
+        """Index of the backup being restored, if it's an archive backup"""
+        if self._archive_index is None:
+            self._archive_index = read_archive_index(self.source_dir)
+        return self._archive_index
+
+    def extract(self, paths: List[str], destination_dir: Optional[Path] = None) -> None:
+        """Extracts some files from an archive backup.
+
+        Args:
+            paths: relative to the backup root, e.g. Documents/Notes/notes.db
+            destination_dir: where to put them, defaults to the installed data
+        """
+        if self.archive_index is None:
+            self.app.exit(f"{self.source_dir} is not an archive backup")
+        extract_archive(
+            self.source_dir,
+            destination_dir or self.destination_dir,
+            self.archive_index,
+            paths,
+            self.workers,
+        )
+
+    def _list_files(self) -> Tuple[List[str], List[BackupFile]]:
+        if self.archive_index is not None:
+            dirs, files = self.archive_index.dirs, self.archive_index.files
+        else:
+            dirs, files = super()._list_files()
+            manifest = read_manifest(self.source_dir)
+            if manifest is None:
+                logging.info(f"{self.source_dir} has no manifest, restored files won't be verified")
+            else:
+                self._check_manifest(manifest, files)
+        self._backup_dirs = dirs
+        self._backup_paths = {f.path for f in files}
+        if self.changed_only:
+            changed = [f for f in files if not self._matches_installed(f)]
+            logging.info(f"{len(files) - len(changed)} of {len(files)} files are already up to date")
+            files = changed
+        return dirs, files
+
+    def _check_manifest(self, manifest: Dict[str, BackupFile], files: List[BackupFile]) -> None:
+        """Gives each file the sha256 it's verified against.
+
+        Exits before anything is restored if the backup doesn't have the files
+        its manifest lists, with the sizes it lists.
+        """
+        problems = []
+        for file in files:
+            entry = manifest.get(file.path)
+            if entry is None:
+                problems.append(f"{file.path} isn't in the manifest")
+            elif entry.size != file.size:
+                problems.append(f"{file.path} is {file.size} bytes, the manifest says {entry.size}")
+            else:
+                file.sha256 = entry.sha256
+        listed = {f.path for f in files}
+        problems.extend(f"{path} is missing from the backup" for path in manifest if path not in listed)
+        if problems:
+            for problem in problems:
+                logging.error(f"{self.source_dir}: {problem}")
+            self.app.exit(f"{self.mode} failed: {self.source_dir} doesn't match its manifest ({problems[0]})")
+
+    def _matches_installed(self, file: BackupFile) -> bool:
+        try:
+            st = (self.destination_dir / file.path).stat()
+        except OSError:
+            return False
+        return st.st_size == file.size and st.st_mtime_ns == file.mtime_ns
+
+    def _get_required_space(self, files: List[BackupFile]) -> int:
+        # Files are replaced one at a time, so the space the installed copies
+        # use now is freed as we go
+        replaced = 0
+        for file in files:
+            try:
+                replaced += (self.destination_dir / file.path).stat().st_size
+            except OSError:
+                pass
+        largest = max((f.size for f in files), default=0)
+        return max(super()._get_required_space(files) - replaced, 0) + largest
+
+    def _put_in_place(self, destination: Path, write: Callable[[Path], None]) -> None:
+        # Moved into place by _commit_staged, once every file is verified
+        _write_partial(destination, write)
+        with self._staged_lock:
+            self._staged.add(destination)
+
+    def _written_path(self, destination: Path) -> Path:
+        with self._staged_lock:
+            staged = destination in self._staged
+        return _partial_path(destination) if staged else destination
+
+    def _copy_files(self, dirs: List[str], files: List[BackupFile]) -> None:
+        self._staged = set()
+        try:
+            if self.archive_index is None:
+                super()._copy_files(dirs, files)
+            else:
+                for d in dirs:
+                    (self.destination_dir / d).mkdir(parents=True, exist_ok=True)
+                self._staged.update(extract_archive(
+                    self.source_dir,
+                    self.destination_dir,
+                    self.archive_index,
+                    [f.path for f in files] if self.changed_only else None,
+                    workers=self.workers,
+                    on_progress=self._add_progress,
+                    stage=True,
+                ))
+        except BaseException:
+            # The installed data is left as it was
+            for destination in self._staged:
+                _partial_path(destination).unlink(missing_ok=True)
+            self._staged = set()
+            raise
+        self._commit_staged()
+        if self.archive_index is None:
+            # Moving the files in changed the directory times again
+            for d in reversed(dirs):
+                shutil.copystat(self.source_dir / d, self.destination_dir / d)
+
+    def _commit_staged(self) -> None:
+        """Moves every staged file into place.
+
+        A database is only ever next to the -wal/-shm/-journal files it was
+        backed up with, installed ones that aren't in the backup are removed
+        before it's replaced.
+        """
+        for destination in sorted(self._staged):
+            for suffix in SQLITE_SIDECAR_SUFFIXES:
+                sidecar = destination.with_name(f"{destination.name}{suffix}")
+                relative = str(sidecar.relative_to(self.destination_dir))
+                if sidecar not in self._staged and relative not in self._backup_paths:
+                    sidecar.unlink(missing_ok=True)
+            os.replace(_partial_path(destination), destination)
+        logging.debug(f"Put {len(self._staged)} restored files in place")
+        self._staged = set()
+
+    def _after_copy(self, dirs: List[str], files: List[BackupFile]) -> None:
+        # Only once everything is in place, so an interrupted restore leaves
+        # the installed data as it was (plus any files restored so far)
+        self._remove_extra_files()
+
+    def _remove_extra_files(self) -> None:
+        """Removes installed data that isn't in the backup"""
+        installed = utils.scan_tree([self.destination_dir / d for d in self.DATA_DIRS])
+        removed = 0
+        for scanned in installed.files:
+            if str(scanned.path.relative_to(self.destination_dir)) not in self._backup_paths:
+                scanned.path.unlink(missing_ok=True)
+                removed += 1
+        backup_dirs = set(self._backup_dirs)
+        for d in reversed(installed.dirs):
+            if str(d.relative_to(self.destination_dir)) not in backup_dirs:
+                shutil.rmtree(d, ignore_errors=True)
+        logging.info(f"Removed {removed} files that aren't in the backup")
 
     def run(self) -> None:
         """Run the restore task."""
@@ -210,10 +993,10 @@ class RestoreTask(BackupBase):
 
 
 def backup(app: App) -> None:
-    backup = BackupTask(app)
+    backup = BackupTask(app, archive=app.conf._overrides.backup_archive)
     backup.run()
 
 
 def restore(app: App) -> None:
-    restore = RestoreTask(app)
+    restore = RestoreTask(app, changed_only=app.conf._overrides.restore_changed_only)
     restore.run()
@@ -4,7 +4,6 @@ import queue
 import shutil
 import sys
 import threading
-import time
 from typing import Optional, Tuple
 
 from ou_dedetai import constants
@@ -76,7 +75,8 @@ class CLI(App):
             # exit; run it here on the main thread so the process truly stops.
             if self._pending_exit is not None:
                 self.exit(*self._pending_exit)
-            time.sleep(3)
+            # Returns as soon as a Logos process exits
+            self.logos.wait_for_change(3)
             self.logos.monitor()
 
     def stop_installed_app(self):
@@ -1,3 +1,4 @@
+import concurrent.futures
 import copy
 import os
 import subprocess
@@ -242,6 +243,10 @@ class EphemeralConfiguration:
 
     # Start of values just set via cli arg
     app_run_as_root_permitted: bool = False
+    backup_archive: bool = False
+    """Whether backups are written as compressed archives instead of a plain copy"""
+    restore_changed_only: bool = False
+    """Whether restore skips files that already match the backup"""
     agreed_to_faithlife_terms: bool = False
     """The user expressed clear agreement with faithlife's terms.
     Normally the MSI would prompt for this as well.
@@ -973,6 +978,19 @@ class Config:
             self._wine_appimage_files = utils.find_appimage_files(self.app)
         return self._wine_appimage_files
 
+    def find_wine_files(self) -> None:
+        """Fills wine_binary_files and wine_app_image_files, looking for both at once"""
+        if self._wine_binary_files is not None or self._wine_appimage_files is not None:
+            # At most one left to look for, the properties do that
+            return
+        # Made here, building them reads config values that may prompt
+        appimage_search = utils.appimage_search(self.app)
+        binary_search = utils.wine_binary_search(self.app, self._raw.faithlife_product_release)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            appimages = executor.submit(appimage_search.run)
+            self._wine_binary_files = binary_search.run()
+            self._wine_appimage_files = appimages.result()
+
     @property
     def wine_binary_code(self) -> str:
         """Wine binary code.
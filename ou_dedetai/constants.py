@@ -72,6 +72,11 @@ DEFAULT_CONFIG_PATH = os.path.expanduser(f"{CONFIG_DIR}/{BINARY_NAME}.json")
 DEFAULT_APP_WINE_LOG_PATH = os.path.expanduser(f"{STATE_DIR}/wine.log")
 DEFAULT_APP_LOG_PATH = os.path.expanduser(f"{STATE_DIR}/{BINARY_NAME}.log")
 NETWORK_CACHE_PATH = f"{CACHE_DIR}/network.json"
+VERIFIED_FILES_PATH = f"{CACHE_DIR}/verified.json"
+DOWNLOAD_STORE_DIR = f"{CACHE_DIR}/store"
+"""Verified downloads keyed by their content, see network.logos_reuse_download"""
+WINE_RELEASES_CACHE_PATH = f"{CACHE_DIR}/wine_releases.json"
+"""Parsed `wine --version` of every binary we've checked, see wine.get_wine_release"""
 
 RELATIVE_BINARY_DIR = "data/bin"
 
@@ -3,6 +3,7 @@ They can be called from CLI, GUI, or TUI.
 """
 
 import copy
+from dataclasses import asdict
 import glob
 import json
 import logging
@@ -15,6 +16,7 @@ import webbrowser
 from zipfile import ZipFile
 
 from ou_dedetai import constants
+from ou_dedetai import database
 from ou_dedetai import system
 from ou_dedetai.app import App
 
@@ -200,11 +202,23 @@ def get_support(app: App) -> str:
         context_to_write["STATE_DIR"] = constants.STATE_DIR
 
         context_to_write["network_cache"] = app.conf._network._cache._as_dict()
+        context_to_write["connection_stats"] = app.conf._network.connection_stats()
         context_to_write["ephemeral_config"] = app.conf._overrides.__dict__
         context_to_write["persistent_config"] = app.conf._raw._as_dict()
 
         zip.writestr("context.json", json.dumps(context_to_write, indent=4))
 
+        if (
+            app.conf._logos_appdata_dir is not None
+            and Path(app.conf._logos_appdata_dir).exists()
+        ):
+            app.status("Checking Logos databases", percent=90)
+            try:
+                report = database.check_databases(app.conf._logos_appdata_dir)
+                zip.writestr("database_health.json", json.dumps(asdict(report), indent=4))
+            except Exception as e:
+                logging.debug(f"Failed to check Logos databases: {e}")
+
         app.status(f"Wrote support bundle to: {output_path}", percent=100)
 
         answer = app.ask(
@@ -1,10 +1,134 @@
 import abc
+import concurrent.futures
 import contextlib
+from dataclasses import dataclass, field
 import logging
+import os
 import sqlite3
+import threading
+import time
 import inotify.adapters # type: ignore
+import inotify.constants # type: ignore
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
+
+from . import utils
+
+DB_BUSY_TIMEOUT = 2.0
+"""Seconds to wait for Logos to release a lock before giving up on a statement"""
+
+STATEMENT_CACHE_SIZE = 64
+"""Prepared statements kept per connection, keyed by their SQL"""
+
+POOL_MAX_IDLE = 2
+"""Idle connections kept per database and mode"""
+
+
+def _uri(path: str | Path, read_only: bool, immutable: bool = False) -> str:
+    mode = "ro" if read_only else "rw"
+    uri = f"{Path(path).absolute().as_uri()}?mode={mode}"
+    if immutable:
+        uri += "&immutable=1"
+    return uri
+
+
+def _open(path: str | Path, read_only: bool, immutable: bool = False) -> sqlite3.Connection:
+    """Opens a database without creating it if it doesn't exist.
+
+    Read-only connections (mode=ro) never take a write lock. On a WAL
+    database readers don't block Logos' writers either.
+
+    Immutable connections take no locks at all, but don't see a WAL and
+    may read pages half written by someone else.
+    """
+    connection = sqlite3.connect(
+        _uri(path, read_only, immutable),
+        uri=True,
+        autocommit=True,
+        timeout=DB_BUSY_TIMEOUT,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    if read_only:
+        connection.execute("PRAGMA query_only=ON")
+    return connection
+
+
+@dataclass
+class PooledConnection:
+    path: str
+    read_only: bool
+    connection: sqlite3.Connection
+    inode: int
+    """Of the database file when this was opened, to notice it being replaced"""
+
+
+class ConnectionPool:
+    """Keeps connections to each database open for reuse.
+
+    Reusing a connection also reuses the statements it has already prepared.
+    Idle connections are in autocommit mode and hold no locks.
+    """
+
+    def __init__(self, max_idle: int = POOL_MAX_IDLE) -> None:
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle: dict[tuple[str, bool], list[PooledConnection]] = {}
+
+    def acquire(self, path: str | Path, read_only: bool = False) -> PooledConnection:
+        """Takes a connection out of the pool, opening one if needed.
+
+        Raises:
+            sqlite3.OperationalError: the database couldn't be opened
+        """
+        path = os.path.abspath(path)
+        try:
+            inode = os.stat(path).st_ino
+        except OSError as e:
+            raise sqlite3.OperationalError(f"unable to open database file {path}: {e}") from e
+        with self._lock:
+            idle = self._idle.get((path, read_only), [])
+            while idle:
+                pooled = idle.pop()
+                if pooled.inode == inode:
+                    return pooled
+                # The database was replaced since (e.g. restored from a backup)
+                pooled.connection.close()
+        return PooledConnection(path, read_only, _open(path, read_only), inode)
+
+    def release(self, pooled: PooledConnection) -> None:
+        """Puts a connection back in the pool"""
+        try:
+            if pooled.connection.in_transaction:
+                pooled.connection.rollback()
+        except sqlite3.Error:
+            pooled.connection.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault((pooled.path, pooled.read_only), [])
+            if len(idle) < self.max_idle:
+                idle.append(pooled)
+                return
+        pooled.connection.close()
+
+    @contextlib.contextmanager
+    def connection(self, path: str | Path, read_only: bool = False) -> Iterator[sqlite3.Connection]:
+        pooled = self.acquire(path, read_only)
+        try:
+            yield pooled.connection
+        finally:
+            self.release(pooled)
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle = [pooled for connections in self._idle.values() for pooled in connections]
+            self._idle.clear()
+        for pooled in idle:
+            pooled.connection.close()
+
+
+pool = ConnectionPool()
+"""Shared by everything that opens Logos' databases"""
 
 
 class FaithlifeDatabase(contextlib.AbstractContextManager):
@@ -14,15 +138,20 @@ class FaithlifeDatabase(contextlib.AbstractContextManager):
 
     logos_app_dir: Path
     logos_user_id: str
+    read_only: bool
     _db: Optional[sqlite3.Connection]
 
     def __init__(
         self,
         logos_app_dir: Path,
-        logos_user_id: str
+        logos_user_id: str,
+        read_only: bool = False,
     ):
         self.logos_app_dir = logos_app_dir
         self.logos_user_id = logos_user_id
+        self.read_only = read_only
+        self._db = None
+        self._pooled: Optional[PooledConnection] = None
 
     @abc.abstractmethod
     def _database_path(self) -> Path:
@@ -55,20 +184,21 @@ class FaithlifeDatabase(contextlib.AbstractContextManager):
         return self._db
 
     def _connect(self) -> sqlite3.Connection:
-        return sqlite3.connect(str(self._database_path()), autocommit=True)
+        self._pooled = pool.acquire(self._database_path(), self.read_only)
+        return self._pooled.connection
 
     def close(self):
-        if self._db:
-            self._db.close()
+        if self._pooled:
+            pool.release(self._pooled)
+            self._pooled = None
+        self._db = None
 
     def __enter__(self):
         self._db = self._connect()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if self._db:
-            self._db.__exit__(exc_type, exc_value, traceback)
-            self._db = None
+        self.close()
 
 
 class LocalUserPreferencesManager(FaithlifeDatabase):
@@ -94,59 +224,423 @@ class LocalUserPreferencesManager(FaithlifeDatabase):
         return self
 
 
-# FIXME: refactor into FaithlifeDatabase class
-def watch_db(path: str, sql_statements: list[str]):
-    """Runs SQL statements against a sqlite db once to start with, then again every time
-    The sqlite db is written to.
-    
-    Handles -wal/-shm as well
+WATCH_QUIET_PERIOD = 1.0
+"""Seconds without writes to a watched database before its SQL is re-applied.
+
+Logos writes a database in bursts of page writes, this handles a burst once"""
+
+WATCH_MAX_DELAY = 5.0
+"""Longest a re-application is put off while writes keep coming"""
+
+WATCH_IDLE_WAKEUP = 1.0
+"""Seconds between checks for unregistered databases when nothing is pending"""
+
+_WRITE_EVENTS = {'IN_MODIFY', 'IN_CLOSE_WRITE', 'IN_CREATE', 'IN_MOVED_TO'}
+_DB_SUFFIXES = ("-wal", "-shm", "-journal")
+
+
+@dataclass
+class ConditionalStatement:
+    """A statement that only runs if a read-only query says it has something to do.
+
+    Checking first means we only take the write lock on a database Logos is
+    using when something actually needs fixing."""
+    statement: str
+    needed: str
+    """Query returning at least one row if the statement has work to do"""
+
+
+@dataclass
+class _WatchedDatabase:
+    path: str
+    sql_statements: list[str | ConditionalStatement]
+    pooled: PooledConnection
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    first_write: Optional[float] = None
+    """When the first write we haven't handled yet was seen"""
+    due: Optional[float] = None
+    """When to re-apply the SQL (time.monotonic())"""
+    released: bool = False
+    """The connection went back to the pool, so it's no longer ours to use"""
+    data_version: Optional[int] = None
+    """PRAGMA data_version right after we last applied the SQL.
+
+    It changes only when another connection commits, so our own writes
+    don't make us apply again"""
+
+
+class DatabaseWatcher:
+    """Re-applies SQL to sqlite databases every time something else writes to them.
 
-    This function may run infinitely, spawn it on it's own thread
+    All databases share one inotify instance (one fd, waited on with epoll)
+    and one thread. The thread exits once nothing is being watched.
+
+    The directory containing each database is watched, so -wal/-shm files
+    are picked up even if they don't exist yet.
     """
-    # Silence inotify logs
-    logging.getLogger('inotify').setLevel(logging.CRITICAL)
-    i = inotify.adapters.Inotify()
-    i.add_watch(path)
-
-    def execute_sql(cur):
-        # logging.debug(f"Executing SQL against {path}: {sql_statements}")
-        for statement in sql_statements:
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._watched: dict[int, _WatchedDatabase] = {}
+        self._dirs: dict[str, set[int]] = {}
+        """Watched directory -> databases in it"""
+        self._next_handle = 1
+        self._inotify: Optional[inotify.adapters.Inotify] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, path: str, sql_statements: list[str | ConditionalStatement]) -> int:
+        """Runs the SQL statements once now, then again after every write to the database.
+
+        Returns:
+            Handle to pass to unregister
+
+        Raises:
+            FileNotFoundError: the database doesn't exist
+        """
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No database at {path}")
+        # Kept for as long as we watch, data_version is per connection
+        pooled = pool.acquire(path)
+        watched = _WatchedDatabase(path, sql_statements, pooled)
+        self._apply(watched)
+        directory = os.path.dirname(path)
+        with self._lock:
+            if self._inotify is None:
+                # Silence inotify logs
+                logging.getLogger('inotify').setLevel(logging.CRITICAL)
+                self._inotify = inotify.adapters.Inotify(block_duration_s=self._block_duration)
+            if directory not in self._dirs:
+                mask = (
+                    inotify.constants.IN_MODIFY | inotify.constants.IN_CLOSE_WRITE
+                    | inotify.constants.IN_CREATE | inotify.constants.IN_MOVED_TO
+                )
+                self._inotify.add_watch(directory, mask)
+                self._dirs[directory] = set()
+            handle = self._next_handle
+            self._next_handle += 1
+            self._watched[handle] = watched
+            self._dirs[directory].add(handle)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="watch_db", daemon=True)
+                self._thread.start()
+        logging.debug(f"Watching {path}")
+        return handle
+
+    def unregister(self, handle: int) -> None:
+        """Stops watching a database. Its SQL won't be run again"""
+        with self._lock:
+            watched = self._watched.pop(handle, None)
+            if watched is None:
+                return
+            directory = os.path.dirname(watched.path)
+            self._dirs[directory].discard(handle)
+            if not self._dirs[directory] and self._inotify is not None:
+                del self._dirs[directory]
+                self._inotify.remove_watch(directory)
+        with watched.lock:
+            watched.released = True
+            pool.release(watched.pooled)
+        logging.debug(f"Stopped watching {watched.path}")
+
+    def _block_duration(self) -> float:
+        """How long the event loop may wait for the next event"""
+        with self._lock:
+            due = [w.due for w in self._watched.values() if w.due is not None]
+        if not due:
+            return WATCH_IDLE_WAKEUP
+        return min(max(min(due) - time.monotonic(), 0.01), WATCH_IDLE_WAKEUP)
+
+    def _run(self) -> None:
+        assert self._inotify is not None
+        while True:
             try:
-                cur.execute(statement)
-            # Database may be locked, keep trying later.
-            except sqlite3.OperationalError:
-                logging.exception("Best-effort db update failed")
-                pass
-
-    with sqlite3.connect(path, autocommit=True) as con:
-        cur = con.cursor()
-
-        # Execute once before we start the loop
-        execute_sql(cur)
-        swallow_one = True
-
-        # Keep track of if we've added -wal and -shm are added yet
-        # They may not exist when we start
-        watching_wal_and_shm = False
-        for event in i.event_gen(yield_nones=False):
-            (_, type_names, _, _) = event
-            # These files may not exist when it's executes for the first time
-            if (
-                not watching_wal_and_shm
-                and Path(path + "-wal").exists()
-                and Path(path + "-shm").exists()
-            ):
-                i.add_watch(path + "-wal")
-                i.add_watch(path + "-shm")
-                watching_wal_and_shm = True
-
-            if 'IN_MODIFY' in type_names or 'IN_CLOSE_WRITE' in type_names:
-                # Check to make sure that we aren't responding to our own write
-                if swallow_one:
-                    swallow_one = False
+                for event in self._inotify.event_gen(yield_nones=True):
+                    if event is not None:
+                        _, type_names, directory, filename = event
+                        if _WRITE_EVENTS.intersection(type_names):
+                            self._mark_written(os.path.join(directory, filename))
+                    with self._lock:
+                        if not self._watched:
+                            self._thread = None
+                            return
+                    self._apply_due()
+            except inotify.adapters.TerminalEventException as e:
+                # Events were dropped, so we can't tell what was written
+                logging.warning(f"Database watch lost events ({e}), re-checking all databases")
+                with self._lock:
+                    for watched in self._watched.values():
+                        watched.due = time.monotonic()
+
+    def _mark_written(self, file_path: str) -> None:
+        db_path = file_path
+        for suffix in _DB_SUFFIXES:
+            if file_path.endswith(suffix):
+                db_path = file_path[:-len(suffix)]
+        now = time.monotonic()
+        with self._lock:
+            for watched in self._watched.values():
+                if watched.path != db_path:
                     continue
-                execute_sql(cur)
-                swallow_one = True
-        # Shouldn't be possible to get here, but on the off-chance it happens, 
-        # we'd like to know and cleanup
-        logging.debug(f"Stopped watching {path}")
+                if watched.first_write is None:
+                    watched.first_write = now
+                watched.due = min(now + WATCH_QUIET_PERIOD, watched.first_write + WATCH_MAX_DELAY)
+
+    def _apply_due(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            due = [w for w in self._watched.values() if w.due is not None and w.due <= now]
+            for watched in due:
+                watched.due = None
+                watched.first_write = None
+        for watched in due:
+            self._apply(watched)
+
+    def _apply(self, watched: _WatchedDatabase) -> None:
+        with watched.lock:
+            if watched.released:
+                return
+            try:
+                data_version = _data_version(watched.pooled.connection)
+                if data_version == watched.data_version:
+                    # Nothing else has committed since we last applied
+                    return
+                # logging.debug(f"Executing SQL against {watched.path}: {watched.sql_statements}")
+                for statement in watched.sql_statements:
+                    if isinstance(statement, ConditionalStatement):
+                        if watched.pooled.connection.execute(statement.needed).fetchone() is None:
+                            continue
+                        statement = statement.statement
+                    logging.debug(f"Fixing up {watched.path}: {statement}")
+                    watched.pooled.connection.execute(statement)
+                # Our own writes don't change it, so this is still the version
+                # after the last commit by someone else
+                watched.data_version = data_version
+            # Database may be locked (or we were unregistered), keep trying later.
+            except (sqlite3.OperationalError, sqlite3.ProgrammingError):
+                logging.exception("Best-effort db update failed")
+                with self._lock:
+                    watched.due = time.monotonic() + WATCH_QUIET_PERIOD
+
+
+def _data_version(connection: sqlite3.Connection) -> int:
+    return int(connection.execute("PRAGMA data_version").fetchone()[0])
+
+
+_watcher = DatabaseWatcher()
+
+
+def watch_db(path: str, sql_statements: list[str | ConditionalStatement]) -> int:
+    """Runs SQL statements against a sqlite db once to start with, then again every time
+    the sqlite db is written to (including its -wal/-shm)
+
+    Returns:
+        Handle to pass to unwatch_db
+    """
+    return _watcher.register(path, sql_statements)
+
+
+def unwatch_db(handle: int) -> None:
+    _watcher.unregister(handle)
+
+
+DB_SCAN_WORKERS = 8
+"""Databases checked at once by check_databases"""
+
+DB_SCAN_TIMEOUT = 10.0
+"""Seconds one database may take to check before it's interrupted"""
+
+QUICK_CHECK_MAX_ERRORS = 20
+"""Problems PRAGMA quick_check lists before it stops looking"""
+
+DATABASE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+"""File extensions worth opening to see if they're sqlite databases"""
+
+_SQLITE_MAGIC = b"SQLite format 3\x00"
+
+
+@dataclass
+class OrphanCheck:
+    description: str
+    query: str
+    """Counts the rows that point at something that doesn't exist"""
+    attach: Optional[tuple[str, str]] = None
+    """(schema name, path relative to the database's directory) of another
+    database the query reads from"""
+
+
+ORPHAN_CHECKS: dict[str, list[OrphanCheck]] = {
+    "Updates.db": [
+        OrphanCheck(
+            "UpdateUrls without an Update",
+            "SELECT COUNT(*) FROM UpdateUrls WHERE UpdateId NOT IN (SELECT UpdateId FROM Updates)",
+        ),
+        OrphanCheck(
+            "Updates without UpdateUrls",
+            "SELECT COUNT(*) FROM Updates WHERE UpdateId NOT IN (SELECT UpdateId FROM UpdateUrls)",
+        ),
+        OrphanCheck(
+            "Resources with a missing UpdateId",
+            "SELECT COUNT(*) FROM Resources"
+            " WHERE UpdateId IS NOT NULL AND UpdateId NOT IN (SELECT UpdateId FROM Updates)",
+        ),
+    ],
+    # Logos crashes on startup if one of these isn't registered in UpdateManager
+    "CloudResources.db": [
+        OrphanCheck(
+            "TransitionStates for a resource UpdateManager doesn't have",
+            "SELECT COUNT(*) FROM TransitionStates"
+            " WHERE ResourceId NOT IN (SELECT ResourceId FROM updates.Resources)",
+            attach=("updates", "../UpdateManager/Updates.db"),
+        ),
+    ],
+}
+"""Database file name -> rows Logos is known to choke on"""
+
+
+@dataclass
+class DatabaseHealth:
+    path: str
+    wal: bool
+    """Whether the database is in WAL mode, otherwise it was read without locking"""
+    quick_check: list[str] = field(default_factory=list)
+    """Problems PRAGMA quick_check found"""
+    orphans: dict[str, int] = field(default_factory=dict)
+    """Orphan check description -> rows found, only for checks that found some"""
+    skipped: list[str] = field(default_factory=list)
+    """Orphan checks that couldn't run, e.g. the table doesn't exist"""
+    error: Optional[str] = None
+    """Why the database couldn't be checked"""
+    seconds: float = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return self.error is None and not self.quick_check and not self.orphans
+
+
+@dataclass
+class DatabaseHealthReport:
+    root: str
+    databases: list[DatabaseHealth]
+    seconds: float
+
+    @property
+    def problems(self) -> list[DatabaseHealth]:
+        return [d for d in self.databases if not d.healthy]
+
+
+def find_databases(root: str | Path) -> list[Path]:
+    """Files under root that may be sqlite databases, by extension"""
+    scan = utils.scan_tree([Path(root)])
+    return sorted(
+        f.path for f in scan.files
+        if f.path.suffix.lower() in DATABASE_SUFFIXES
+    )
+
+
+def _is_wal(path: str | Path) -> Optional[bool]:
+    """Reads the database header.
+
+    Returns:
+        Whether the database is in WAL mode, None if it isn't a sqlite database
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(20)
+    except OSError:
+        return None
+    if len(header) < 20 or not header.startswith(_SQLITE_MAGIC):
+        return None
+    # File format read/write versions are 2 in WAL mode
+    return header[18] == 2
+
+
+def check_database(path: str | Path, timeout: float = DB_SCAN_TIMEOUT) -> Optional[DatabaseHealth]:
+    """Runs PRAGMA quick_check and the ORPHAN_CHECKS for this file name.
+
+    Never locks the database against Logos. WAL databases are opened read
+    only, readers don't block writers there. Other databases are opened
+    immutable, which takes no locks but can report problems that are really
+    a write in progress, so check again with Logos closed before acting.
+
+    Returns:
+        None if path isn't a sqlite database
+    """
+    wal = _is_wal(path)
+    if wal is None:
+        return None
+    start = time.monotonic()
+    health = DatabaseHealth(str(path), wal)
+    try:
+        connection = _open(path, read_only=True, immutable=not wal)
+    except sqlite3.Error as e:
+        health.error = str(e)
+        return health
+    deadline = start + timeout
+    # Checked every thousand VM instructions, interrupts the running statement
+    connection.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+    try:
+        rows = connection.execute(f"PRAGMA quick_check({QUICK_CHECK_MAX_ERRORS})").fetchall()
+        health.quick_check = [row[0] for row in rows if row[0] != "ok"]
+        for check in ORPHAN_CHECKS.get(Path(path).name, []):
+            try:
+                if check.attach is not None:
+                    name, relative_path = check.attach
+                    attached = Path(path).parent / relative_path
+                    attached_wal = _is_wal(attached)
+                    if attached_wal is None:
+                        raise sqlite3.OperationalError(f"no database at {attached}")
+                    uri = _uri(attached.resolve(), read_only=True, immutable=not attached_wal)
+                    connection.execute(f"ATTACH DATABASE ? AS {name}", [uri])
+                try:
+                    count = int(connection.execute(check.query).fetchone()[0])
+                finally:
+                    if check.attach is not None:
+                        connection.execute(f"DETACH DATABASE {check.attach[0]}")
+            except sqlite3.OperationalError as e:
+                if time.monotonic() > deadline:
+                    raise
+                logging.debug(f"Skipping {check.description} in {path}: {e}")
+                health.skipped.append(check.description)
+                continue
+            if count:
+                health.orphans[check.description] = count
+    except sqlite3.Error as e:
+        if time.monotonic() > deadline:
+            health.error = f"timed out after {timeout}s"
+        else:
+            health.error = str(e)
+    finally:
+        connection.close()
+        health.seconds = time.monotonic() - start
+    return health
+
+
+def check_databases(
+    root: str | Path,
+    max_workers: int = DB_SCAN_WORKERS,
+    timeout: float = DB_SCAN_TIMEOUT,
+) -> DatabaseHealthReport:
+    """Checks every sqlite database under root (e.g. the Logos appdata dir).
+
+    Databases are checked in parallel, sqlite releases the GIL while it reads.
+    Safe to run while Logos is running, see check_database.
+    """
+    start = time.monotonic()
+    paths = find_databases(root)
+    databases = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for health in executor.map(lambda p: check_database(p, timeout), paths):
+            if health is not None:
+                databases.append(health)
+    report = DatabaseHealthReport(str(root), databases, time.monotonic() - start)
+    for health in report.problems:
+        logging.warning(
+            f"Database {health.path} has problems: "
+            f"{health.error or health.quick_check or health.orphans}"
+        )
+    logging.info(
+        f"Checked {len(report.databases)} database(s) under {root} "
+        f"in {report.seconds:.1f}s, {len(report.problems)} with problems"
+    )
+    return report
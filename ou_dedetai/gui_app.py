@@ -3,7 +3,6 @@
 #   - https://tkdocs.com/
 #   - https://github.com/thw26/LogosLinuxInstaller/blob/master/LogosLinuxInstaller.sh
 
-import copy
 import logging
 from pathlib import Path
 from queue import Queue
@@ -461,20 +460,8 @@ class ControlWindow(GuiApp):
             control_gui.update_product_labelvar.set(f"Update {self.conf._raw.faithlife_product}")
 
         # Spawn a thread to ensure our logos state stays up to date
-        def _monitor_faithlife_product_pids():
-            last_state = copy.copy(self.logos.logos_state)
-            while True:
-                if self.is_installed():
-                    self.logos.monitor()
-                    time.sleep(1)
-                else:
-                    # Will probably be some time before we need to monitor.
-                    time.sleep(30)
-                # If our state changed, we need to update our button.
-                if last_state != self.logos.logos_state:
-                    self.update_app_button()
-                last_state = copy.copy(self.logos.logos_state)
-        self.start_thread(_monitor_faithlife_product_pids)
+        # If our state changed, we need to update our button.
+        self.start_thread(self.logos.watch, self.update_app_button)
         self.gui.update_lli_label.config(text=text)
         self.gui.run_indexing_radio.config(
             command=self.on_action_radio_clicked
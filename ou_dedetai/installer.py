@@ -1,10 +1,14 @@
+from dataclasses import dataclass, field
+import json
 import logging
 import os
 import shutil
 import subprocess
 import sys
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
 from ou_dedetai.app import App, UserExitedFromAsk
 
@@ -19,7 +23,6 @@ from ou_dedetai.system import OpenGLIncompatible
 # This step doesn't do anything per-say, but "collects" all the choices in one step
 # The app would continue to work without this function
 def ensure_choices(app: App):
-    app.installer_step_count += 1
 
     app.status("Asking questions if needed…")
 
@@ -39,12 +42,12 @@ def ensure_choices(app: App):
     # Debug print the entire config
     logging.debug(f"> Config={app.conf.__dict__}")
 
+    # Now that the choices are settled we know all of the urls
+    prefetch_downloads(app)
+
     app.status("Install is running…")
 
 def ensure_install_dirs(app: App):
-    app.installer_step_count += 1
-    ensure_choices(app=app)
-    app.installer_step += 1
     app.status("Ensuring installation directories…")
     wine_dir = Path("")
 
@@ -63,9 +66,6 @@ def ensure_install_dirs(app: App):
 
 
 def ensure_sys_deps(app: App):
-    app.installer_step_count += 1
-    ensure_install_dirs(app=app)
-    app.installer_step += 1
     app.status("Ensuring system dependencies are met…")
 
     if not app.conf.skip_install_system_dependencies:
@@ -192,21 +192,19 @@ def check_system_compatibility(app: App):
     check_opengl(app=app)
 
 
-def ensure_appimage_download(app: App):
-    app.installer_step_count += 1
-    ensure_sys_deps(app=app)
-    check_system_compatibility(app=app)
-    app.installer_step += 1
+def get_appimage_download(app: App) -> Optional[tuple[str, str]]:
+    """Which wine AppImage the install needs, if any
 
+    Returns:
+        (download url, file name) or None if wine isn't an AppImage
+    """
     if (
         app.conf.faithlife_product_version != '9'
         and not str(app.conf.wine_binary).lower().endswith('appimage')
         and app.conf.wine_binary not in [constants.WINE_RECOMMENDED_SIGIL, constants.WINE_BETA_SIGIL]
     ):
-        return
-    app.status("Ensuring wine AppImage is downloaded…")
+        return None
 
-    downloaded_file = None
     appimage_path = app.conf.wine_appimage_recommended_file_name 
     download_url = app.conf.wine_appimage_recommended_url
 
@@ -236,10 +234,43 @@ def ensure_appimage_download(app: App):
         appimage_path = app.conf.wine_appimage_recommended_file_name
         download_url = app.conf.wine_appimage_recommended_url
     else:
-        logging.warning("Could not find which appimage to download, returning early.")
+        logging.warning("Could not find which appimage to download.")
+        return None
+
+    return download_url, Path(appimage_path).name
+
+
+def prefetch_downloads(app: App):
+    """Starts downloading everything the install needs in the background.
+
+    The steps that use these files wait on the download rather than starting it,
+    so network time overlaps with wineboot, registry setup, fonts, etc.
+    """
+    downloads = [wine.get_icu_download(app)]
+    if not _product_installer_exists(app):
+        downloads.append((app.conf.faithlife_installer_download_url, app.conf.faithlife_installer_name))
+    # NOTE: check_system_compatibility may still switch to the beta AppImage.
+    # If so ensure_appimage_download cancels this one.
+    appimage = get_appimage_download(app)
+    if appimage is not None:
+        downloads.insert(0, appimage)
+    for url, filename in downloads:
+        network.prefetch(url, filename, app)
+
+
+def ensure_appimage_download(app: App):
+    prefetched = get_appimage_download(app)
+    check_system_compatibility(app=app)
+
+    appimage = get_appimage_download(app)
+    if prefetched is not None and prefetched != appimage:
+        # check_for_known_bugs switched wine, so that download isn't needed
+        network.cancel_prefetch(*prefetched)
+    if appimage is None:
         return
+    app.status("Ensuring wine AppImage is downloaded…")
+    download_url, filename = appimage
 
-    filename = Path(appimage_path).name
     downloaded_file = utils.get_downloaded_file_path(app.conf.download_dir, filename)
     if not downloaded_file:
         downloaded_file = f"{app.conf.download_dir}/{filename}"
@@ -255,9 +286,6 @@ def ensure_appimage_download(app: App):
 
 
 def ensure_wine_executables(app: App):
-    app.installer_step_count += 1
-    ensure_appimage_download(app=app)
-    app.installer_step += 1
     app.status("Ensuring wine executables are available…")
 
     create_wine_appimage_symlinks(app=app)
@@ -271,9 +299,6 @@ def ensure_wine_executables(app: App):
 
 
 def ensure_winetricks_executable(app: App):
-    app.installer_step_count += 1
-    ensure_wine_executables(app=app)
-    app.installer_step += 1
     app.status("Ensuring winetricks executable is available…")
 
     system.ensure_winetricks(app=app)
@@ -282,9 +307,6 @@ def ensure_winetricks_executable(app: App):
 
 
 def ensure_product_installer_download(app: App):
-    app.installer_step_count += 1
-    ensure_winetricks_executable(app=app)
-    app.installer_step += 1
     app.status(f"Ensuring {app.conf.faithlife_product} installer is downloaded…")
 
     downloaded_file = utils.get_downloaded_file_path(app.conf.download_dir, app.conf.faithlife_installer_name) 
@@ -299,15 +321,12 @@ def ensure_product_installer_download(app: App):
     # Copy file into install dir.
     installer = Path(f"{app.conf.install_dir}/data/{app.conf.faithlife_installer_name}")
     if not installer.is_file():
-        shutil.copy(downloaded_file, installer.parent)
+        utils.link_or_copy(downloaded_file, installer)
 
     logging.debug(f"> '{downloaded_file}' exists?: {Path(downloaded_file).is_file()}")
 
 
 def ensure_wineprefix_init(app: App):
-    app.installer_step_count += 1
-    ensure_product_installer_download(app=app)
-    app.installer_step += 1
     app.status("Ensuring wineprefix is initialized…")
 
     init_file = Path(f"{app.conf.wine_prefix}/system.reg")
@@ -322,38 +341,35 @@ def ensure_wineprefix_init(app: App):
     logging.debug(f"> {init_file} exists?: {init_file.is_file()}")
 
 
-def ensure_wineprefix_config(app: App):
-    app.installer_step_count += 1
-    ensure_wineprefix_init(app=app)
-    app.installer_step += 1
-    app.status("Ensuring wineprefix configuration…")
+def _wineprefix_config_registry(app: App) -> wine.RegistryTransaction:
+    # All of these are applied with a single regedit
+    registry = wine.RegistryTransaction()
 
     # Force winemenubuilder.exe='' in registry.
-    logging.debug("Setting wineprefix registry to ignore winemenubuilder.exe.")
-    wine.disable_winemenubuilder(app=app, wine64_binary=app.conf.wine64_binary)
+    wine.disable_winemenubuilder(app=app, wine64_binary=app.conf.wine64_binary, transaction=registry)
 
     # Force renderer=gdi in registry.
-    logging.debug("Setting renderer=gdi in wineprefix registry.")
-    wine.set_renderer(app=app, wine64_binary=app.conf.wine64_binary, value='gdi')
+    wine.set_renderer(app=app, wine64_binary=app.conf.wine64_binary, value='gdi', transaction=registry)
 
     # Force fontsmooth=rgb in registry.
-    logging.debug("Setting fontsmoothing=rgb in wineprefix registry.")
-    wine.set_fontsmoothing_to_rgb(app=app, wine64_binary=app.conf.wine64_binary)
+    wine.set_fontsmoothing_to_rgb(app=app, wine64_binary=app.conf.wine64_binary, transaction=registry)
+
+    return registry
+
+
+def ensure_wineprefix_config(app: App):
+    app.status("Ensuring wineprefix configuration…")
+    logging.debug("Setting winemenubuilder.exe='', renderer=gdi and fontsmoothing=rgb in wineprefix registry.")
+    _wineprefix_config_registry(app).apply(app, app.conf.wine64_binary, 'wineprefix-config.reg')
 
 
 def ensure_fonts(app: App):
     """Ensure the arial font is installed"""
-    app.installer_step_count += 1
-    ensure_wineprefix_config(app=app)
-    app.installer_step += 1
 
     wine.install_fonts(app)
 
 
 def ensure_icu_data_files(app: App):
-    app.installer_step_count += 1
-    ensure_fonts(app=app)
-    app.installer_step += 1
     app.status("Ensuring ICU data files are installed…")
     logging.debug('- ICU data files')
 
@@ -363,9 +379,6 @@ def ensure_icu_data_files(app: App):
 
 
 def ensure_product_installed(app: App):
-    app.installer_step_count += 1
-    ensure_icu_data_files(app=app)
-    app.installer_step += 1
     app.status(f"Ensuring {app.conf.faithlife_product} is installed…")
 
     try:
@@ -395,18 +408,12 @@ def ensure_product_installed(app: App):
 
 
 def ensure_config_file(app: App):
-    app.installer_step_count += 1
-    ensure_product_installed(app=app)
-    app.installer_step += 1
     app.status("Ensuring config file is up-to-date…")
 
     app.status("Install has finished.", 100)
 
 
 def ensure_launcher_executable(app: App):
-    app.installer_step_count += 1
-    ensure_config_file(app=app)
-    app.installer_step += 1
     if constants.RUNMODE == 'binary':
         app.status(f"Copying launcher to {app.conf.install_dir}…")
 
@@ -425,9 +432,6 @@ def ensure_launcher_executable(app: App):
 
 
 def ensure_launcher_shortcuts(app: App):
-    app.installer_step_count += 1
-    ensure_launcher_executable(app=app)
-    app.installer_step += 1
     app.status("Creating launcher shortcuts…")
     if constants.RUNMODE == 'binary':
         app.status("Creating launcher shortcuts…")
@@ -439,12 +443,261 @@ def ensure_launcher_shortcuts(app: App):
         )
 
 
+@dataclass
+class InstallStep:
+    """One step of the install"""
+    name: str
+    run: Callable[[App], None]
+    requires: list[str] = field(default_factory=list)
+    """Names of the steps that must run before this one, checked against the order of the steps"""
+    is_done: Optional[Callable[[App], bool]] = None
+    """Returns True if the step's outputs are already in place and it can be skipped"""
+    fingerprint: Optional[Callable[[App], dict]] = None
+    """Returns the step's inputs.
+
+    If they match what was recorded in the InstallLedger the last time the step
+    succeeded, the step is skipped.
+    """
+    outputs: Optional[Callable[[App], Optional[list[Path]]]] = None
+    """Returns the files the step put in place, or None if its outcome isn't there.
+
+    Checked after the step ran, its fingerprint is only recorded if the outcome
+    is in place. The files are recorded with it, if one goes missing the step
+    runs again.
+    """
+    downloads: Optional[Callable[[App], list[tuple[str, str]]]] = None
+    """(url, file name) of what the step downloads, prefetches of them are
+    cancelled if the step is skipped"""
+
+
+class InstallLedger:
+    """Fingerprints of the inputs and the output files of every install step that completed.
+
+    Stored per install so re-running the installer doesn't redo work
+    (spawning wine, winetricks, etc.) that is already done.
+    """
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._steps: dict[str, dict] = {}
+        if path.is_file():
+            try:
+                self._steps = json.loads(path.read_text())
+            except (OSError, json.JSONDecodeError):
+                logging.warning(f"Failed to read install ledger: {path}. Clearing…")
+
+    @staticmethod
+    def for_app(app: App) -> "InstallLedger":
+        return InstallLedger(Path(app.conf.install_dir) / "data" / "install_steps.json")
+
+    def is_current(self, name: str, fingerprint: dict) -> bool:
+        with self._lock:
+            recorded = self._steps.get(name)
+        if recorded is None or recorded.get("inputs") != fingerprint:
+            return False
+        return all(os.path.exists(output) for output in recorded.get("outputs", []))
+
+    def record(self, name: str, fingerprint: dict, outputs: list[Path]):
+        with self._lock:
+            self._steps[name] = {
+                "inputs": fingerprint,
+                "outputs": sorted(str(output) for output in outputs),
+            }
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump(self._steps, f, indent=4, sort_keys=True)
+                f.write("\n")
+
+
+def _install_dirs_exist(app: App) -> bool:
+    return Path(app.conf.installer_binary_dir).is_dir() and Path(app.conf.wine_prefix).is_dir()
+
+
+def _winetricks_exists(app: App) -> bool:
+    return (Path(app.conf.installer_binary_dir) / "winetricks").exists()
+
+
+def _product_installer_exists(app: App) -> bool:
+    return Path(f"{app.conf.install_dir}/data/{app.conf.faithlife_installer_name}").is_file()
+
+
+def _wineprefix_exists(app: App) -> bool:
+    return Path(f"{app.conf.wine_prefix}/system.reg").is_file()
+
+
+def _wineprefix_fingerprint(app: App) -> dict:
+    return {
+        "wine_prefix": app.conf.wine_prefix,
+        # A deleted and re-created prefix has a new inode
+        "wine_prefix_inode": os.stat(app.conf.wine_prefix).st_ino,
+        # Resolves AppImage symlinks, so a new wine version invalidates it as well
+        "wine64_binary": os.path.realpath(app.conf.wine64_binary),
+    }
+
+
+def _wineprefix_config_fingerprint(app: App) -> dict:
+    return {
+        **_wineprefix_fingerprint(app),
+        "winemenubuilder": "disabled",
+        "renderer": "gdi",
+        "fontsmoothing": "rgb",
+    }
+
+
+def _fonts_fingerprint(app: App) -> dict:
+    return {**_wineprefix_fingerprint(app), "fonts": wine.REQUIRED_FONTS}
+
+
+def _icu_data_files_fingerprint(app: App) -> dict:
+    return {**_wineprefix_fingerprint(app), "icu": app.conf.icu_latest_version}
+
+
+def _wineprefix_config_outputs(app: App) -> Optional[list[Path]]:
+    # Read the values back, regedit doesn't fail on edits it couldn't make
+    if not _wineprefix_config_registry(app).is_applied(app):
+        return None
+    return [Path(app.conf.wine_prefix) / "user.reg"]
+
+
+def _icu_data_files_outputs(app: App) -> Optional[list[Path]]:
+    files = wine.get_icu_data_files(app)
+    # The archive is extracted without checking for errors
+    if not files or not all(file.exists() for file in files):
+        return None
+    return files
+
+
+INSTALL_STEPS: list[InstallStep] = [
+    InstallStep("choices", ensure_choices),
+    InstallStep("install_dirs", ensure_install_dirs, ["choices"], _install_dirs_exist),
+    InstallStep("sys_deps", ensure_sys_deps, ["install_dirs"]),
+    InstallStep("appimage_download", ensure_appimage_download, ["sys_deps"]),
+    InstallStep("wine_executables", ensure_wine_executables, ["appimage_download"]),
+    InstallStep("winetricks_executable", ensure_winetricks_executable, ["wine_executables"], _winetricks_exists),
+    InstallStep(
+        "product_installer_download",
+        ensure_product_installer_download,
+        ["install_dirs"],
+        _product_installer_exists,
+        downloads=lambda app: [(app.conf.faithlife_installer_download_url, app.conf.faithlife_installer_name)]
+    ),
+    InstallStep("wineprefix_init", ensure_wineprefix_init, ["wine_executables"], _wineprefix_exists),
+    InstallStep(
+        "wineprefix_config",
+        ensure_wineprefix_config,
+        ["wineprefix_init"],
+        fingerprint=_wineprefix_config_fingerprint,
+        outputs=_wineprefix_config_outputs
+    ),
+    # winetricks runs wine, wait until we're done editing the registry
+    InstallStep(
+        "fonts",
+        ensure_fonts,
+        ["wineprefix_config", "winetricks_executable"],
+        fingerprint=_fonts_fingerprint,
+        outputs=wine.get_installed_font_files
+    ),
+    InstallStep(
+        "icu_data_files",
+        ensure_icu_data_files,
+        ["wineprefix_init"],
+        fingerprint=_icu_data_files_fingerprint,
+        outputs=_icu_data_files_outputs,
+        downloads=lambda app: [wine.get_icu_download(app)]
+    ),
+    InstallStep(
+        "product_installed",
+        ensure_product_installed,
+        ["fonts", "icu_data_files", "product_installer_download"]
+    ),
+    InstallStep("config_file", ensure_config_file, ["product_installed"]),
+    InstallStep("launcher_executable", ensure_launcher_executable, ["config_file"]),
+    InstallStep("launcher_shortcuts", ensure_launcher_shortcuts, ["launcher_executable"]),
+]
+"""Every step of the install and what it depends on"""
+
+
+def run_install_steps(app: App, steps: list[InstallStep]) -> dict[str, float]:
+    """Runs steps one after another on the caller's thread, in the order given.
+
+    Steps prompt the user and write app.conf, so they never run at the same
+    time. The downloads they need are prefetched in the background once the
+    choices are made (see prefetch_downloads), that's the only work that
+    overlaps with them.
+
+    Raises:
+        ValueError - if a step is listed before a step it requires
+
+    Returns:
+        Seconds each step took (0 if it was skipped)
+    """
+    names = {step.name for step in steps}
+    listed: set[str] = set()
+    for step in steps:
+        for requirement in step.requires:
+            if requirement not in names:
+                raise ValueError(f"Install step {step.name} requires unknown step {requirement}")
+            if requirement not in listed:
+                raise ValueError(f"Install step {step.name} is listed before {requirement}, which it requires")
+        listed.add(step.name)
+
+    app.installer_step_count = len(steps)
+    app.installer_step = 0
+    timings: dict[str, float] = {}
+    ledger: Optional[InstallLedger] = None
+
+    def get_ledger() -> InstallLedger:
+        # The install dir isn't known until the choices step has run
+        nonlocal ledger
+        if ledger is None:
+            ledger = InstallLedger.for_app(app)
+        return ledger
+
+    def skip(step: InstallStep) -> float:
+        if step.downloads is not None:
+            for url, file_name in step.downloads(app):
+                network.cancel_prefetch(url, file_name)
+        return 0.0
+
+    def run_step(step: InstallStep) -> float:
+        start = time.monotonic()
+        if step.is_done is not None and step.is_done(app):
+            logging.debug(f"Install step {step.name} is up to date, skipping.")
+            return skip(step)
+        fingerprint = step.fingerprint(app) if step.fingerprint is not None else None
+        if fingerprint is not None and get_ledger().is_current(step.name, fingerprint):
+            logging.debug(f"Install step {step.name} inputs are unchanged, skipping.")
+            return skip(step)
+        step.run(app)
+        if fingerprint is not None:
+            outputs = step.outputs(app) if step.outputs is not None else []
+            if outputs is None:
+                logging.warning(f"Install step {step.name} ran but its outcome isn't in place, not recording it.")
+            else:
+                get_ledger().record(step.name, fingerprint, outputs)
+        return time.monotonic() - start
+
+    for step in steps:
+        logging.debug(f"Starting install step: {step.name}")
+        timings[step.name] = run_step(step)
+        logging.debug(f"Finished install step {step.name} in {timings[step.name]:.2f}s")
+        app.installer_step += 1
+
+    logging.info(
+        "Install step timings: "
+        + ", ".join(f"{name}={seconds:.2f}s" for name, seconds in timings.items())
+    )
+    return timings
+
+
 def install(app: App):
     """Entrypoint for installing"""
     app.status('Installing…')
     try:
-        ensure_launcher_shortcuts(app)
+        run_install_steps(app, INSTALL_STEPS)
     except UserExitedFromAsk:
+        # The downloads were for the choices being reset
+        network.cancel_prefetches()
         # Reset choices, it's possible that the user didn't mean to select
         # one of the options they did - that is why they are exiting
         app.conf.faithlife_product = None  # type: ignore[assignment]
@@ -453,6 +706,7 @@ def install(app: App):
         app.conf.install_dir = None  # type: ignore[assignment]
         raise
     app.status("Install Complete!", 100)
+    network.prune_download_store()
     # Trigger a config update event to refresh the UIs
     app._config_updated_event.set()
 
@@ -486,7 +740,7 @@ def create_wine_appimage_symlinks(app: App):
         return
     if not appimage_file.exists():
         app.status(f"Copying: {downloaded_file} into: {appdir_bindir}")
-        shutil.copy(downloaded_file, appdir_bindir)
+        utils.link_or_copy(downloaded_file, appimage_file)
     os.chmod(appimage_file, 0o755)
     app.conf.wine_appimage_path = appimage_file
     app.conf.wine_binary = str(appimage_file)
@@ -1,12 +1,14 @@
 import os
 from pathlib import Path
 import signal
+import sqlite3
 import subprocess
 import time
 from enum import Enum
 import logging
 import psutil
 import threading
+from typing import Callable, Optional
 
 from ou_dedetai import constants, database
 from ou_dedetai.app import App
@@ -25,14 +27,85 @@ class State(Enum):
 
 
 class LogosManager:
+    DISCOVERY_INTERVAL = 5
+    """Seconds between looking for Logos processes started outside of us.
+
+    Exits of processes we know about are noticed immediately."""
+    STARTING_INTERVAL = 1
+    """Seconds between looking for the processes Logos spawns while starting"""
+
     def __init__(self, app: App):
-        self.logos_state = State.STOPPED
-        self.indexing_state = State.STOPPED
+        self._watcher = system.ProcessExitWatcher()
+        self._logos_state = State.STOPPED
+        self._indexing_state = State.STOPPED
         self.app = app
         self.processes: dict[str, subprocess.Popen] = {}
         """These are sub-processes we started"""
         self.existing_processes: dict[str, list[psutil.Process]] = {}
         """These are processes we discovered already running"""
+        self._db_watches: dict[str, int] = {}
+        """Databases we keep fixing up while Logos runs -> database.watch_db handle"""
+
+    @property
+    def logos_state(self) -> State:
+        return self._logos_state
+
+    @logos_state.setter
+    def logos_state(self, state: State):
+        if state != self._logos_state:
+            self._logos_state = state
+            self._watcher.wake()
+            if state == State.STOPPED:
+                self.unwatch_dbs()
+
+    @property
+    def indexing_state(self) -> State:
+        return self._indexing_state
+
+    @indexing_state.setter
+    def indexing_state(self, state: State):
+        if state != self._indexing_state:
+            self._indexing_state = state
+            self._watcher.wake()
+
+    def wait_for_change(self, timeout: Optional[float] = None) -> bool:
+        """Sleeps until a Logos process exits, our state changes or timeout passes.
+
+        Returns:
+            False if it timed out
+        """
+        if timeout is None:
+            if self.logos_state == State.STARTING:
+                timeout = self.STARTING_INTERVAL
+            else:
+                timeout = self.DISCOVERY_INTERVAL
+        pids = [
+            process.pid
+            for processes in self.existing_processes.values()
+            for process in processes
+        ]
+        # Exited children stay around (as zombies) until they're polled
+        pids.extend(process.pid for process in self.processes.values() if process.poll() is None)
+        return self._watcher.wait(pids, timeout)
+
+    def watch(self, on_change: Callable[[], None]):
+        """Keeps our state up to date, calling on_change when it changes.
+
+        Runs forever, meant to be started in it's own thread.
+        """
+        last_state = (self.logos_state, self.indexing_state)
+        while True:
+            if self.app.is_installed():
+                self.monitor()
+                timeout = None
+            else:
+                # Will probably be some time before we need to monitor.
+                timeout = 30
+            state = (self.logos_state, self.indexing_state)
+            if state != last_state:
+                on_change()
+                last_state = state
+            self.wait_for_change(timeout)
 
     def monitor_indexing(self):
         if self.app.conf.logos_indexer_exe_windows_path in self.existing_processes:
@@ -77,16 +150,16 @@ class LogosManager:
 
     def get_logos_pids(self):
         app = self.app
-        # FIXME: consider refactoring to make one call to get a system pids
-        # Currently this gets all system pids 4 times
-        for exe_path in [
+        exe_paths = [
             app.conf.logos_exe,
             app.conf.logos_system_exe_windows_path,
             app.conf.logos_indexer_exe_windows_path,
             app.conf.logos_cef_exe_windows_path
-        ]:
-            if exe_path:
-                self.existing_processes[exe_path] = system.get_pids(exe_path)
+        ]
+        # One pass over the process table for all of them
+        self.existing_processes.update(
+            system.get_pids_by_cmdline(exe_path for exe_path in exe_paths if exe_path)
+        )
 
     def monitor(self):
         if self.app.is_installed():
@@ -214,13 +287,17 @@ class LogosManager:
         if not logos_user_id:
             return None
         db_path = logos_appdata_dir / "Documents" / logos_user_id / "LocalUserPreferences" / "PreferencesManager.db" 
-        sql = (
-            """UPDATE Preferences SET Data='<data """ +
+        data = (
+            """'<data """ +
             ('OptIn="true"' if val else 'OptIn="false"') +
-            """ StartDownloadHour="0" StopDownloadHour="0" MarkNewResourcesAsCloud="true" />' """
-            """ WHERE Type='UpdateManagerPreferences'""" 
+            """ StartDownloadHour="0" StopDownloadHour="0" MarkNewResourcesAsCloud="true" />'"""
+        )
+        where = f"Type='UpdateManagerPreferences' AND Data IS NOT {data}"
+        sql = database.ConditionalStatement(
+            f"UPDATE Preferences SET Data={data} WHERE {where}",
+            needed=f"SELECT 1 FROM Preferences WHERE {where} LIMIT 1",
         )
-        self.app.start_thread(database.watch_db, str(db_path), [sql])
+        self._watch_db(db_path, [sql])
 
     def prevent_logos_updates(self):
         """Edits Logos' internal database to remove pending installers
@@ -238,23 +315,54 @@ class LogosManager:
         # If we do that we'd have to consider if their other resources are up to date
         # AND if their library is index and their library is prepared.
         # Logos probably should be off for this
-        sql = [
+        # Each statement only runs if its WHERE matches something
+        application_update_urls = (
+            "UpdateId IN (SELECT UpdateId FROM Updates WHERE Source='Application Update')"
+        )
+        orphaned_or_application_updates = (
+            "UpdateId NOT IN (SELECT UpdateId FROM UpdateUrls) OR Source='Application Update'"
+        )
+        missing_update_ids = (
+            "UpdateId IS NOT NULL AND UpdateId NOT IN (SELECT UpdateId FROM Updates)"
+        )
+        sql: list[str | database.ConditionalStatement] = [
             # "DELETE FROM Installers WHERE 1",
             # Cleanup the Update Ids that are associated with an application update
-            "DELETE FROM UpdateUrls WHERE UpdateId IN " +
-                "(SELECT UpdateId FROM Updates WHERE Source='Application Update')",
+            database.ConditionalStatement(
+                f"DELETE FROM UpdateUrls WHERE {application_update_urls}",
+                needed=f"SELECT 1 FROM UpdateUrls WHERE {application_update_urls} LIMIT 1",
+            ),
             # Cleanup database relations and removes Application Updates
             # Fixes corrupt DBs caused by an earlier
             # version of the software #275
             # If we don't do this, the application will crash when it tries to update.
-            "DELETE FROM Updates WHERE UpdateId NOT IN "+
-                "(SELECT UpdateId FROM UpdateUrls) OR "+
-                "Source='Application Update'",
+            database.ConditionalStatement(
+                f"DELETE FROM Updates WHERE {orphaned_or_application_updates}",
+                needed=f"SELECT 1 FROM Updates WHERE {orphaned_or_application_updates} LIMIT 1",
+            ),
             # Also remove any UpdateId references that don't exist
-            "UPDATE Resources SET Status=1, UpdateId=NULL WHERE UpdateId IS NOT NULL "+
-                "AND UpdateId NOT IN (SELECT UpdateId FROM Updates)"
+            database.ConditionalStatement(
+                f"UPDATE Resources SET Status=1, UpdateId=NULL WHERE {missing_update_ids}",
+                needed=f"SELECT 1 FROM Resources WHERE {missing_update_ids} LIMIT 1",
+            ),
         ]
-        self.app.start_thread(database.watch_db, str(db_path), sql)
+        self._watch_db(db_path, sql)
+
+    def _watch_db(self, db_path: Path, sql: list[str | database.ConditionalStatement]):
+        # Replace any watch left over from an earlier start
+        old_handle = self._db_watches.pop(str(db_path), None)
+        if old_handle is not None:
+            database.unwatch_db(old_handle)
+        try:
+            self._db_watches[str(db_path)] = database.watch_db(str(db_path), sql)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Couldn't watch {db_path}: {e}")
+
+    def unwatch_dbs(self):
+        """Stops the database fix-ups started with Logos"""
+        while self._db_watches:
+            _, handle = self._db_watches.popitem()
+            database.unwatch_db(handle)
 
     # Also noticed if the database Data/*/CloudResourceManager/CloudResources.db 
     # table TransitionStates has a ResourceId that isn't registered in UpdateManager,
@@ -411,17 +519,7 @@ class LogosManager:
                 state = state_enabled
 
         logging.info(f"Setting app logging to '{state}'.")
-        exe_args = [
-            'add', 'HKCU\\Software\\Logos4\\Logging', '/v', 'Enabled',
-            '/t', 'REG_DWORD', '/d', value, '/f'
-        ]
-        process = wine.run_wine_during_install(
-            app=self.app,
-            wine_binary=self.app.conf.wine_binary,
-            exe='reg',
-            exe_args=exe_args
-        )
-        if process:
-            process.wait()
-        wine.wineserver_wait(self.app)
+        registry = wine.RegistryTransaction()
+        registry.set_dword('HKCU\\Software\\Logos4\\Logging', 'Enabled', int(value))
+        registry.apply(self.app, self.app.conf.wine_binary, 'set-app-logging.reg')
         self.app.conf.faithlife_product_logging = state == state_enabled
@@ -97,6 +97,14 @@ def get_parser():
         '-q', '--quiet', action='store_true',
         help='Suppress all non-error output',
     )
+    cfg.add_argument(
+        '--backup-archive', action='store_true',
+        help='write backups as compressed archives',
+    )
+    cfg.add_argument(
+        '--restore-changed-only', action='store_true',
+        help='only restore files that differ from the installed data',
+    )
 
     # Define runtime actions (mutually exclusive).
     grp = parser.add_argument_group(
@@ -264,6 +272,12 @@ def parse_args(args, parser) -> Tuple[EphemeralConfiguration, Callable[[Ephemera
     if args.i_agree_to_faithlife_terms:
         ephemeral_config.agreed_to_faithlife_terms = True
 
+    if args.backup_archive:
+        ephemeral_config.backup_archive = True
+
+    if args.restore_changed_only:
+        ephemeral_config.restore_changed_only = True
+
 
     def cli_operation(action: str) -> Callable[[EphemeralConfiguration], None]:
         """Wrapper for a function pointer to a given function under CLI
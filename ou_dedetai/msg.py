@@ -1,16 +1,51 @@
+import atexit
 import gzip
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
 import shutil
 import sys
 
 from pathlib import Path
+from typing import Optional
 
 from ou_dedetai import constants
 
+LOG_QUEUE_SIZE = 10000
+"""Records buffered for the log writer thread.
+
+Once it's full DEBUG/INFO records are dropped rather than stalling the caller"""
+
+LOG_BATCH_SIZE = 500
+"""Most records the log writer thread writes out at once"""
+
+LOG_BLOCK_TIMEOUT = 1.0
+"""Seconds a WARNING or worse waits for room in a full buffer before it's dropped"""
+
 
 class GzippedRotatingFileHandler(RotatingFileHandler):
+    def handle_batch(self, records: list[logging.LogRecord]) -> None:
+        """Writes records with one write and flush, rolling over first if they don't fit"""
+        records = [r for r in records if self.filter(r)]
+        if not records:
+            return
+        self.acquire()
+        try:
+            text = "".join(self.format(r) + self.terminator for r in records)
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0:
+                position = self.stream.tell()
+                if position > 0 and position + len(text) >= self.maxBytes:
+                    self.doRollover()
+            self.stream.write(text)
+            self.flush()
+        except Exception:
+            self.handleError(records[0])
+        finally:
+            self.release()
+
     def doRollover(self):
         super().doRollover()
 
@@ -46,6 +81,109 @@ class DeduplicateFilter(logging.Filter):
         return True
 
 
+class BoundedQueueHandler(QueueHandler):
+    """Hands records to the log writer thread, so logging never waits on disk.
+
+    If the writer falls behind and the queue fills up, DEBUG and INFO records
+    are dropped and the count is logged once there's room again.
+    """
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.log_queue = log_queue
+        # emit (and so enqueue) runs under the handler's lock
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped:
+            dropped = logging.makeLogRecord({
+                "name": "root",
+                "levelno": logging.WARNING,
+                "levelname": "WARNING",
+                "msg": f"Log buffer was full, dropped {self.dropped} message(s)",
+            })
+            try:
+                self.queue.put_nowait(dropped)
+                self.dropped = 0
+            except queue.Full:
+                pass
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if record.levelno >= logging.WARNING:
+            try:
+                self.log_queue.put(record, timeout=LOG_BLOCK_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+        self.dropped += 1
+
+
+class BatchingQueueListener(QueueListener):
+    """Writes queued records out on its own thread, a batch at a time.
+
+    Handlers with a handle_batch method get the whole batch at once, so the
+    log file is written and flushed once per batch instead of per record.
+    Log rollover (and its gzip) runs on this thread too.
+    """
+
+    def __init__(self, log_queue: queue.Queue, *handlers: logging.Handler) -> None:
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.log_queue = log_queue
+
+    def enqueue_sentinel(self) -> None:
+        # Wait for room, the queue may be full
+        self.log_queue.put(None)
+
+    def _monitor(self) -> None:
+        while True:
+            batch = [self.dequeue(True)]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+            # None is the sentinel stop() queues
+            records = [r for r in batch if r is not None]
+            if records:
+                self.handle_batch(records)
+            for _ in batch:
+                self.log_queue.task_done()
+            if len(records) != len(batch):
+                return
+
+    def handle_batch(self, records: list[logging.LogRecord]) -> None:
+        for handler in self.handlers:
+            accepted = [r for r in records if r.levelno >= handler.level]
+            if not accepted:
+                continue
+            if isinstance(handler, GzippedRotatingFileHandler):
+                handler.handle_batch(accepted)
+            else:
+                for record in accepted:
+                    handler.handle(record)
+
+
+_listener: Optional[BatchingQueueListener] = None
+
+
+def _handlers() -> list[logging.Handler]:
+    """The handlers that actually write the logs"""
+    if _listener is not None:
+        return list(_listener.handlers)
+    return logging.getLogger().handlers
+
+
+def stop_logging() -> None:
+    """Writes out everything still queued and stops the log writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 def get_log_level_name(level):
     name = None
     levels = {
@@ -105,18 +243,37 @@ def initialize_logging():
         # stdout_h,
         stderr_h,
     ]
+    formatter = logging.Formatter(
+        '%(asctime)s %(levelname)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # The handlers run on the listener's thread, callers only queue records
+    global _listener
+    stop_logging()
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_h = BoundedQueueHandler(log_queue)
+    queue_h.name = "queue"
+    # Only the message, the handlers add the rest
+    queue_h.setFormatter(logging.Formatter())
+    _listener = BatchingQueueListener(log_queue, *handlers)
+    _listener.start()
+    atexit.register(stop_logging)
 
     # Set initial config.
     logging.basicConfig(
         level=logging.DEBUG,
-        format='%(asctime)s %(levelname)s: %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        handlers=handlers,
+        handlers=[queue_h],
     )
     logging.debug(f"Installer log file: {app_log_path}")
 
 
 def initialize_tui_logging():
+    if _listener is not None:
+        _listener.handlers = tuple(h for h in _listener.handlers if h.name != 'terminal')
+        return
     current_logger = logging.getLogger()
     for h in current_logger.handlers:
         if h.name == 'terminal':
@@ -126,17 +283,22 @@ def initialize_tui_logging():
 
 def update_log_level(new_level: int | str):
     # Update logging level from config.
-    for h in logging.getLogger().handlers:
+    for h in _handlers():
         if type(h) is logging.StreamHandler:
             h.setLevel(new_level)
     logging.info(f"Terminal log level set to {get_log_level_name(new_level)}")
 
 
 def update_log_path(app_log_path: str | Path):
-    for h in logging.getLogger().handlers:
+    for h in _handlers():
         if type(h) is GzippedRotatingFileHandler and h.name == "logfile":
             new_base_filename = os.path.abspath(os.fspath(app_log_path))
             if new_base_filename != h.baseFilename:
                 # One last message on the old log to let them know it moved
                 logging.debug(f"Installer log file changed to: {app_log_path}")
-                h.baseFilename = new_base_filename
+                # The listener thread may be writing
+                h.acquire()
+                try:
+                    h.baseFilename = new_base_filename
+                finally:
+                    h.release()
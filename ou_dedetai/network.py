@@ -1,21 +1,24 @@
 import abc
-from dataclasses import dataclass, field
+import concurrent.futures
+from dataclasses import asdict, dataclass, field
 import hashlib
 import json
 import logging
 from math import ceil
 import os
+import threading
 import time
 from typing import Callable, Optional
 import requests
 import shutil
 import sys
-from base64 import b64encode
+from base64 import b64decode, b64encode
 from pathlib import Path
 from urllib.parse import urlparse
 from xml.etree import ElementTree as ET
 from datetime import datetime
 
+import requests.adapters
 import requests.structures
 
 from ou_dedetai.app import App
@@ -23,6 +26,13 @@ from ou_dedetai.app import App
 from . import constants
 from . import utils
 
+SEGMENTED_DOWNLOAD_MIN_SIZE = 32 * 1024 * 1024
+"""Files smaller than this are downloaded over a single connection"""
+SEGMENTED_DOWNLOAD_CONNECTIONS = 4
+"""Number of byte ranges fetched at once for large downloads"""
+DOWNLOAD_STORE_MAX_AGE_DAYS = 30
+"""Days a download store entry is kept after the last copy linked to it is gone"""
+
 class Props(abc.ABC):
     def __init__(self) -> None:
         self._md5: Optional[str] = None
@@ -70,6 +80,76 @@ class FileProps(Props):
                 md5.update(chunk)
         return b64encode(md5.digest()).decode('utf-8')
 
+
+class DownloadHasher:
+    """MD5s a file as it's being downloaded.
+
+    Once the download finishes the digest is saved in a <file>.md5state sidecar,
+    so verifying the download doesn't need to read the whole file back.
+
+    hashlib can't serialize a partial hash, so resuming an interrupted download
+    hashes the part already on disk once before continuing.
+
+    MD5 can only be fed in order. A segmented download hashes its first
+    segment as it streams, the other segments are read back from disk once
+    everything before them is hashed.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.size = 0
+        """Number of bytes hashed so far"""
+        self._md5 = hashlib.md5()
+
+    def update(self, data: bytes):
+        self._md5.update(data)
+        self.size += len(data)
+
+    def update_from_disk(self, until: int):
+        """Hashes the bytes from what was last hashed until the given offset"""
+        if until <= self.size:
+            return
+        with self.path.open('rb') as f:
+            f.seek(self.size)
+            while self.size < until:
+                chunk = f.read(min(524288, until - self.size))
+                if not chunk:
+                    break
+                self.update(chunk)
+
+    @property
+    def md5(self) -> str:
+        return b64encode(self._md5.digest()).decode('utf-8')
+
+    def save(self):
+        stat = self.path.stat()
+        if stat.st_size != self.size:
+            logging.warning(f"Not saving md5 of {self.path}, only {self.size} of {stat.st_size} bytes were hashed.")
+            return
+        with _md5_state_path(self.path).open('w') as f:
+            json.dump({"size": self.size, "mtime_ns": stat.st_mtime_ns, "md5": self.md5}, f)
+
+
+def _md5_state_path(path: Path | str) -> Path:
+    path = Path(path)
+    return path.with_name(f"{path.name}.md5state")
+
+
+def _read_md5_state(path: Path | str) -> Optional[str]:
+    """Returns the md5 saved while downloading path, if the file hasn't changed since"""
+    state_path = _md5_state_path(path)
+    if not state_path.is_file():
+        return None
+    try:
+        stat = Path(path).stat()
+        state = json.loads(state_path.read_text())
+        if state["size"] == stat.st_size and state["mtime_ns"] == stat.st_mtime_ns:
+            md5: str = state["md5"]
+            return md5
+    except (OSError, json.JSONDecodeError, KeyError, TypeError):
+        logging.warning(f"Failed to read md5 state: {state_path}")
+    return None
+
+
 @dataclass
 class SoftwareReleaseInfo:
     version: str
@@ -98,7 +178,7 @@ class UrlProps(Props):
         logging.debug(f"Getting headers from {self.path}.")
         try:
             h = {'Accept-Encoding': 'identity'}  # force non-compressed txfr
-            r = requests.head(self.path, allow_redirects=True, headers=h)
+            r = NetworkRequests.http().head(self.path, allow_redirects=True, headers=h)
         except requests.exceptions.ConnectionError:
             logging.critical("Failed to connect to the server.")
             return requests.structures.CaseInsensitiveDict()
@@ -237,6 +317,116 @@ class CachedRequests:
         return self
 
 
+class HttpSession:
+    """Connection pool shared by all of our HTTP requests.
+
+    A HEAD followed by a GET (or several range requests) to the same host reuse
+    the same keep-alive connection instead of paying for a new TCP+TLS handshake.
+
+    requests.Session isn't safe to share between threads, but its adapter's
+    connection pool is, so each thread gets its own session mounted on the
+    same adapter.
+    """
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 16) -> None:
+        self._adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+        )
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session: Optional[requests.Session] = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            self._local.session = session
+        return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.session.get(url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.session.head(url, **kwargs)
+
+    def connection_stats(self) -> dict[str, dict[str, int]]:
+        """Requests made, connections opened, and connections reused per host"""
+        stats: dict[str, dict[str, int]] = {}
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = stats.setdefault(pool.host, {"requests": 0, "connections": 0, "reused": 0})
+            host_stats["requests"] += pool.num_requests
+            host_stats["connections"] += pool.num_connections
+            host_stats["reused"] += max(0, pool.num_requests - pool.num_connections)
+        return stats
+
+
+class VerifiedFiles:
+    """Index of downloads that have already been verified.
+
+    Maps a file's path to its inode, size, mtime and md5 at the time it was verified,
+    so as long as the file is unchanged verifying it again only needs a stat().
+    Persisted in the cache dir so it works across runs.
+    """
+
+    def __init__(self, entries: Optional[dict[str, dict]] = None) -> None:
+        self._entries: dict[str, dict] = entries or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls) -> "VerifiedFiles":
+        path = Path(constants.VERIFIED_FILES_PATH)
+        if path.exists():
+            try:
+                return VerifiedFiles(json.loads(path.read_text()))
+            except json.JSONDecodeError:
+                logging.warning("Failed to read verified files JSON. Clearing…")
+        return VerifiedFiles()
+
+    def _write(self) -> None:
+        path = Path(constants.VERIFIED_FILES_PATH)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        with open(path, "w") as f:
+            json.dump(self._entries, f, indent=4, sort_keys=True)
+            f.write("\n")
+
+    @staticmethod
+    def _key(path: Path | str) -> str:
+        return os.path.realpath(path)
+
+    @staticmethod
+    def _fingerprint(stat: os.stat_result) -> dict:
+        return {"inode": stat.st_ino, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def md5(self, path: Path | str) -> Optional[str]:
+        """Returns the verified md5 of path if it hasn't changed since it was verified"""
+        with self._lock:
+            entry = self._entries.get(self._key(path))
+        if entry is None:
+            return None
+        try:
+            fingerprint = self._fingerprint(os.stat(path))
+        except OSError:
+            return None
+        if any(entry.get(k) != v for k, v in fingerprint.items()):
+            return None
+        md5: Optional[str] = entry.get("md5")
+        return md5
+
+    def add(self, path: Path | str, md5: str) -> None:
+        with self._lock:
+            self._entries[self._key(path)] = {**self._fingerprint(os.stat(path)), "md5": md5}
+            # Drop entries for files that no longer exist
+            for key in [k for k in self._entries if not os.path.exists(k)]:
+                del self._entries[key]
+            self._write()
+
+
 class NetworkRequests:
     """Uses the cache if found, otherwise retrieves the value from the network."""
 
@@ -249,6 +439,24 @@ class NetworkRequests:
     ) -> None:
         self._cache = CachedRequests.load().ensure_fresh(force=force_clean or False)
         self._cache._update_hook = hook
+        self.verified_files = VerifiedFiles.load()
+        # Prefetches may look up urls from other threads
+        self._cache_lock = threading.Lock()
+
+    _http: Optional[HttpSession] = None
+    _http_lock = threading.Lock()
+
+    @classmethod
+    def http(cls) -> HttpSession:
+        """The HTTP connection pool shared by every request we make"""
+        with cls._http_lock:
+            if cls._http is None:
+                cls._http = HttpSession()
+            return cls._http
+
+    @classmethod
+    def connection_stats(cls) -> dict[str, dict[str, int]]:
+        return cls.http().connection_stats()
 
     def _faithlife_product_releases(
         self,
@@ -302,8 +510,10 @@ class NetworkRequests:
         """
         if url not in self._cache.url_size_and_hash:
             props = UrlProps(url)
-            self._cache.url_size_and_hash[url] = props.size, props.md5
-            self._cache._write()
+            size_and_hash = props.size, props.md5
+            with self._cache_lock:
+                self._cache.url_size_and_hash[url] = size_and_hash
+                self._cache._write()
         return self._cache.url_size_and_hash[url]
 
     def url_size(self, url: str) -> Optional[int]:
@@ -373,6 +583,172 @@ class NetworkRequests:
         return self._repo_latest_version("FaithLife-Community/icu")
 
 
+def _store_path(url: str, app: App) -> Path:
+    """Path of a verified download in the content-addressed store.
+
+    Keyed by the server's md5 when it gives one, so the same file under a
+    different url is shared. Otherwise keyed by the url.
+    """
+    url_md5 = app.conf._network.url_md5(url)
+    if url_md5 is not None:
+        key = "md5-" + b64decode(url_md5).hex()
+    else:
+        key = "url-" + hashlib.sha256(url.encode()).hexdigest()
+    return Path(constants.DOWNLOAD_STORE_DIR) / key
+
+
+def _add_to_store(file_path: Path, store_path: Path, md5: str, app: App):
+    """Links a verified file into the store and records its md5.
+
+    The store entry is only reused while it still matches that record.
+    """
+    try:
+        store_path.parent.mkdir(parents=True, exist_ok=True)
+        utils.link_or_copy(file_path, store_path)
+        app.conf._network.verified_files.add(store_path, md5)
+    except OSError as e:
+        # The store is only an optimization
+        logging.warning(f"Failed to add {file_path} to the download store: {e}")
+
+
+def _verified_store_file(store_path: Path, url: str, app: App) -> bool:
+    """Whether store_path is unchanged since it was added, and matches the url"""
+    if not store_path.is_file():
+        return False
+    recorded_md5 = app.conf._network.verified_files.md5(store_path)
+    if recorded_md5 is None:
+        logging.debug(f"{store_path} has changed since it was stored, not using it.")
+        return False
+    url_md5 = app.conf._network.url_md5(url)
+    if url_md5 is not None and recorded_md5 != url_md5:
+        return False
+    url_size = app.conf._network.url_size(url)
+    return url_size is None or store_path.stat().st_size == url_size
+
+
+def prune_download_store(max_age_days: float = DOWNLOAD_STORE_MAX_AGE_DAYS):
+    """Removes store entries that no other file has linked to for max_age_days.
+
+    Adding or removing a hardlink updates a file's ctime, so for an entry with
+    a single link its ctime is about when the last copy went away.
+    """
+    store_dir = Path(constants.DOWNLOAD_STORE_DIR)
+    if not store_dir.is_dir():
+        return
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+    for entry in store_dir.iterdir():
+        try:
+            stat = entry.stat()
+            if entry.is_file() and stat.st_nlink == 1 and stat.st_ctime < cutoff:
+                entry.unlink()
+                logging.debug(f"Removed unused download {entry}")
+        except OSError as e:
+            logging.warning(f"Failed to prune {entry} from the download store: {e}")
+
+
+def _downloaded_md5(sourceurl: str, file_path: Path, app: App) -> str:
+    """md5 of a verified download, without reading it again where possible"""
+    md5 = app.conf._network.url_md5(sourceurl) or _read_md5_state(file_path)
+    if md5 is None:
+        # The server didn't give us one and we didn't download it ourselves
+        md5 = FileProps(file_path).md5
+    assert md5 is not None
+    return md5
+
+
+class DownloadCancelled(Exception):
+    """A background download was stopped before it finished"""
+
+
+@dataclass
+class _Prefetch:
+    future: concurrent.futures.Future[bool]
+    cancel: threading.Event
+    """Checked between chunks, set to stop the download"""
+
+
+_prefetch_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_prefetches: dict[tuple[str, str], _Prefetch] = {}
+_prefetches_lock = threading.Lock()
+
+
+def prefetch(sourceurl: str, file: str, app: App):
+    """Starts downloading a file in the background.
+
+    A later logos_reuse_download of the same url and file waits for this
+    download to finish instead of starting its own.
+    """
+    global _prefetch_executor
+    key = (sourceurl, file)
+    with _prefetches_lock:
+        if key in _prefetches:
+            return
+        if _prefetch_executor is None:
+            _prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=3,
+                thread_name_prefix="prefetch"
+            )
+        logging.debug(f"Prefetching {file} from {sourceurl}")
+        cancel = threading.Event()
+        future = _prefetch_executor.submit(
+            _reuse_download,
+            sourceurl,
+            file,
+            app.conf.download_dir,
+            app,
+            status_messages=False,
+            background=True,
+            cancel=cancel
+        )
+        _prefetches[key] = _Prefetch(future, cancel)
+
+
+def cancel_prefetch(sourceurl: str, file: str):
+    """Stops a prefetch that turned out not to be needed.
+
+    What was downloaded so far is kept, a later download resumes it.
+    """
+    with _prefetches_lock:
+        prefetch = _prefetches.pop((sourceurl, file), None)
+    if prefetch is not None:
+        logging.debug(f"Cancelling prefetch of {file}")
+        prefetch.cancel.set()
+        prefetch.future.cancel()
+
+
+def cancel_prefetches():
+    """Stops every prefetch.
+
+    The interpreter waits for the prefetch threads before exiting, so this
+    must be called on exit or it waits for the downloads to finish.
+    """
+    global _prefetch_executor
+    with _prefetches_lock:
+        prefetches = list(_prefetches.values())
+        _prefetches.clear()
+        executor = _prefetch_executor
+        _prefetch_executor = None
+    for prefetch in prefetches:
+        prefetch.cancel.set()
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _wait_for_prefetch(sourceurl: str, file: str, app: App):
+    with _prefetches_lock:
+        prefetch = _prefetches.pop((sourceurl, file), None)
+    if prefetch is None:
+        return
+    future = prefetch.future
+    if not future.done():
+        app.status(f"Waiting for {file} to finish downloading…")
+    try:
+        if not future.result():
+            logging.info(f"Prefetch of {file} failed, retrying.")
+    except Exception as e:
+        logging.info(f"Prefetch of {file} failed, retrying: {e}")
+
+
 def logos_reuse_download(
     sourceurl: str,
     file: str,
@@ -380,6 +756,42 @@ def logos_reuse_download(
     app: App,
     status_messages: bool = True
 ):
+    _wait_for_prefetch(sourceurl, file, app)
+    if not _reuse_download(sourceurl, file, targetdir, app, status_messages):
+        file_path = Path(app.conf.download_dir) / file
+        if _download_incomplete(sourceurl, file_path, app):
+            app.exit(f"Download of {file} was interrupted, try again to resume it.")
+        app.exit(f"Bad file size or checksum: {file_path}")
+
+
+def _reuse_download(
+    sourceurl: str,
+    file: str,
+    targetdir: str,
+    app: App,
+    status_messages: bool = True,
+    background: bool = False,
+    cancel: Optional[threading.Event] = None
+) -> bool:
+    """Ensures file is in targetdir, downloading it if needed.
+
+    Background downloads don't report progress to the app.
+
+    Raises:
+        DownloadCancelled - if cancel was set, the partial download is kept
+
+    Returns:
+        False if the download failed verification (it's deleted) or was
+        interrupted (it's kept to be resumed)
+    """
+    # Verified files are kept in a store and linked (or reflinked) into place
+    # rather than being searched for, hashed and copied every time.
+    store_path = _store_path(sourceurl, app)
+    if _verified_store_file(store_path, sourceurl, app):
+        logging.info(f"{file} found in the download store. Using it…")
+        utils.link_or_copy(store_path, Path(targetdir) / file)
+        return True
+
     dirs = [
         app.conf.user_download_dir,
         app.conf.download_dir,
@@ -398,42 +810,300 @@ def logos_reuse_download(
                     status_messages=status_messages
                 ):
                     logging.info(f"{file} properties match. Using it…")
-                    logging.debug(f"Copying {file} into {targetdir}")
-                    try:
-                        shutil.copy(os.path.join(i, file), targetdir)
-                    except shutil.SameFileError:
-                        pass
+                    logging.debug(f"Linking {file} into {targetdir}")
+                    _add_to_store(file_path, store_path, _downloaded_md5(sourceurl, file_path, app), app)
+                    utils.link_or_copy(file_path, Path(targetdir) / file)
                     found = 0
                     break
                 else:
                     logging.info(f"Incomplete file: {file_path}.")
     if found == 1:
         file_path = Path(os.path.join(app.conf.download_dir, file))
+        # Never write into a file that shares its data with the store.
+        if file_path.is_file() and file_path.stat().st_nlink > 1:
+            file_path.unlink()
         # Start download.
         _net_get(
             sourceurl,
             target=file_path,
-            app=app,
+            app=None if background else app,
+            cancel=cancel,
         )
+        logging.debug(f"HTTP connections: {NetworkRequests.connection_stats()}")
         if _verify_downloaded_file(
             sourceurl,
             file_path,
             app=app,
             status_messages=status_messages
         ):
-            logging.debug(f"Copying: {file} into: {targetdir}")
-            try:
-                shutil.copy(os.path.join(app.conf.download_dir, file), targetdir)
-            except shutil.SameFileError:
-                pass
+            logging.debug(f"Linking: {file} into: {targetdir}")
+            _add_to_store(file_path, store_path, _downloaded_md5(sourceurl, file_path, app), app)
+            utils.link_or_copy(file_path, Path(targetdir) / file)
+        elif _download_incomplete(sourceurl, file_path, app):
+            # A network error, keep what was downloaded so the next attempt resumes it
+            logging.warning(f"Download of {file} was interrupted, keeping it to resume later.")
+            return False
         else:
             # In case we ever get here, give us an opportunity to recover by trying the download again from the start
             os.remove(file_path)
-            app.exit(f"Bad file size or checksum: {file_path}")
+            _segments_path(file_path).unlink(missing_ok=True)
+            _md5_state_path(file_path).unlink(missing_ok=True)
+            return False
+    return True
+
+
+def _download_incomplete(url: str, file_path: Path, app: App) -> bool:
+    """Whether file_path is a download that stopped early, rather than a bad one"""
+    if _segments_path(file_path).exists():
+        return True
+    url_size = app.conf._network.url_size(url)
+    file_size = FileProps(file_path).size
+    return url_size is not None and file_size is not None and file_size < url_size
+
+
+@dataclass
+class DownloadSegment:
+    """One byte range of a segmented download"""
+    start: int
+    end: int
+    """Last byte of the range (inclusive, like the HTTP Range header)"""
+    done: int = 0
+    """Number of bytes of this range already written to disk"""
+
+    @property
+    def complete(self) -> bool:
+        return self.start + self.done > self.end
+
+
+class _RangeNotSatisfied(Exception):
+    """The server didn't honor our Range header"""
+
+
+def _segments_path(target: Path | str) -> Path:
+    """Sidecar recording the progress of a segmented download.
+
+    While this file exists the download is incomplete, even though the
+    target was preallocated to its full size.
+    """
+    target = Path(target)
+    return target.with_name(f"{target.name}.segments")
+
+
+def _plan_segments(start: int, total_size: int, count: int) -> list[DownloadSegment]:
+    """Splits the bytes from start until total_size into count ranges"""
+    remaining = total_size - start
+    if remaining <= 0:
+        return []
+    count = max(1, min(count, remaining))
+    segment_size = ceil(remaining / count)
+    segments = []
+    for offset in range(start, total_size, segment_size):
+        segments.append(DownloadSegment(offset, min(offset + segment_size, total_size) - 1))
+    return segments
+
+
+def _load_segments(target: Path, url: str, total_size: int) -> Optional[list[DownloadSegment]]:
+    """Loads the segments of an interrupted download of the same url/size"""
+    path = _segments_path(target)
+    if not path.is_file() or not target.is_file():
+        return None
+    try:
+        data = json.loads(path.read_text())
+        if data.get("url") != url or data.get("size") != total_size:
+            logging.debug(f"Ignoring segments for a different download: {path}")
+            return None
+        return [DownloadSegment(**s) for s in data["segments"]]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        logging.warning(f"Failed to read download segments: {path}")
+        return None
+
+
+def _write_segments(target: Path, url: str, total_size: int, segments: list[DownloadSegment]):
+    # Replaced atomically, a truncated sidecar would lose track of what's downloaded
+    path = _segments_path(target)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with tmp_path.open("w") as f:
+        json.dump({"url": url, "size": total_size, "segments": [asdict(s) for s in segments]}, f)
+    os.replace(tmp_path, path)
+
+
+def _contiguous_size(segments: list[DownloadSegment], total_size: int) -> int:
+    """Number of bytes from the start of the file that are on disk"""
+    for segment in segments:
+        if not segment.complete:
+            return segment.start + segment.done
+    return total_size
+
+
+def _download_segment(
+    url: str,
+    segment: DownloadSegment,
+    fd: int,
+    chunk_size: int,
+    on_data: Optional[Callable[[bytes], None]] = None,
+    cancel: Optional[threading.Event] = None
+):
+    """Downloads a single range into fd, retrying while progress is being made
+
+    on_data is called with every chunk written, in order.
+
+    Raises:
+        _RangeNotSatisfied - if the server answers without sending any of the range
+        DownloadCancelled - if cancel was set
+    """
+    while not segment.complete:
+        last_done = segment.done
+        error: Optional[requests.exceptions.RequestException] = None
+        headers = {
+            'Accept-Encoding': 'identity',
+            'Range': f'bytes={segment.start + segment.done}-{segment.end}',
+        }
+        try:
+            with NetworkRequests.http().get(url, stream=True, headers=headers) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise _RangeNotSatisfied(f"Expected a partial response, got: {r.status_code}")
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    if cancel is not None and cancel.is_set():
+                        raise DownloadCancelled(url)
+                    remaining = segment.end - (segment.start + segment.done) + 1
+                    chunk = chunk[:remaining]
+                    os.pwrite(fd, chunk, segment.start + segment.done)
+                    if on_data is not None:
+                        on_data(chunk)
+                    segment.done += len(chunk)
+                    if len(chunk) == remaining:
+                        break
+        except requests.exceptions.RequestException as e:
+            error = e
+        if segment.done > last_done:
+            if not segment.complete:
+                logging.warning(
+                    f"Only downloaded a portion of bytes {segment.start}-{segment.end}, retrying: {error}"
+                )
+            continue
+        # Asking again for the same range would get the same answer
+        if error is not None:
+            raise error
+        raise _RangeNotSatisfied(
+            f"No data received for bytes {segment.start + segment.done}-{segment.end}"
+        )
+
+
+def _net_get_segmented(
+    url_props: UrlProps,
+    target: Path,
+    total_size: int,
+    app: Optional[App] = None,
+    cancel: Optional[threading.Event] = None
+) -> Optional[bool]:
+    """Downloads a file over several connections at once.
+
+    Each segment is written in place into a preallocated file, and its
+    progress is kept in a sidecar file so an interrupted download resumes
+    each segment where it stopped.
+
+    Only the first pending segment is hashed as it streams. The others,
+    (n-1)/n of a fresh download over n connections, are read back once the
+    hashed prefix reaches them. That read usually hits the page cache, but
+    with less free memory than the file size it is real disk I/O.
+
+    Returns:
+        True - if the file was downloaded
+        False - if the server doesn't honor ranges, the caller should fall back to a single stream
+        None - on a network error
+
+    Raises:
+        DownloadCancelled - if cancel was set, progress so far is kept for resuming
+    """
+    url = url_props.path
+    _md5_state_path(target).unlink(missing_ok=True)
+    segments = _load_segments(target, url, total_size)
+    if segments is not None:
+        logging.info(f"Continuing segmented download for {url}.")
+    else:
+        # A partial single-stream download is a valid prefix, keep it.
+        local_size = FileProps(target).size or 0
+        if local_size and (local_size >= total_size or _segments_path(target).exists()):
+            # Preallocated for segments we can't read, which parts of it were
+            # downloaded is unknown
+            logging.info(f"Discarding {target}, its download progress is unknown.")
+            os.truncate(target, 0)
+            local_size = 0
+        segments = _plan_segments(local_size, total_size, SEGMENTED_DOWNLOAD_CONNECTIONS)
+        logging.info(f"Starting segmented download for {url} from byte {local_size}.")
+    pending = [s for s in segments if not s.complete]
+
+    chunk_size = min([int(total_size / 50), 2 * 1024 * 1024])
+    hasher = DownloadHasher(target)
+    fd = os.open(target, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            os.posix_fallocate(fd, 0, total_size)
+        except OSError:
+            # Not supported on all filesystems, a sparse file is good enough.
+            os.ftruncate(fd, total_size)
+        _write_segments(target, url, total_size, segments)
+        # What's already on disk from before, read once
+        hasher.update_from_disk(_contiguous_size(segments, total_size))
+        # The first pending segment starts where the hash stopped, so its
+        # chunks can be hashed as they arrive. Only its thread touches the
+        # hasher until it's complete.
+        inline = pending[0] if pending else None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+            futures = [
+                executor.submit(
+                    _download_segment, url, s, fd, chunk_size,
+                    hasher.update if s is inline else None,
+                    cancel
+                )
+                for s in pending
+            ]
+            not_done = set(futures)
+            while not_done:
+                _, not_done = concurrent.futures.wait(not_done, timeout=0.5)
+                _write_segments(target, url, total_size, segments)
+                if inline is None or inline.complete:
+                    # Catch up on later segments while the rest still download
+                    hasher.update_from_disk(_contiguous_size(segments, total_size))
+                if app:
+                    downloaded = total_size - sum(s.end - s.start + 1 - s.done for s in segments)
+                    app.status(f"Downloading {target.name}…", downloaded / total_size)
+    finally:
+        os.close(fd)
+
+    for future in futures:
+        e = future.exception()
+        if isinstance(e, DownloadCancelled):
+            raise e
+        if isinstance(e, _RangeNotSatisfied):
+            logging.warning(f"Server did not honor byte ranges: {e}")
+            _segments_path(target).unlink(missing_ok=True)
+            target.unlink(missing_ok=True)
+            return False
+        elif e is not None:
+            logging.error(f"Error occurred during HTTP request: {e}")
+            return None
+
+    hasher.update_from_disk(total_size)
+    hasher.save()
+    _segments_path(target).unlink(missing_ok=True)
+    return True
 
 
 # FIXME: refactor to raise rather than return None
-def _net_get(url: str, target: Optional[Path]=None, app: Optional[App] = None):
+def _net_get(
+    url: str,
+    target: Optional[Path]=None,
+    app: Optional[App] = None,
+    cancel: Optional[threading.Event] = None
+):
+    """Downloads url into target, or returns its content if there's no target
+
+    Raises:
+        DownloadCancelled - if cancel was set, what was written so far is kept
+    """
     # TODO:
     # - Check available disk space before starting download
     logging.debug(f"Download source: {url}")
@@ -458,8 +1128,21 @@ def _net_get(url: str, target: Optional[Path]=None, app: Optional[App] = None):
     if target_props.size:
         logging.debug(f"File exists: {str(target_props.path)}")
 
+    if (
+        target_props.path is not None
+        and type(total_size) is int
+        and total_size >= SEGMENTED_DOWNLOAD_MIN_SIZE
+        and url_props.headers.get('Accept-Ranges') == 'bytes'
+    ):
+        result = _net_get_segmented(url_props, target_props.path, total_size, app, cancel)
+        if result is not False:
+            # Either the file was downloaded or there was a network error
+            return None
+        # Otherwise fall back to a single stream below.
+
     try_again = True
     last_size = None
+    hasher: Optional[DownloadHasher] = None
 
     while try_again:
         try_again = False
@@ -481,6 +1164,14 @@ def _net_get(url: str, target: Optional[Path]=None, app: Optional[App] = None):
 
         logging.debug(f"{chunk_size=}; {file_mode=}; {headers=}")
 
+        if target_props.path is not None:
+            _md5_state_path(target_props.path).unlink(missing_ok=True)
+            if file_mode == 'wb' or hasher is None:
+                hasher = DownloadHasher(target_props.path)
+            if file_mode == 'ab':
+                # Only reads from disk what wasn't hashed on a previous attempt.
+                hasher.update_from_disk(local_size)
+
         # Log download type.
         if 'Range' in headers.keys():
             message = f"Continuing download for {url_props.path}."
@@ -494,7 +1185,7 @@ def _net_get(url: str, target: Optional[Path]=None, app: Optional[App] = None):
             # One that writes into a file, and one that returns a str, 
             # that share most of the internal logic
             if target_props.path is None:  # return url content as text
-                with requests.get(url_props.path, headers=headers) as r:
+                with NetworkRequests.http().get(url_props.path, headers=headers) as r:
                     if callable(r):
                         logging.error("Failed to retrieve data from the URL.")
                         return None
@@ -524,7 +1215,7 @@ def _net_get(url: str, target: Optional[Path]=None, app: Optional[App] = None):
 
                     return r._content  # raw bytes
             else:  # download url to target.path
-                with requests.get(url_props.path, stream=True, headers=headers) as r:
+                with NetworkRequests.http().get(url_props.path, stream=True, headers=headers) as r:
                     with target_props.path.open(mode=file_mode) as f:
                         if file_mode == 'wb':
                             mode_text = 'Writing'
@@ -532,7 +1223,11 @@ def _net_get(url: str, target: Optional[Path]=None, app: Optional[App] = None):
                             mode_text = 'Appending'
                         logging.debug(f"{mode_text} data to file {target_props.path}.")
                         for chunk in r.iter_content(chunk_size=chunk_size):
+                            if cancel is not None and cancel.is_set():
+                                raise DownloadCancelled(url)
                             f.write(chunk)
+                            if hasher:
+                                hasher.update(chunk)
                             local_size = os.fstat(f.fileno()).st_size
                             if type(total_size) is int:
                                 percent = local_size / total_size
@@ -547,6 +1242,8 @@ def _net_get(url: str, target: Optional[Path]=None, app: Optional[App] = None):
                                         f"Downloading {target_props.path.name}…",
                                         percent
                                     )
+                if hasher:
+                    hasher.save()
         except requests.exceptions.RequestException as e:
             # If this was an incomplete read try again
             new_size = FileProps(target).size
@@ -571,15 +1268,26 @@ def _net_get(url: str, target: Optional[Path]=None, app: Optional[App] = None):
 def _verify_downloaded_file(url: str, file_path: Path | str, app: App, status_messages: bool = True): 
     if status_messages:
         app.status(f"Verifying {file_path}…", 0)
+    if _segments_path(file_path).exists():
+        logging.warning(f"{file_path} is a partial segmented download.")
+        return False
     file_props = FileProps(file_path)
     url_size = app.conf._network.url_size(url)
     if url_size is not None and file_props.size != url_size:
         logging.warning(f"{file_path} is the wrong size.")
         return False
     url_md5 = app.conf._network.url_md5(url)
-    if url_md5 is not None and file_props.md5 != url_md5:
-        logging.warning(f"{file_path} has the wrong MD5 sum.")
-        return False
+    if url_md5 is not None:
+        verified_files = app.conf._network.verified_files
+        if verified_files.md5(file_path) == url_md5:
+            logging.debug(f"{file_path} is unchanged since it was verified.")
+            return True
+        # Prefer the md5 computed while downloading over reading the file again
+        file_md5 = _read_md5_state(file_path) or file_props.md5
+        if file_md5 != url_md5:
+            logging.warning(f"{file_path} has the wrong MD5 sum.")
+            return False
+        verified_files.add(file_path, url_md5)
     logging.debug(f"{file_path} is verified.")
     return True
 
@@ -0,0 +1,367 @@
+"""Reads and writes a wine prefix's registry hives (user.reg/system.reg) directly.
+
+Starting wine just to query a value can take seconds when the wineserver isn't
+already running. The hives are plain text, so they can be read without wine.
+
+The wineserver keeps the registry in memory and saves it over these files,
+so they may only be written to while it isn't running.
+"""
+from dataclasses import dataclass
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+ROOT_ALIASES = {
+    "HKCU": "HKEY_CURRENT_USER",
+    "HKLM": "HKEY_LOCAL_MACHINE",
+    "HKCR": "HKEY_CLASSES_ROOT",
+    "HKU": "HKEY_USERS",
+}
+
+HIVE_FILES = {
+    "HKEY_CURRENT_USER": "user.reg",
+    "HKEY_LOCAL_MACHINE": "system.reg",
+}
+"""Registry roots that are stored in a hive file we understand"""
+
+_HEX_TYPES = {
+    "1": "REG_SZ",
+    "2": "REG_EXPAND_SZ",
+    "3": "REG_BINARY",
+    "4": "REG_DWORD",
+    "7": "REG_MULTI_SZ",
+    "b": "REG_QWORD",
+}
+
+_KEY_LINE = re.compile(r"^\[(.*)\](?:\s+(\d+))?\s*$")
+
+
+@dataclass
+class RegistryValue:
+    type: str
+    """REG_SZ, REG_DWORD, etc."""
+    data: str | int | bytes
+
+
+def split_key(key: str) -> tuple[str, str]:
+    """Splits a key like HKCU\\Software\\Wine into its full root name and the rest"""
+    root, _, rest = key.partition("\\")
+    return ROOT_ALIASES.get(root.upper(), root.upper()), rest
+
+
+def _unescape(text: str, pos: int) -> tuple[str, int]:
+    """Reads the quoted string starting at text[pos]
+
+    Returns:
+        The string and the position after the closing quote
+    """
+    assert text[pos] == '"'
+    pos += 1
+    output: list[str] = []
+    simple_escapes = {
+        "a": "\a", "b": "\b", "e": "\x1b", "f": "\f",
+        "n": "\n", "r": "\r", "t": "\t", "v": "\v",
+    }
+    while pos < len(text):
+        char = text[pos]
+        if char == '"':
+            return "".join(output), pos + 1
+        if char != "\\" or pos + 1 >= len(text):
+            output.append(char)
+            pos += 1
+            continue
+        pos += 1
+        char = text[pos]
+        if char in simple_escapes:
+            output.append(simple_escapes[char])
+            pos += 1
+        elif char == "x":
+            digits = re.match(r"[0-9a-fA-F]{1,4}", text[pos + 1:])
+            if digits:
+                output.append(chr(int(digits.group(), 16)))
+                pos += 1 + len(digits.group())
+            else:
+                output.append(char)
+                pos += 1
+        elif char in "01234567":
+            digits = re.match(r"[0-7]{1,3}", text[pos:])
+            assert digits
+            output.append(chr(int(digits.group(), 8)))
+            pos += len(digits.group())
+        else:
+            output.append(char)
+            pos += 1
+    raise ValueError(f"Unterminated string: {text}")
+
+
+def _escape(text: str) -> str:
+    """Quotes text the way wine writes strings in its hives"""
+    output = ['"']
+    for char in text:
+        if char in ('"', "\\"):
+            output.append("\\" + char)
+        elif char == "\n":
+            output.append("\\n")
+        elif char == "\r":
+            output.append("\\r")
+        elif char == "\t":
+            output.append("\\t")
+        elif ord(char) < 32 or ord(char) > 126:
+            output.append(f"\\x{ord(char):04x}")
+        else:
+            output.append(char)
+    output.append('"')
+    return "".join(output)
+
+
+def _parse_data(data: str) -> RegistryValue:
+    if data.startswith('"'):
+        return RegistryValue("REG_SZ", _unescape(data, 0)[0])
+    if data.startswith("dword:"):
+        return RegistryValue("REG_DWORD", int(data[len("dword:"):], 16))
+    match = re.match(r"str\((\w+)\):", data)
+    if match:
+        value_type = _HEX_TYPES.get(match.group(1), "REG_SZ")
+        return RegistryValue(value_type, _unescape(data, match.end())[0])
+    match = re.match(r"hex(?:\((\w+)\))?:", data)
+    if match:
+        value_type = _HEX_TYPES.get(match.group(1) or "3", "REG_BINARY")
+        hex_bytes = data[match.end():].replace("\\", "").replace(" ", "")
+        raw = bytes(int(b, 16) for b in hex_bytes.split(",") if b)
+        if value_type in ("REG_SZ", "REG_EXPAND_SZ", "REG_MULTI_SZ"):
+            return RegistryValue(value_type, raw.decode("utf-16-le").rstrip("\0"))
+        if value_type in ("REG_DWORD", "REG_QWORD"):
+            return RegistryValue(value_type, int.from_bytes(raw, "little"))
+        return RegistryValue(value_type, raw)
+    raise ValueError(f"Unknown registry data: {data}")
+
+
+def format_value(value: RegistryValue) -> str:
+    """Formats the data of a value as it appears after the = in a hive"""
+    if value.type == "REG_SZ" and isinstance(value.data, str):
+        return _escape(value.data)
+    if value.type == "REG_DWORD" and isinstance(value.data, int):
+        return f"dword:{value.data:08x}"
+    raise ValueError(f"Writing {value.type} values isn't supported")
+
+
+def _parse_name(line: str) -> Optional[tuple[str, str]]:
+    """Splits a value line into its name and data"""
+    if line.startswith("@="):
+        return "", line[2:]
+    if not line.startswith('"'):
+        return None
+    name, end = _unescape(line, 0)
+    if line[end:end + 1] != "=":
+        return None
+    return name, line[end + 1:]
+
+
+def _logical_lines(lines: list[str]) -> list[tuple[int, int, str]]:
+    """Joins lines continued with a trailing backslash (long hex values).
+
+    Returns:
+        (first line index, index after the last line, joined text)
+    """
+    output = []
+    i = 0
+    while i < len(lines):
+        start = i
+        text = lines[i].rstrip("\n")
+        while text.endswith("\\") and i + 1 < len(lines):
+            i += 1
+            text = text[:-1] + lines[i].strip()
+        i += 1
+        output.append((start, i, text))
+    return output
+
+
+def _parse_key(line: str) -> Optional[str]:
+    match = _KEY_LINE.match(line)
+    if not match:
+        return None
+    # Key names are escaped like strings ("\\" separates the parts)
+    return _unescape(f'"{match.group(1)}"', 0)[0]
+
+
+def parse_hive(text: str) -> dict[str, dict[str, RegistryValue]]:
+    """Parses a hive into lowercased key -> lowercased value name -> value"""
+    keys: dict[str, dict[str, RegistryValue]] = {}
+    values: Optional[dict[str, RegistryValue]] = None
+    for _, _, line in _logical_lines(text.splitlines()):
+        if line.startswith("["):
+            key = _parse_key(line)
+            values = keys.setdefault(key.lower(), {}) if key is not None else None
+            continue
+        if values is None:
+            continue
+        try:
+            parsed = _parse_name(line)
+            if parsed is None:
+                continue
+            name, data = parsed
+            values[name.lower()] = _parse_data(data)
+        except ValueError as e:
+            logging.debug(f"Skipping registry line {line!r}: {e}")
+    return keys
+
+
+_hives: dict[str, tuple[tuple[int, int, int], dict[str, dict[str, RegistryValue]]]] = {}
+_hives_lock = threading.Lock()
+
+
+def _load_hive(path: Path) -> Optional[dict[str, dict[str, RegistryValue]]]:
+    """Parses a hive, reusing the last parse if the file hasn't changed"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    # Both wine and write_values replace the file, so the inode changes as well
+    fingerprint = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    with _hives_lock:
+        cached = _hives.get(str(path))
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+    keys = parse_hive(path.read_text(encoding="utf-8", errors="surrogateescape"))
+    with _hives_lock:
+        _hives[str(path)] = fingerprint, keys
+    return keys
+
+
+def hive_path(wine_prefix: str | Path, key: str) -> Optional[Path]:
+    root, _ = split_key(key)
+    if root not in HIVE_FILES:
+        return None
+    return Path(wine_prefix) / HIVE_FILES[root]
+
+
+def read_value(wine_prefix: str | Path, key: str, name: str) -> tuple[bool, Optional[RegistryValue]]:
+    """Reads a value straight from the hive.
+
+    Returns:
+        (whether the hive could be read, the value if it exists)
+    """
+    path = hive_path(wine_prefix, key)
+    if path is None:
+        return False, None
+    keys = _load_hive(path)
+    if keys is None:
+        return False, None
+    _, subkey = split_key(key)
+    values = keys.get(subkey.lower())
+    if values is None:
+        return True, None
+    return True, values.get(name.lower())
+
+
+def wineserver_running(wine_prefix: str | Path) -> bool:
+    """Whether a wineserver has this prefix open.
+
+    The wineserver creates its socket in a directory named after the device and
+    inode of the prefix. A stale socket (after a crash) reads as running, which
+    only means we fall back to going through wine.
+    """
+    try:
+        stat = os.stat(wine_prefix)
+    except OSError:
+        return False
+    server_dir = Path(f"/tmp/.wine-{os.getuid()}/server-{stat.st_dev:x}-{stat.st_ino:x}")
+    return (server_dir / "socket").exists()
+
+
+def _filetime(seconds: float) -> int:
+    """Unix time to a Windows FILETIME (100ns intervals since 1601)"""
+    return int((seconds + 11644473600) * 10_000_000)
+
+
+def write_values(wine_prefix: str | Path, edits: dict[str, dict[str, RegistryValue]]) -> bool:
+    """Writes values into the prefix's hives without starting wine.
+
+    Only call this while the wineserver isn't running, otherwise it will
+    overwrite these changes when it next saves.
+
+    Returns:
+        False if nothing was written because a key isn't in a hive we can edit
+    """
+    by_hive: dict[Path, dict[str, dict[str, RegistryValue]]] = {}
+    for key, values in edits.items():
+        path = hive_path(wine_prefix, key)
+        if path is None or not path.is_file():
+            return False
+        _, subkey = split_key(key)
+        by_hive.setdefault(path, {})[subkey] = values
+
+    for path, hive_edits in by_hive.items():
+        lines = path.read_text(encoding="utf-8", errors="surrogateescape").splitlines()
+        for subkey, values in hive_edits.items():
+            lines = _set_values(lines, subkey, values)
+        # Replace the file in one step so a crash can't leave a partial hive
+        with tempfile.NamedTemporaryFile(
+            "w",
+            dir=path.parent,
+            prefix=f".{path.name}.",
+            delete=False,
+            encoding="utf-8",
+            errors="surrogateescape",
+        ) as f:
+            f.write("\n".join(lines) + "\n")
+        os.chmod(f.name, path.stat().st_mode)
+        os.replace(f.name, path)
+        logging.debug(f"Wrote {sum(len(v) for v in hive_edits.values())} value(s) to {path}")
+    return True
+
+
+def _set_values(lines: list[str], subkey: str, values: dict[str, RegistryValue]) -> list[str]:
+    """Returns lines with values set under subkey, adding the key if needed"""
+    logical = _logical_lines(lines)
+    section_start = None
+    section_end = len(lines)
+    for start, end, text in logical:
+        if text.startswith("["):
+            if section_start is not None:
+                section_end = start
+                break
+            key = _parse_key(text)
+            if key is not None and key.lower() == subkey.lower():
+                section_start = end
+
+    remaining = {name.lower(): (name, value) for name, value in values.items()}
+    if section_start is None:
+        now = time.time()
+        if lines and lines[-1].strip():
+            lines.append("")
+        escaped_key = subkey.replace("\\", "\\\\")
+        lines.append(f"[{escaped_key}] {int(now)}")
+        lines.append(f"#time={_filetime(now):x}")
+        for name, value in remaining.values():
+            lines.append(_value_line(name, value))
+        return lines
+
+    output = lines[:section_start]
+    last_value = section_start
+    for start, end, text in logical:
+        if start < section_start or start >= section_end:
+            continue
+        parsed = _parse_name(text)
+        if parsed is not None and parsed[0].lower() in remaining:
+            name, value = remaining.pop(parsed[0].lower())
+            output.append(_value_line(parsed[0], value))
+        else:
+            output.extend(lines[start:end])
+        if text.strip():
+            last_value = len(output)
+    # New values go after the key's existing values
+    output[last_value:last_value] = [_value_line(name, value) for name, value in remaining.values()]
+    output.extend(lines[section_end:])
+    return output
+
+
+def _value_line(name: str, value: RegistryValue) -> str:
+    if name == "":
+        return f"@={format_value(value)}"
+    return f"{_escape(name)}={format_value(value)}"
@@ -60,11 +60,13 @@ def detect_broken_install(
 
     # Recovery is best-effort we don't want to crash the app on account of failures here
     try:
-        with ou_dedetai.database.LocalUserPreferencesManager(logos_app_dir, logos_user_id) as db: 
+        with ou_dedetai.database.LocalUserPreferencesManager(
+            logos_app_dir, logos_user_id, read_only=True
+        ) as db:
             app_local_preferences = db.app_local_preferences
             if (
                 app_local_preferences
-                and 'FirstRunDialogWizardState="ResourceBundleSelection"' in db.app_local_preferences 
+                and 'FirstRunDialogWizardState="ResourceBundleSelection"' in app_local_preferences
             ):
                 # We're in first-run state.
                 first_run = True
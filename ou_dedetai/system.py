@@ -5,6 +5,7 @@ import logging
 import os
 import psutil
 import platform
+import select
 import shutil
 import struct
 import subprocess
@@ -16,7 +17,7 @@ from collections.abc import MutableMapping
 from dataclasses import dataclass
 from packaging.version import Version
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Iterable, Optional, Tuple
 
 from ou_dedetai import constants, network, wine
 from ou_dedetai.app import App
@@ -228,16 +229,124 @@ def popen_command(command, retries=1, delay=0, **kwargs) -> Optional[subprocess.
 
 
 def get_pids(query) -> list[psutil.Process]:
-    results = []
-    for process in psutil.process_iter(['pid', 'name', 'cmdline']):
+    return get_pids_by_cmdline([query])[query]
+
+
+def get_pids_by_cmdline(queries: Iterable[str]) -> dict[str, list[psutil.Process]]:
+    """Finds the processes with each query as one of their arguments.
+
+    The process table is only walked once no matter how many queries there are.
+
+    Returns:
+        query -> processes (empty if none matched)
+    """
+    wanted = set(queries)
+    results: dict[str, list[psutil.Process]] = {query: [] for query in wanted}
+    if not wanted:
+        return results
+    proc = Path("/proc")
+    if not proc.is_dir():
+        for process in psutil.process_iter(['pid', 'name', 'cmdline']):
+            try:
+                cmdline = process.info['cmdline']
+                if cmdline is not None:
+                    for query in wanted.intersection(cmdline):
+                        results[query].append(process)
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass
+        return results
+
+    # Cheap substring check on the raw bytes before splitting the arguments
+    needles = [os.fsencode(query) for query in wanted]
+    for entry in os.scandir(proc):
+        if not entry.name.isdigit():
+            continue
         try:
-            if process.info['cmdline'] is not None and query in process.info['cmdline']:
-                results.append(process)
+            with open(f"{entry.path}/cmdline", "rb") as f:
+                raw = f.read()
+        except OSError:
+            # Exited while we were scanning or not ours to read
+            continue
+        if not any(needle in raw for needle in needles):
+            continue
+        args = {os.fsdecode(arg) for arg in raw.split(b"\0")}
+        matches = wanted.intersection(args)
+        if not matches:
+            continue
+        try:
+            process = psutil.Process(int(entry.name))
         except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass
+            continue
+        for query in matches:
+            results[query].append(process)
     return results
 
 
+class ProcessExitWatcher:
+    """Sleeps until a process exits or we're woken up, instead of polling.
+
+    Uses pidfds where the kernel supports them (Linux 5.3+), which become
+    readable the moment the process exits. Otherwise checks the pids once a
+    second.
+    """
+    def __init__(self) -> None:
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+
+    def wake(self):
+        """Makes a wait() in progress (or the next one) return right away"""
+        try:
+            os.write(self._wake_write, b"\0")
+        except BlockingIOError:
+            # Already has a wake up pending
+            pass
+
+    def _drain(self):
+        try:
+            while os.read(self._wake_read, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self, pids: Iterable[int], timeout: float) -> bool:
+        """Waits for any of pids to exit.
+
+        Returns:
+            False if the timeout was reached without anything happening
+        """
+        pidfds: list[int] = []
+        try:
+            for pid in set(pids):
+                try:
+                    pidfds.append(os.pidfd_open(pid))
+                except ProcessLookupError:
+                    # Already gone
+                    self._drain()
+                    return True
+                except (AttributeError, OSError):
+                    # pidfds aren't supported
+                    return self._poll(pids, timeout)
+            readable, _, _ = select.select([self._wake_read, *pidfds], [], [], timeout)
+            self._drain()
+            return bool(readable)
+        finally:
+            for fd in pidfds:
+                os.close(fd)
+
+    def _poll(self, pids: Iterable[int], timeout: float) -> bool:
+        pids = set(pids)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([self._wake_read], [], [], min(1, remaining))
+            if readable or not all(psutil.pid_exists(pid) for pid in pids):
+                self._drain()
+                return True
+
+
 def reboot(superuser_command: str):
     logging.info("Rebooting system.")
     command = f"{superuser_command} reboot now"
@@ -56,6 +56,7 @@ class TUI(App):
         self.todo_q: Queue[str] = Queue()
         self.todo_e = threading.Event()
         self.choice_q: Queue[str] = Queue()
+        self.logos_state_changed = threading.Event()
 
         # Install and Options
         self.password_q: Queue[str] = Queue()
@@ -472,6 +473,7 @@ class TUI(App):
 
         self.active_screen = self.main_screen
         check_resize_last_time = last_time = time.time()
+        self.start_thread(self.logos.watch, self.logos_state_changed.set)
 
         while self.is_running:
             # A worker thread (e.g. the memory watchdog) may have asked us to
@@ -514,9 +516,11 @@ class TUI(App):
                             self.active_screen = self.tui_screens[-1]
 
                     if not isinstance(self.active_screen, tui_screen.DialogScreen):
-                        run_monitor, last_time = utils.stopwatch(last_time, 2.5)
-                        if run_monitor:
-                            self.logos.monitor()
+                        # Logos state is kept up to date by the watch thread,
+                        # refresh right away when it changes.
+                        refresh_options, last_time = utils.stopwatch(last_time, 2.5)
+                        if refresh_options or self.logos_state_changed.is_set():
+                            self.logos_state_changed.clear()
                             self.main_screen.set_options(self.set_tui_menu_options())
 
                     if isinstance(self.active_screen, tui_screen.CursesScreen):
@@ -1,6 +1,10 @@
 import atexit
+import concurrent.futures
+from dataclasses import dataclass
 from datetime import datetime
 import enum
+import fcntl
+import glob
 import inspect
 import json
 import logging
@@ -18,7 +22,7 @@ import time
 from ou_dedetai.app import App
 from packaging.version import Version
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 
 from . import constants
 from . import network
@@ -209,6 +213,8 @@ def get_winebin_code_and_desc(app: App, binary) -> Tuple[str, str | None]:
 
 
 def get_wine_options(app: App) -> List[str]:
+    # Look for both kinds at the same time
+    app.conf.find_wine_files()
     appimages = app.conf.wine_app_image_files
     binaries = app.conf.wine_binary_files
     logging.debug(f"{appimages=}")
@@ -267,24 +273,142 @@ def enough_disk_space(dest_dir, bytes_required: int) -> bool:
     return free_bytes > bytes_required
 
 
+SCAN_WORKERS = 8
+"""Directories listed at once by scan_tree"""
+
+
+@dataclass
+class ScannedFile:
+    path: Path
+    size: int
+    mtime_ns: int
+    inode: Optional[Tuple[int, int]] = None
+    """(device, inode) if the file has other hardlinks"""
+
+
+@dataclass
+class TreeScan:
+    dirs: List[Path]
+    """Every directory, parents before their children"""
+    files: List[ScannedFile]
+    """Regular files. Sockets, fifos etc. are skipped"""
+    size: int
+    """Bytes used by the files and directories, hardlinked files counted once"""
+
+
+def _scanned_file(path: Path, st: os.stat_result) -> ScannedFile:
+    inode = (st.st_dev, st.st_ino) if st.st_nlink > 1 else None
+    return ScannedFile(path, st.st_size, st.st_mtime_ns, inode)
+
+
+def _scan_entries(
+    directory: Path,
+    follow_symlinks: bool,
+) -> Tuple[List[Path], List[ScannedFile], int]:
+    """Lists one directory.
+
+    Returns:
+        Its subdirectories, its files and the bytes used by the subdirectories' entries
+    """
+    subdirs: List[Path] = []
+    files: List[ScannedFile] = []
+    dir_bytes = 0
+    try:
+        entries = os.scandir(directory)
+    except OSError as e:
+        logging.warning(f"Couldn't list {directory}: {e}")
+        return subdirs, files, dir_bytes
+    with entries:
+        for entry in entries:
+            try:
+                # The type usually comes with the listing, so only files and
+                # directories cost a stat
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    dir_bytes += entry.stat(follow_symlinks=follow_symlinks).st_size
+                    subdirs.append(Path(entry.path))
+                elif entry.is_file(follow_symlinks=follow_symlinks):
+                    files.append(_scanned_file(Path(entry.path), entry.stat(follow_symlinks=follow_symlinks)))
+            except OSError as e:
+                # e.g. a broken symlink, or removed while we were looking
+                logging.debug(f"Skipping {entry.path}: {e}")
+    return subdirs, files, dir_bytes
+
+
+def _scan_subtree(root: Path, follow_symlinks: bool) -> Tuple[List[Path], List[ScannedFile], int]:
+    dirs: List[Path] = []
+    files: List[ScannedFile] = []
+    dir_bytes = 0
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        dirs.append(directory)
+        subdirs, found, size = _scan_entries(directory, follow_symlinks)
+        stack.extend(reversed(subdirs))
+        files.extend(found)
+        dir_bytes += size
+    return dirs, files, dir_bytes
+
+
+def scan_tree(
+    roots: List[Path] | Tuple[Path, ...],
+    follow_symlinks: bool = False,
+    max_workers: int = SCAN_WORKERS,
+) -> TreeScan:
+    """Lists and sizes everything under roots in one pass.
+
+    The subdirectories directly under each root are walked in parallel.
+    Roots that don't exist are ignored.
+    """
+    dirs: List[Path] = []
+    files: List[ScannedFile] = []
+    dir_bytes = 0
+    subtrees: List[Path] = []
+    for root in roots:
+        root = Path(root)
+        try:
+            st = root.stat() if follow_symlinks else root.lstat()
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            files.append(_scanned_file(root, st))
+            continue
+        if not stat.S_ISDIR(st.st_mode):
+            continue
+        dirs.append(root)
+        dir_bytes += st.st_size
+        subdirs, found, size = _scan_entries(root, follow_symlinks)
+        subtrees.extend(subdirs)
+        files.extend(found)
+        dir_bytes += size
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for sub_dirs, sub_files, size in executor.map(
+            lambda d: _scan_subtree(d, follow_symlinks), subtrees
+        ):
+            dirs.extend(sub_dirs)
+            files.extend(sub_files)
+            dir_bytes += size
+
+    file_bytes = 0
+    seen_inodes = set()
+    for file in files:
+        if file.inode is not None:
+            if file.inode in seen_inodes:
+                continue
+            seen_inodes.add(file.inode)
+        file_bytes += file.size
+    return TreeScan(dirs, files, dir_bytes + file_bytes)
+
+
 def get_path_size(file_path: Path|str) -> int:
-    file_path = Path(file_path)
-    if not file_path.exists():
-        path_size = 0
-    else:
-        path_size = sum(f.stat().st_size for f in file_path.rglob('*')) + file_path.stat().st_size
-    return path_size
+    return scan_tree([Path(file_path)]).size
 
 
 def get_folder_group_size(
     src_dirs: List[Path] | Tuple[Path],
     q: queue.Queue[int] | None = None,
 ) ->  int:
-    src_size = 0
-    for d in src_dirs:
-        if not d.is_dir():
-            continue
-        src_size += get_path_size(d)
+    src_size = scan_tree([d for d in src_dirs if d.is_dir()]).size
     if q is not None:
         q.put(src_size)
 
@@ -425,74 +549,166 @@ def check_appimage(filestr):
         return False
 
 
-def find_appimage_files(app: App) -> list[str]:
-    release_version = app.conf.installed_faithlife_product_release or app.conf.faithlife_product_release 
-    appimages = []
-    directories = [
-        app.conf.installer_binary_dir,
-        os.path.expanduser("~") + "/bin",
-        app.conf.download_dir
-    ]
-    if app.conf._overrides.custom_binary_path is not None:
-        directories.append(app.conf._overrides.custom_binary_path)
+def _read_executable_header(path: Path) -> Optional[bytes]:
+    """First bytes of a file, enough to tell ELF/AppImage/script apart"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(16)
+    except OSError:
+        return None
 
-    if sys.version_info < (3, 12):
-        raise RuntimeError("Python 3.12 or higher is required for .rglob() flag `case-sensitive` ")
 
-    for d in directories:
-        appimage_paths = Path(d).glob('wine*.appimage', case_sensitive=False)
-        for p in appimage_paths:
-            if p is not None and check_appimage(p):
-                output1, output2 = wine.check_wine_version_and_branch(
-                    release_version,
-                    p,
-                    app.conf.faithlife_product_version
-                )
-                if output1 is not None and output1:
-                    appimages.append(str(p))
-                else:
-                    logging.info(f"AppImage file {p} not added: {output2}")
+def _is_usable_appimage_header(header: bytes) -> bool:
+    # See is_appimage for the format. Only type 2 AppImages are supported.
+    return header[1:4] == b'ELF' and header[8:10] == b'AI' and header[10:11] == b'\x02'
 
-    return appimages
 
+def _is_executable_header(header: bytes) -> bool:
+    return header[:4] == b'\x7fELF' or header[:2] == b'#!'
 
-def find_wine_binary_files(app: App, release_version: Optional[str]) -> list[str]:
-    wine_binary_path_list = [
+
+def _wine_binary_roots(app: App) -> list[Path]:
+    """Directories that may hold a wine64, in order of preference.
+
+    Extra directories are appended to a copy of PATH, the environment
+    itself is left untouched.
+    """
+    home = os.path.expanduser("~")
+    extra_dirs = [
         "/usr/local/bin",
-        os.path.expanduser("~") + "/bin",
-        os.path.expanduser("~") + "/PlayOnLinux/wine/linux-amd64/*/bin",
-        os.path.expanduser("~") + "/.steam/steam/steamapps/common/Proton*/files/bin",
+        f"{home}/bin",
+        f"{home}/PlayOnLinux/wine/linux-amd64/*/bin",
+        f"{home}/.steam/steam/steamapps/common/Proton*/files/bin",
     ]
+    if app.conf._overrides.custom_binary_path is not None:
+        extra_dirs.append(app.conf._overrides.custom_binary_path)
+
+    roots = [Path(p) for p in os.environ.get('PATH', '').split(os.pathsep) if p]
+    for pattern in extra_dirs:
+        roots.extend(Path(p) for p in sorted(glob.glob(pattern)))
+    return list(dict.fromkeys(roots))
+
 
+def _appimage_roots(app: App) -> list[Path]:
+    roots = [
+        Path(app.conf.installer_binary_dir),
+        Path(os.path.expanduser("~")) / "bin",
+        Path(app.conf.download_dir),
+    ]
     if app.conf._overrides.custom_binary_path is not None:
-        wine_binary_path_list.append(app.conf._overrides.custom_binary_path)
-
-    # Temporarily modify PATH for additional WINE64 binaries.
-    for p in wine_binary_path_list:
-        if p not in os.environ['PATH'] and os.path.isdir(p):
-            os.environ['PATH'] = os.environ['PATH'] + os.pathsep + p
-
-    # Check each directory in PATH for wine64; add to list
-    binaries = []
-    paths = os.environ["PATH"].split(":")
-    for path in paths:
-        binary_path = os.path.join(path, "wine64")
-        if os.path.exists(binary_path) and os.access(binary_path, os.X_OK):
-            binaries.append(binary_path)
-
-    for binary in binaries[:]:
-        output1, output2 = wine.check_wine_version_and_branch(
-            release_version,
-            binary,
-            app.conf.faithlife_product_version
+        roots.append(Path(app.conf._overrides.custom_binary_path))
+    return list(dict.fromkeys(roots))
+
+
+def _scan_wine_binary_root(root: Path) -> list[Path]:
+    binary_path = root / "wine64"
+    if not os.access(binary_path, os.X_OK):
+        return []
+    header = _read_executable_header(binary_path)
+    if header is None or not _is_executable_header(header):
+        return []
+    return [binary_path]
+
+
+def _scan_appimage_root(root: Path) -> list[Path]:
+    found = []
+    for path in sorted(root.glob('wine*.appimage', case_sensitive=False)):
+        header = _read_executable_header(path)
+        if header is not None and _is_usable_appimage_header(header):
+            found.append(path)
+    return found
+
+
+def discover_wine_candidates(
+    roots: list[Path],
+    scan: Callable[[Path], list[Path]],
+    release_version: Optional[str],
+    faithlife_product_version: str
+) -> list[str]:
+    """Scans all roots at once and checks the wine version of what it finds.
+
+    Returns:
+        Usable binaries, in the order of roots
+    """
+    def scan_and_check(root: Path) -> list[Path]:
+        paths = scan(root)
+        # Each root's binaries are probed as soon as it has been scanned
+        releases = wine.get_wine_releases([str(path) for path in paths if os.access(path, os.X_OK)])
+        usable = []
+        for path in paths:
+            ok, reason = wine.check_wine_version_and_branch(
+                release_version,
+                path,
+                faithlife_product_version,
+                releases.get(str(path))
+            )
+            if not ok:
+                logging.info(f"Wine binary {path} not added: {reason}")
+                continue
+            usable.append(path)
+        return usable
+
+    with concurrent.futures.ThreadPoolExecutor(thread_name_prefix="wine-discovery") as executor:
+        scans = [executor.submit(scan_and_check, root) for root in roots]
+        found = []
+        seen = set()
+        for scanned in scans:
+            for path in scanned.result():
+                if str(path) not in seen:
+                    seen.add(str(path))
+                    found.append(str(path))
+    return found
+
+
+@dataclass
+class WineSearch:
+    """Where to look for wine binaries and which versions are usable.
+
+    Reading config values can prompt the user and write the config, so they're
+    resolved on the calling thread when this is made. Only plain values are
+    handed to the scanning threads.
+    """
+    roots: list[Path]
+    scan: Callable[[Path], list[Path]]
+    release_version: Optional[str]
+    faithlife_product_version: str
+
+    def run(self) -> list[str]:
+        return discover_wine_candidates(
+            self.roots,
+            self.scan,
+            self.release_version,
+            self.faithlife_product_version
         )
-        if output1 is not None and output1:
-            continue
-        else:
-            binaries.remove(binary)
-            logging.info(f"Removing binary: {binary} because: {output2}")
 
-    return binaries
+
+def appimage_search(app: App) -> WineSearch:
+    release_version = app.conf.installed_faithlife_product_release or app.conf.faithlife_product_release 
+    if sys.version_info < (3, 12):
+        raise RuntimeError("Python 3.12 or higher is required for .rglob() flag `case-sensitive` ")
+    return WineSearch(
+        _appimage_roots(app),
+        _scan_appimage_root,
+        release_version,
+        app.conf.faithlife_product_version
+    )
+
+
+def wine_binary_search(app: App, release_version: Optional[str]) -> WineSearch:
+    return WineSearch(
+        _wine_binary_roots(app),
+        _scan_wine_binary_root,
+        release_version,
+        app.conf.faithlife_product_version
+    )
+
+
+def find_appimage_files(app: App) -> list[str]:
+    return appimage_search(app).run()
+
+
+def find_wine_binary_files(app: App, release_version: Optional[str]) -> list[str]:
+    return wine_binary_search(app, release_version).run()
 
 
 def set_appimage_symlink(app: App):
@@ -603,6 +819,41 @@ def grep(regexp, filepath):
         raise e
 
 
+FICLONE = 0x40049409
+"""ioctl request to share a file's extents (reflink) on btrfs/xfs"""
+
+
+def link_or_copy(src: Path | str, dst: Path | str) -> None:
+    """Makes dst have the same contents as src without writing the data again if possible.
+
+    Tries a hardlink, then a reflink, then falls back to a copy.
+    """
+    src = Path(src)
+    dst = Path(dst)
+    if dst.is_dir():
+        dst = dst / src.name
+    if dst.exists():
+        if os.path.samefile(src, dst):
+            return
+        dst.unlink()
+    try:
+        os.link(src, dst)
+        logging.debug(f"Hardlinked {src} to {dst}")
+        return
+    except OSError as e:
+        logging.debug(f"Failed to hardlink {src} to {dst}: {e}")
+    try:
+        with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        shutil.copymode(src, dst)
+        logging.debug(f"Reflinked {src} to {dst}")
+        return
+    except OSError as e:
+        logging.debug(f"Failed to reflink {src} to {dst}: {e}")
+    shutil.copy(src, dst)
+    logging.debug(f"Copied {src} to {dst}")
+
+
 def untar_file(file_path, output_dir):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -1,17 +1,22 @@
-from dataclasses import dataclass
+import concurrent.futures
+from dataclasses import asdict, dataclass
+import json
 import logging
 import os
 import shutil
 import subprocess
-from pathlib import Path
+import tarfile
+from pathlib import Path, PurePosixPath
 from packaging.version import Version
 import tempfile
-from typing import IO, Optional
+import threading
+from typing import IO, Callable, Optional
 
 from ou_dedetai import constants
 from ou_dedetai.app import App
 
 from . import network
+from . import registry
 from . import system
 from . import utils
 
@@ -71,8 +76,104 @@ def get_devel_or_stable(version: str) -> str:
         return 'devel'
 
 
-# FIXME: consider raising exceptions on error
+class WineReleaseCache:
+    """Releases of the wine binaries we've already probed.
+
+    Running `wine --version` takes a while (for AppImages it means mounting
+    the image), so the result is kept keyed by the binary's real path along
+    with its size, mtime and inode. If any of those change it's probed again.
+    """
+
+    def __init__(self, entries: Optional[dict[str, dict]] = None) -> None:
+        self._entries: dict[str, dict] = entries or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls) -> "WineReleaseCache":
+        path = Path(constants.WINE_RELEASES_CACHE_PATH)
+        if path.exists():
+            try:
+                return WineReleaseCache(json.loads(path.read_text()))
+            except json.JSONDecodeError:
+                logging.warning("Failed to read wine releases JSON. Clearing…")
+        return WineReleaseCache()
+
+    def _write(self) -> None:
+        path = Path(constants.WINE_RELEASES_CACHE_PATH)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        with open(path, "w") as f:
+            json.dump(self._entries, f, indent=4, sort_keys=True)
+            f.write("\n")
+
+    @staticmethod
+    def _fingerprint(binary: str) -> Optional[tuple[str, dict]]:
+        try:
+            realpath = os.path.realpath(binary)
+            stat = os.stat(realpath)
+        except OSError:
+            return None
+        return realpath, {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+    def get(self, binary: str) -> Optional[WineRelease]:
+        fingerprint = self._fingerprint(binary)
+        if fingerprint is None:
+            return None
+        realpath, expected = fingerprint
+        with self._lock:
+            entry = self._entries.get(realpath)
+        if entry is None or any(entry.get(k) != v for k, v in expected.items()):
+            return None
+        return WineRelease(**entry["release"])
+
+    def add(self, binary: str, release: WineRelease):
+        fingerprint = self._fingerprint(binary)
+        if fingerprint is None:
+            return
+        realpath, entry = fingerprint
+        with self._lock:
+            self._entries[realpath] = {**entry, "release": asdict(release)}
+            self._write()
+
+
+_release_cache: Optional[WineReleaseCache] = None
+_release_cache_lock = threading.Lock()
+
+
+def _get_release_cache() -> WineReleaseCache:
+    global _release_cache
+    with _release_cache_lock:
+        if _release_cache is None:
+            _release_cache = WineReleaseCache.load()
+        return _release_cache
+
+
 def get_wine_release(binary: str) -> tuple[Optional[WineRelease], str]:
+    """Returns the release of the wine binary, only running it if it changed"""
+    cache = _get_release_cache()
+    wine_release = cache.get(binary)
+    if wine_release is not None:
+        logging.debug(f"Wine release of {binary} (cached): {str(wine_release)}")
+        return wine_release, "yes"
+    wine_release, message = _probe_wine_release(binary)
+    if wine_release is not None:
+        cache.add(binary, wine_release)
+    return wine_release, message
+
+
+def get_wine_releases(binaries: list[str]) -> dict[str, tuple[Optional[WineRelease], str]]:
+    """get_wine_release for many binaries, probing the uncached ones in parallel"""
+    binaries = list(dict.fromkeys(str(b) for b in binaries))
+    if not binaries:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(8, len(binaries)),
+        thread_name_prefix="wine-version"
+    ) as executor:
+        return dict(zip(binaries, executor.map(get_wine_release, binaries)))
+
+
+# FIXME: consider raising exceptions on error
+def _probe_wine_release(binary: str) -> tuple[Optional[WineRelease], str]:
     cmd = [binary, "--version"]
     try:
         version_string = subprocess.check_output(cmd, encoding='utf-8').strip()
@@ -209,7 +310,9 @@ def check_wine_rules(
 
 
 def check_wine_version_and_branch(release_version: Optional[str], test_binary,
-                                  faithlife_product_version):
+                                  faithlife_product_version,
+                                  wine_release_result: Optional[tuple[Optional[WineRelease], str]] = None):
+    """wine_release_result is the get_wine_release of test_binary, if it was already probed"""
     if not os.path.exists(test_binary):
         reason = "Binary does not exist."
         return False, reason
@@ -218,7 +321,9 @@ def check_wine_version_and_branch(release_version: Optional[str], test_binary,
         reason = "Binary is not executable."
         return False, reason
 
-    wine_release, error_message = get_wine_release(test_binary)
+    if wine_release_result is None:
+        wine_release_result = get_wine_release(test_binary)
+    wine_release, error_message = wine_release_result
 
     if wine_release is None:
         return False, error_message
@@ -253,7 +358,12 @@ def initializeWineBottle(wine64_binary: str, app: App):
     )
 
 
-def set_win_version(app: App, exe: str, windows_version: str):
+def set_win_version(
+    app: App,
+    exe: str,
+    windows_version: str,
+    transaction: Optional["RegistryTransaction"] = None
+):
     if exe == "logos":
         # This operation is equivilent to f"winetricks -q settings {windows_version}"
         # but faster
@@ -265,21 +375,10 @@ def set_win_version(app: App, exe: str, windows_version: str):
 
     elif exe == "indexer":
         reg = f"HKCU\\Software\\Wine\\AppDefaults\\{app.conf.faithlife_product}Indexer.exe"
-        exe_args = [
-            'add',
-            reg,
-            "/v", "Version",
-            "/t", "REG_SZ",
-            "/d", f"{windows_version}", "/f",
-            ]
-        process = run_wine_during_install(
-            app,
-            app.conf.wine_binary,
-            exe='reg',
-            exe_args=exe_args
-        )
-        if process is None:
-            app.exit("Failed to spawn command to set windows version for indexer")
+
+        def edit(transaction: RegistryTransaction):
+            transaction.set_string(reg, "Version", windows_version)
+        _apply_now(app, app.conf.wine_binary, 'set-indexer-win-version.reg', edit, transaction)
 
 
 def wine_reg_query(app: App, key_name: str, value_name: str) -> Optional[str]:
@@ -295,6 +394,13 @@ def wine_reg_query(app: App, key_name: str, value_name: str) -> Optional[str]:
 
     ```
     """
+    if not registry.wineserver_running(app.conf.wine_prefix):
+        found_hive, value = registry.read_value(app.conf.wine_prefix, key_name, value_name)
+        if found_hive:
+            if value is None or value.type != "REG_SZ":
+                return None
+            return str(value.data)
+
     process = run_wine_completed_process(
         app=app,
         wine_binary=app.conf.wine64_binary,
@@ -353,27 +459,123 @@ def wine_reg_install(app: App, name: str, reg_text: str, wine64_binary: str):
             reg_file.unlink()
 
 
-def disable_winemenubuilder(app: App, wine64_binary: str):
-    name='disable-winemenubuilder.reg'
-    reg_text = r'''REGEDIT4
+class RegistryTransaction:
+    """Collects registry edits so they can be applied with a single regedit.
+
+    Every wine process start (and the wineserver wait after it) costs seconds,
+    so edits are merged into one REGEDIT4 document rather than applied one by one.
+    If the wineserver isn't running they're written to the hives directly instead.
+    """
+
+    def __init__(self) -> None:
+        self._keys: dict[str, dict[str, registry.RegistryValue]] = {}
+
+    @staticmethod
+    def _key(key: str) -> str:
+        root, rest = registry.split_key(key)
+        return f"{root}\\{rest}" if rest else root
+
+    @staticmethod
+    def _quote(value: str) -> str:
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    def _set(self, key: str, name: str, value: registry.RegistryValue):
+        self._keys.setdefault(self._key(key), {})[name] = value
+
+    def set_string(self, key: str, name: str, value: str):
+        self._set(key, name, registry.RegistryValue("REG_SZ", value))
+
+    def set_dword(self, key: str, name: str, value: int):
+        self._set(key, name, registry.RegistryValue("REG_DWORD", value))
+
+    def __bool__(self) -> bool:
+        return bool(self._keys)
+
+    def to_reg(self) -> str:
+        lines = ["REGEDIT4"]
+        for key, values in self._keys.items():
+            lines.append("")
+            lines.append(f"[{key}]")
+            for name, value in values.items():
+                if isinstance(value.data, int):
+                    data = f"dword:{value.data:08x}"
+                else:
+                    data = self._quote(str(value.data))
+                lines.append(f"{self._quote(name)}={data}")
+        return "\n".join(lines) + "\n"
+
+    def is_applied(self, app: App) -> bool:
+        """Reads every edit back from the prefix and checks it took effect"""
+        for key, values in self._keys.items():
+            for name, value in values.items():
+                # Formatted the way get_registry_value returns them
+                if isinstance(value.data, int):
+                    expected = hex(value.data)
+                else:
+                    expected = str(value.data)
+                current = get_registry_value(key, name, app)
+                if current != expected:
+                    logging.warning(f"Registry value {key}\\{name} is {current!r}, expected {expected!r}")
+                    return False
+        return True
+
+    def apply(self, app: App, wine64_binary: str, name: str = "ou-dedetai.reg"):
+        """Applies all edits with one regedit and one wineserver wait"""
+        if not self:
+            return
+        logging.debug(f"Applying registry edits:\n{self.to_reg()}")
+        if (
+            not registry.wineserver_running(app.conf.wine_prefix)
+            and registry.write_values(app.conf.wine_prefix, self._keys)
+        ):
+            logging.info("Registry edits written to the wine prefix hives.")
+        else:
+            wine_reg_install(app, name, self.to_reg(), wine64_binary)
+        self._keys = {}
+
+
+def _apply_now(
+    app: App,
+    wine64_binary: str,
+    name: str,
+    edit: Callable[[RegistryTransaction], None],
+    transaction: Optional[RegistryTransaction]
+):
+    """Adds the edit to transaction, or applies it right away if there isn't one"""
+    if transaction is not None:
+        edit(transaction)
+        return
+    transaction = RegistryTransaction()
+    edit(transaction)
+    transaction.apply(app, wine64_binary, name)
 
-[HKEY_CURRENT_USER\Software\Wine\DllOverrides]
-"winemenubuilder.exe"=""
-'''
-    wine_reg_install(app, name, reg_text, wine64_binary)
 
+def disable_winemenubuilder(
+    app: App,
+    wine64_binary: str,
+    transaction: Optional[RegistryTransaction] = None
+):
+    def edit(reg: RegistryTransaction):
+        reg.set_string("HKEY_CURRENT_USER\\Software\\Wine\\DllOverrides", "winemenubuilder.exe", "")
+    _apply_now(app, wine64_binary, 'disable-winemenubuilder.reg', edit, transaction)
 
-def set_renderer(app: App, wine64_binary: str, value: str):
-    name=f'set-renderer-to-{value}.reg'
-    reg_text = rf'''REGEDIT4
 
-[HKEY_CURRENT_USER\Software\Wine\Direct3D]
-"renderer"="{value}"
-'''
-    wine_reg_install(app, name, reg_text, wine64_binary)
+def set_renderer(
+    app: App,
+    wine64_binary: str,
+    value: str,
+    transaction: Optional[RegistryTransaction] = None
+):
+    def edit(reg: RegistryTransaction):
+        reg.set_string("HKEY_CURRENT_USER\\Software\\Wine\\Direct3D", "renderer", value)
+    _apply_now(app, wine64_binary, f'set-renderer-to-{value}.reg', edit, transaction)
 
 
-def set_fontsmoothing_to_rgb(app: App, wine64_binary: str):
+def set_fontsmoothing_to_rgb(
+    app: App,
+    wine64_binary: str,
+    transaction: Optional[RegistryTransaction] = None
+):
     # Possible registry values:
     # "disable":      FontSmoothing=0; FontSmoothingOrientation=1; FontSmoothingType=0
     # "gray/grey":    FontSmoothing=2; FontSmoothingOrientation=1; FontSmoothingType=1
@@ -381,16 +583,13 @@ def set_fontsmoothing_to_rgb(app: App, wine64_binary: str):
     # "rgb":          FontSmoothing=2; FontSmoothingOrientation=1; FontSmoothingType=2
     # https://github.com/Winetricks/winetricks/blob/8cf82b3c08567fff6d3fb440cbbf61ac5cc9f9aa/src/winetricks#L17411
 
-    name='set-fontsmoothing-to-rgb.reg'
-    reg_text = r'''REGEDIT4
-
-[HKEY_CURRENT_USER\Control Panel\Desktop]
-"FontSmoothing"="2"
-"FontSmoothingGamma"=dword:00000578
-"FontSmoothingOrientation"=dword:00000001
-"FontSmoothingType"=dword:00000002
-'''
-    wine_reg_install(app, name, reg_text, wine64_binary)
+    def edit(reg: RegistryTransaction):
+        key = "HKEY_CURRENT_USER\\Control Panel\\Desktop"
+        reg.set_string(key, "FontSmoothing", "2")
+        reg.set_dword(key, "FontSmoothingGamma", 0x578)
+        reg.set_dword(key, "FontSmoothingOrientation", 1)
+        reg.set_dword(key, "FontSmoothingType", 2)
+    _apply_now(app, wine64_binary, 'set-fontsmoothing-to-rgb.reg', edit, transaction)
 
 
 def install_msi(app: App):
@@ -456,27 +655,55 @@ def run_winetricks(app: App, *args):
         logging.debug('winetricks proc: <None>')
 
 
+REQUIRED_FONTS = ["arial"]
+"""Fonts installed into the prefix with winetricks"""
+
+
+def _get_font_file(app: App, font: str) -> tuple[bool, Optional[Path]]:
+    """Returns whether the font is installed, and its file if it's in the prefix's Fonts dir"""
+    registry_key = wine_reg_query(
+        app,
+        "HKEY_LOCAL_MACHINE\\Software\\Microsoft\\Windows NT\\CurrentVersion\\Fonts",
+        f"{font.capitalize()} (TrueType)"
+    )
+    if registry_key is not None and registry_key != f"{font}.ttf":
+        # Can hit this case with the debian package ttf-mscorefonts-installer
+        return True, None
+    # This case doesn't happen normally, but still good to check.
+    # There could be a registry key saying it's in Fonts but in reality it's not.
+    font_file = Path(app.conf.wine_prefix) / "drive_c" / "windows" / "Fonts" / f"{font}.ttf"
+    if registry_key == f"{font}.ttf" and font_file.exists():
+        return True, font_file
+    return False, None
+
+
+def get_installed_font_files(app: App) -> Optional[list[Path]]:
+    """Returns the files of the required fonts, or None if one isn't installed.
+
+    Fonts installed by other means aren't in the prefix and aren't listed.
+    """
+    font_files = []
+    for font in REQUIRED_FONTS:
+        installed, font_file = _get_font_file(app, font)
+        if not installed:
+            return None
+        if font_file is not None:
+            font_files.append(font_file)
+    return font_files
+
+
 def install_fonts(app: App):
     """Installs all required fonts:
     
     - arial
     """
-    fonts_dir = Path(app.conf.wine_prefix) / "drive_c" / "windows" / "Fonts"
-    fonts = ["arial"]
+    fonts = REQUIRED_FONTS
     for i, f in enumerate(fonts):
-        registry_key = wine_reg_query(
-            app,
-            "HKEY_LOCAL_MACHINE\\Software\\Microsoft\\Windows NT\\CurrentVersion\\Fonts", 
-            f"{f.capitalize()} (TrueType)"
-        )
-        if registry_key is not None and registry_key != f"{f}.ttf":
-            # Can hit this case with the debian package ttf-mscorefonts-installer
+        installed, font_file = _get_font_file(app, f)
+        if installed and font_file is None:
             logging.debug(f"Found font {f} already installed by other means, no need to install.") 
             continue
-        # This case doesn't happen normally, but still good to check.
-        # Now we need to check to see if there is a registry key saying it's in Fonts
-        # but in reality it's not.
-        if registry_key == f"{f}.ttf" and (fonts_dir / f"{f}.ttf").exists():
+        if installed:
             logging.debug(f"Found font {f} already in fonts dir, no need to install.")
             continue
         # Font isn't installed, continue to install with winetricks.
@@ -669,14 +896,20 @@ def run_wine_during_install(
 # Seems like we want to have a more holistic mechanism for ensuring
 # all users use the latest and greatest.
 # Sort of like an update, but for wine and all of the bits underneath "Logos" itself
-def enforce_icu_data_files(app: App):
-    app.status("Downloading ICU files…")
+def get_icu_download(app: App) -> tuple[str, str]:
+    """Returns the ICU download url and the file name to save it as"""
     icu_url = app.conf.icu_latest_version_url
     icu_latest_version = app.conf.icu_latest_version
 
     icu_filename = os.path.basename(icu_url).removesuffix(".tar.gz")
     # Append the version to the file name so it doesn't collide with previous versions
     icu_filename = f"{icu_filename}-{icu_latest_version}.tar.gz"
+    return icu_url, icu_filename
+
+
+def enforce_icu_data_files(app: App):
+    app.status("Downloading ICU files…")
+    icu_url, icu_filename = get_icu_download(app)
     network.logos_reuse_download(
         icu_url,
         icu_filename,
@@ -698,8 +931,40 @@ def enforce_icu_data_files(app: App):
     app.status("ICU files copied.", 100)
 
 
+def get_icu_data_files(app: App) -> Optional[list[Path]]:
+    """Returns the files enforce_icu_data_files copies into the prefix's windows dir.
+
+    Listed from the downloaded archive, None if it can't be read.
+    """
+    _, icu_filename = get_icu_download(app)
+    windows_dir = Path(app.conf.wine_prefix) / "drive_c" / "windows"
+    try:
+        with tarfile.open(Path(app.conf.download_dir) / icu_filename, 'r:gz') as tar:
+            members = [member.name for member in tar.getmembers() if member.isfile()]
+    except (OSError, tarfile.TarError) as e:
+        logging.warning(f"Failed to list the ICU data files: {e}")
+        return None
+    files = []
+    for member in members:
+        parts = PurePosixPath(member).parts
+        if parts[:2] == ("icu-win", "windows") and len(parts) > 2:
+            files.append(windows_dir.joinpath(*parts[2:]))
+    return files
+
+
 def get_registry_value(reg_path, name, app: App):
     logging.debug(f"Get value for: {reg_path=}; {name=}")
+    # While the wineserver is running the hives on disk may be out of date
+    if not registry.wineserver_running(app.conf.wine_prefix):
+        found_hive, registry_value = registry.read_value(app.conf.wine_prefix, reg_path, name)
+        if found_hive:
+            if registry_value is None:
+                return None
+            # Match the format of `wine reg query`
+            if isinstance(registry_value.data, int):
+                return hex(registry_value.data)
+            return str(registry_value.data)
+
     # FIXME: consider breaking run_wine_proc into a helper function before decoding is attempted
     # NOTE: Can't use run_wine_proc here because of infinite recursion while
     # trying to determine wine_output_encoding.
@@ -727,7 +992,9 @@ def get_registry_value(reg_path, name, app: App):
     if result is not None and result.stdout is not None:
         for line in result.stdout.splitlines():
             if line.strip().startswith(name):
-                value = line.split()[-1].strip()
+                # name, type and data, an empty REG_SZ has no data
+                type_and_data = line.strip()[len(name):].split(None, 1)
+                value = type_and_data[1].strip() if len(type_and_data) > 1 else ""
                 logging.debug(f"Registry value: {value}")
                 break
     else:
@@ -0,0 +1,239 @@
+"""Benchmarks BackupTask and RestoreTask on a synthetic Logos data tree.
+
+Not run by unittest. Run from the repo root:
+
+    python -m tests.benchmark_backup --workers 1 4 8 --output results.json
+
+The tree has many small SQLite databases (like Logos' per-resource and
+per-user stores) and a few large resource files. Every backup/restore runs in
+its own process so peak RSS is per run. If strace is installed, --strace adds
+per-run syscall counts.
+
+Results are warm page cache numbers, the tree was just written.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+
+from ou_dedetai import backup
+from ou_dedetai import constants
+from ou_dedetai import utils
+
+
+class HeadlessApp:
+    """Just enough of App to drive BackupTask/RestoreTask without a UI"""
+
+    def __init__(self, appdata_dir: Path, backup_dir: Path) -> None:
+        self.conf = SimpleNamespace(
+            faithlife_product="Logos",
+            backup_dir=str(backup_dir),
+            _logos_appdata_dir=str(appdata_dir),
+        )
+
+    def approve(self, question, context=None):
+        return True
+
+    def ask(self, question, options):
+        # Restore offers the latest backup first
+        return options[0]
+
+    def status(self, message, percent=None):
+        pass
+
+    def exit(self, reason, intended=False):
+        raise SystemExit(reason)
+
+    def start_thread(self, task, *args, daemon_bool=True, **kwargs):
+        thread = threading.Thread(target=task, args=args, kwargs=kwargs, daemon=daemon_bool)
+        thread.start()
+        return thread
+
+
+def _write_sqlite(path: Path, size: int, rng: random.Random) -> None:
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute("CREATE TABLE Items (Id INTEGER PRIMARY KEY, Data BLOB)")
+        row_size = 512
+        connection.executemany(
+            "INSERT INTO Items (Data) VALUES (?)",
+            ((rng.randbytes(row_size),) for _ in range(max(size // row_size, 1))),
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def make_tree(
+    root: Path,
+    small_files: int,
+    large_files: int,
+    large_size: int,
+    seed: int = 0,
+) -> dict:
+    """Writes a Logos-like Data/Documents/Users tree under root"""
+    rng = random.Random(seed)
+    for i in range(small_files):
+        # Mostly resource databases, the rest user documents and settings
+        top = rng.choices(['Data', 'Documents', 'Users'], weights=[6, 3, 1])[0]
+        directory = root / top / f"{rng.randrange(50):02d}" / f"{rng.randrange(20):02d}"
+        directory.mkdir(parents=True, exist_ok=True)
+        _write_sqlite(directory / f"{i:06d}.db", rng.randrange(16, 256) * 1024, rng)
+    resources = root / 'Data' / 'Resources'
+    resources.mkdir(parents=True, exist_ok=True)
+    chunk = 8 * 1024 * 1024
+    for i in range(large_files):
+        with open(resources / f"resource-{i}.lbxlls", 'wb') as f:
+            remaining = large_size
+            while remaining > 0:
+                # Half random, half repetitive, so compression has something to do
+                count = min(chunk, remaining)
+                f.write(rng.randbytes(count // 2) + bytes(count - count // 2))
+                remaining -= count
+    scan = utils.scan_tree([root / d for d in backup.BackupBase.DATA_DIRS])
+    return {
+        "small_files": small_files,
+        "large_files": large_files,
+        "large_file_bytes": large_size,
+        "files": len(scan.files),
+        "bytes": sum(f.size for f in scan.files),
+    }
+
+
+def run_one(operation: str, appdata_dir: Path, backup_dir: Path, workers: int, archive: bool) -> dict:
+    """Runs one backup or restore in this process"""
+    app = HeadlessApp(appdata_dir, backup_dir)
+    task: backup.BackupBase
+    if operation == 'restore':
+        task = backup.RestoreTask(app)
+    else:
+        task = backup.BackupTask(app, archive=archive)
+    task.workers = workers
+    start = time.perf_counter()
+    task.run()
+    wall = time.perf_counter() - start
+    # Archive mode does its work in child processes
+    peak_kib = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return {
+        "operation": operation,
+        "workers": workers,
+        "archive": archive,
+        "wall_seconds": wall,
+        "bytes": task.data_size,
+        "throughput_bytes_per_second": task.data_size / wall if wall else None,
+        "peak_rss_bytes": peak_kib * 1024,
+    }
+
+
+def _parse_strace_summary(path: Path) -> dict:
+    """Reads the table strace -c writes"""
+    counts = {}
+    for line in path.read_text().splitlines():
+        parts = line.split()
+        # % time, seconds, usecs/call, calls, [errors,] syscall
+        if len(parts) >= 5 and parts[3].isdigit() and not parts[-1].startswith('total'):
+            counts[parts[-1]] = int(parts[3])
+    return {"total": sum(counts.values()), "by_syscall": counts}
+
+
+def run_in_subprocess(
+    operation: str,
+    appdata_dir: Path,
+    backup_dir: Path,
+    workers: int,
+    archive: bool,
+    strace: bool,
+) -> dict:
+    command = [
+        sys.executable, '-m', 'tests.benchmark_backup', '--run-one', operation,
+        '--tree', str(appdata_dir), '--backup-dir', str(backup_dir),
+        '--workers', str(workers),
+    ]
+    if archive:
+        command.append('--archive')
+    strace_output: Optional[Path] = None
+    if strace:
+        strace_output = backup_dir / f".strace-{operation}-{workers}.txt"
+        command = ['strace', '-f', '-c', '-o', str(strace_output), *command]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    result["syscalls"] = None
+    if strace_output is not None:
+        result["syscalls"] = _parse_strace_summary(strace_output)
+        strace_output.unlink()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--small-files', type=int, default=2000)
+    parser.add_argument('--large-files', type=int, default=2)
+    parser.add_argument('--large-size-mb', type=int, default=2048)
+    parser.add_argument('--archive', action='store_true', help="benchmark archive backups")
+    parser.add_argument('--strace', action='store_true', help="count syscalls with strace")
+    parser.add_argument('--dir', help="where to build the tree, defaults to a temporary directory")
+    parser.add_argument('--output', help="write results here instead of stdout")
+    # Used internally to run one measurement per process
+    parser.add_argument('--run-one', choices=['backup', 'restore'], help=argparse.SUPPRESS)
+    parser.add_argument('--tree', help=argparse.SUPPRESS)
+    parser.add_argument('--backup-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        result = run_one(args.run_one, Path(args.tree), Path(args.backup_dir), args.workers[0], args.archive)
+        print(json.dumps(result))
+        return
+
+    if args.strace and shutil.which('strace') is None:
+        parser.exit(1, "strace not found\n")
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as td:
+        appdata_dir = Path(td) / 'Logos'
+        tree = make_tree(appdata_dir, args.small_files, args.large_files, args.large_size_mb * 1024 * 1024)
+        runs = []
+        for workers in args.workers:
+            backup_dir = Path(td) / f"backups-{workers}"
+            backup_dir.mkdir()
+            # The second backup hardlinks everything from the first
+            operations = ['backup', 'restore'] if args.archive else ['backup', 'backup', 'restore']
+            for operation in operations:
+                result = run_in_subprocess(operation, appdata_dir, backup_dir, workers, args.archive, args.strace)
+                result["incremental"] = operation == 'backup' and len(list(backup_dir.iterdir())) > 1
+                runs.append(result)
+                # Backup folder names have a one second resolution
+                time.sleep(1)
+            shutil.rmtree(backup_dir)
+
+    report = {
+        "app_version": constants.LLI_CURRENT_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "tree": tree,
+        "runs": runs,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,18 @@
-import subprocess
+import hashlib
+import os
+import shutil
 import tempfile
+import threading
 import unittest
 from pathlib import Path
 from unittest.mock import Mock
 import ou_dedetai.backup as backup
-from . import REPODIR
-from . import TESTDATADIR
+
+
+def start_thread(task, *args, daemon_bool=True, **kwargs):
+    t = threading.Thread(target=task, args=args, kwargs=kwargs, daemon=daemon_bool)
+    t.start()
+    return t
 
 
 class TestBackup(unittest.TestCase):
@@ -13,9 +20,143 @@ class TestBackup(unittest.TestCase):
         self.app = Mock()
         self.app.conf = Mock()
 
-    @unittest.skip("Not tested.")
     def test_copy_data(self):
-        pass
+        with tempfile.TemporaryDirectory() as td:
+            d = Path(td)
+            self.app.conf.faithlife_product = 'Logos'
+            self.app.conf.backup_dir = d / 'backups'
+            self.app.conf._logos_appdata_dir = d / 'Logos'
+            self.app.start_thread.side_effect = start_thread
+            src = d / 'Logos'
+            (src / 'Data' / 'empty').mkdir(parents=True)
+            (src / 'Documents').mkdir()
+            (src / 'Data' / 'big.bin').write_bytes(os.urandom(3 * backup.COPY_CHUNK_SIZE + 5))
+            (src / 'Documents' / 'notes.txt').write_text("notes")
+            os.utime(src / 'Documents' / 'notes.txt', ns=(1_000_000_000, 1_000_000_000))
+            os.link(src / 'Data' / 'big.bin', src / 'Documents' / 'big-link.bin')
+
+            b = backup.BackupTask(self.app)
+            b.run()
+
+            dst = b.destination_dir
+            self.assertEqual(
+                (dst / 'Data' / 'big.bin').read_bytes(),
+                (src / 'Data' / 'big.bin').read_bytes()
+            )
+            self.assertEqual((dst / 'Documents' / 'notes.txt').read_text(), "notes")
+            self.assertEqual((dst / 'Documents' / 'notes.txt').stat().st_mtime_ns, 1_000_000_000)
+            self.assertTrue((dst / 'Data' / 'empty').is_dir())
+            self.assertTrue((dst / 'Data' / 'big.bin').samefile(dst / 'Documents' / 'big-link.bin'))
+            self.assertFalse((dst / 'Users').exists())
+            self.assertEqual(b._get_copy_percentage(), 100)
+
+    def test_incremental_backup(self):
+        with tempfile.TemporaryDirectory() as td:
+            d = Path(td)
+            self.app.conf.faithlife_product = 'Logos'
+            self.app.conf.backup_dir = d / 'backups'
+            self.app.conf._logos_appdata_dir = d / 'Logos'
+            self.app.start_thread.side_effect = start_thread
+            data = d / 'Logos' / 'Data'
+            data.mkdir(parents=True)
+            (data / 'same.txt').write_text("same")
+            (data / 'changed.txt').write_text("old")
+
+            first = backup.BackupTask(self.app)
+            first._destination_dir = d / 'backups' / 'Logos-1'
+            first._destination_dir.mkdir(parents=True)
+            first.run()
+            manifest = backup.read_manifest(first.destination_dir)
+            self.assertIsNotNone(manifest)
+            self.assertEqual(manifest['Data/same.txt'].sha256, hashlib.sha256(b"same").hexdigest())
+
+            (data / 'changed.txt').write_text("new!")
+            second = backup.BackupTask(self.app)
+            second._destination_dir = d / 'backups' / 'Logos-2'
+            second._destination_dir.mkdir(parents=True)
+            second.run()
+
+            old_dir, new_dir = first.destination_dir / 'Data', second.destination_dir / 'Data'
+            self.assertTrue((old_dir / 'same.txt').samefile(new_dir / 'same.txt'))
+            self.assertFalse((old_dir / 'changed.txt').samefile(new_dir / 'changed.txt'))
+            self.assertEqual((new_dir / 'changed.txt').read_text(), "new!")
+            manifest = backup.read_manifest(second.destination_dir)
+            self.assertEqual(manifest['Data/changed.txt'].sha256, hashlib.sha256(b"new!").hexdigest())
+
+    def test_archive_backup_and_restore(self):
+        with tempfile.TemporaryDirectory() as td:
+            d = Path(td)
+            self.app.conf.faithlife_product = 'Logos'
+            self.app.conf.backup_dir = d / 'backups'
+            self.app.conf._logos_appdata_dir = d / 'Logos'
+            self.app.start_thread.side_effect = start_thread
+            src = d / 'Logos'
+            (src / 'Data' / 'empty').mkdir(parents=True)
+            (src / 'Users').mkdir()
+            big = os.urandom(backup.ARCHIVE_CHUNK_SIZE // 2 + 1)
+            (src / 'Data' / 'a.bin').write_bytes(big)
+            (src / 'Data' / 'b.bin').write_bytes(big)
+            (src / 'Users' / 'prefs.db').write_text("prefs")
+
+            b = backup.BackupTask(self.app, archive=True)
+            b.run()
+            index = backup.read_archive_index(b.destination_dir)
+            self.assertIsNotNone(index)
+            self.assertEqual(len(index.chunks), 2)
+            self.assertFalse((b.destination_dir / 'Data').exists())
+
+            prefs_mtime_ns = (src / 'Users' / 'prefs.db').stat().st_mtime_ns
+            for sub in ('Data', 'Users'):
+                shutil.rmtree(src / sub)
+            r = backup.RestoreTask(self.app)
+            r._source_dir = b.destination_dir
+            r.extract(['Users/prefs.db'], d / 'single')
+            self.assertEqual((d / 'single' / 'Users' / 'prefs.db').read_text(), "prefs")
+            self.assertFalse((d / 'single' / 'Data').exists())
+
+            r.run()
+            self.assertEqual((src / 'Data' / 'b.bin').read_bytes(), big)
+            self.assertEqual((src / 'Users' / 'prefs.db').read_text(), "prefs")
+            self.assertTrue((src / 'Data' / 'empty').is_dir())
+            self.assertEqual(r._get_copy_percentage(), 100)
+            # Exactly, so restoring only changed files skips it next time
+            self.assertEqual((src / 'Users' / 'prefs.db').stat().st_mtime_ns, prefs_mtime_ns)
+
+    def test_archive_restore_verification_failure(self):
+        with tempfile.TemporaryDirectory() as td:
+            d = Path(td)
+            self.app.conf.faithlife_product = 'Logos'
+            self.app.conf.backup_dir = d / 'backups'
+            self.app.conf._logos_appdata_dir = d / 'Logos'
+            self.app.start_thread.side_effect = start_thread
+            src = d / 'Logos'
+            (src / 'Users').mkdir(parents=True)
+            (src / 'Users' / 'prefs.db').write_text("prefs")
+
+            b = backup.BackupTask(self.app, archive=True)
+            b.run()
+            index = backup.read_archive_index(b.destination_dir)
+            index.files[0].sha256 = hashlib.sha256(b"other").hexdigest()
+            backup.write_archive_index(b.destination_dir, index)
+            (src / 'Users' / 'prefs.db').write_text("installed")
+
+            r = backup.RestoreTask(self.app)
+            r._source_dir = b.destination_dir
+            with self.assertRaises(backup.VerificationError):
+                r.extract(['Users/prefs.db'])
+            self.assertEqual((src / 'Users' / 'prefs.db').read_text(), "installed")
+            self.assertEqual(list(src.rglob('*.partial')), [])
+
+    def test_copy_file_progress(self):
+        with tempfile.TemporaryDirectory() as td:
+            d = Path(td)
+            data = os.urandom(2 * backup.COPY_CHUNK_SIZE + 1)
+            (d / 'src').write_bytes(data)
+            progress = []
+            copied = backup.copy_file(d / 'src', d / 'dst', progress.append)
+            self.assertEqual(copied, len(data))
+            self.assertEqual(sum(progress), len(data))
+            self.assertEqual((d / 'dst').read_bytes(), data)
 
     def test_get_all_backups(self):
         with tempfile.TemporaryDirectory() as td:
@@ -33,23 +174,6 @@ class TestBackup(unittest.TestCase):
             bdirs = b._get_all_backups()
             self.assertEqual(bdirs, backup_dirs)
 
-    def test_get_dir_group_size(self):
-        size_dir = 4096
-
-        cmd = ['du', '-sb', str(TESTDATADIR)]
-        size_du = int(subprocess.check_output(cmd).decode().split()[0])
-        size_testdata = size_du + size_dir  # add in 'data' dir
-
-        cmd = ['du', '-sb', str(REPODIR / 'snap')]
-        size_du = int(subprocess.check_output(cmd).decode().split()[0])
-        size_snap = size_du + size_dir*3  # add in 'snap', 'bin', 'gui' dirs
-
-        self.app.conf.backup_dir = Path('.')
-        b = backup.BackupTask(self.app)
-        dirs = [TESTDATADIR, REPODIR / 'snap']
-        size = b._get_dir_group_size(dirs)
-        self.assertEqual(size_testdata + size_snap, size)
-
     def test_set_dest_dir(self):
         with tempfile.TemporaryDirectory() as td:
             d = Path(td)
@@ -65,6 +189,103 @@ class TestRestore(unittest.TestCase):
         self.app = Mock()
         self.app.conf = Mock()
 
+    def make_backup(self, d):
+        self.app.conf.faithlife_product = 'Logos'
+        self.app.conf.backup_dir = d / 'backups'
+        self.app.conf._logos_appdata_dir = d / 'Logos'
+        self.app.start_thread.side_effect = start_thread
+        self.app.exit.side_effect = SystemExit
+        src = d / 'Logos'
+        (src / 'Data').mkdir(parents=True)
+        (src / 'Documents').mkdir()
+        (src / 'Data' / 'resource.bin').write_bytes(b"resource")
+        (src / 'Documents' / 'notes.txt').write_text("notes")
+        b = backup.BackupTask(self.app)
+        b.run()
+        return src, b.destination_dir
+
+    def test_restore(self):
+        with tempfile.TemporaryDirectory() as td:
+            d = Path(td)
+            src, backup_dir = self.make_backup(d)
+            (src / 'Documents' / 'notes.txt').write_text("changed")
+            (src / 'Documents' / 'extra').mkdir()
+            (src / 'Documents' / 'extra' / 'new.txt').write_text("new")
+            (src / 'Users').mkdir()
+            resource_inode = (src / 'Data' / 'resource.bin').stat().st_ino
+
+            r = backup.RestoreTask(self.app, changed_only=True)
+            r._source_dir = backup_dir
+            r.run()
+
+            self.assertEqual((src / 'Documents' / 'notes.txt').read_text(), "notes")
+            # Already matched the backup, so it wasn't rewritten
+            self.assertEqual((src / 'Data' / 'resource.bin').stat().st_ino, resource_inode)
+            self.assertFalse((src / 'Documents' / 'extra').exists())
+            self.assertFalse((src / 'Users').exists())
+            self.assertEqual(list(src.rglob('*.partial')), [])
+
+    def test_restore_verification_failure(self):
+        with tempfile.TemporaryDirectory() as td:
+            d = Path(td)
+            src, backup_dir = self.make_backup(d)
+            corrupted = backup_dir / 'Data' / 'resource.bin'
+            st = corrupted.stat()
+            corrupted.write_bytes(b"RESOURCE")
+            os.utime(corrupted, ns=(st.st_atime_ns, st.st_mtime_ns))
+            (src / 'Data' / 'resource.bin').write_bytes(b"installed")
+            (src / 'Documents' / 'notes.txt').write_text("installed")
+
+            r = backup.RestoreTask(self.app)
+            r._source_dir = backup_dir
+            with self.assertRaises(SystemExit):
+                r.run()
+            self.assertEqual((src / 'Data' / 'resource.bin').read_bytes(), b"installed")
+            # Files that did verify aren't put in place either
+            self.assertEqual((src / 'Documents' / 'notes.txt').read_text(), "installed")
+            self.assertEqual(list(src.rglob('*.partial')), [])
+
+    def test_restored_database_replaces_its_sidecars(self):
+        with tempfile.TemporaryDirectory() as td:
+            d = Path(td)
+            src, backup_dir = self.make_backup(d)
+            db = src / 'Documents' / 'notes.db'
+            db.write_text("installed")
+            (src / 'Documents' / 'notes.db-wal').write_text("installed wal")
+            (src / 'Documents' / 'notes.db-shm').write_text("installed shm")
+            backup._partial_path(db).write_text("restored")
+
+            r = backup.RestoreTask(self.app)
+            r._source_dir = backup_dir
+            r._backup_paths = {'Documents/notes.db', 'Documents/notes.db-shm'}
+            r._staged = {db}
+            r._commit_staged()
+            self.assertEqual(db.read_text(), "restored")
+            self.assertFalse((src / 'Documents' / 'notes.db-wal').exists())
+            # In the backup, left for the restore to handle
+            self.assertTrue((src / 'Documents' / 'notes.db-shm').exists())
+
+    def test_restore_manifest_mismatch(self):
+        with tempfile.TemporaryDirectory() as td:
+            d = Path(td)
+            src, backup_dir = self.make_backup(d)
+            (src / 'Documents' / 'notes.txt').write_text("installed")
+            (backup_dir / 'Data' / 'resource.bin').write_bytes(b"truncated")
+
+            r = backup.RestoreTask(self.app)
+            r._source_dir = backup_dir
+            with self.assertRaises(SystemExit):
+                r.run()
+            # Nothing was restored
+            self.assertEqual((src / 'Documents' / 'notes.txt').read_text(), "installed")
+
+            (backup_dir / 'Data' / 'resource.bin').unlink()
+            r = backup.RestoreTask(self.app)
+            r._source_dir = backup_dir
+            with self.assertRaises(SystemExit):
+                r.run()
+            self.assertEqual((src / 'Documents' / 'notes.txt').read_text(), "installed")
+
     def test_set_dest_dir(self):
         with tempfile.TemporaryDirectory() as td:
             d = Path(td)
@@ -0,0 +1,238 @@
+import sqlite3
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import ou_dedetai.database as database
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@patch.object(database, 'WATCH_QUIET_PERIOD', 0.1)
+class TestDatabaseWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.tempdir.name) / "Updates.db")
+        with sqlite3.connect(self.path, autocommit=True) as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("CREATE TABLE Updates (Source TEXT)")
+            con.execute("INSERT INTO Updates VALUES ('Application Update')")
+        self.watcher = database.DatabaseWatcher()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def count(self):
+        with sqlite3.connect(self.path) as con:
+            return con.execute("SELECT COUNT(*) FROM Updates").fetchone()[0]
+
+    def test_reapplies_after_writes(self):
+        handle = self.watcher.register(self.path, ["DELETE FROM Updates"])
+        self.assertEqual(self.count(), 0)
+        with sqlite3.connect(self.path, autocommit=True) as con:
+            for _ in range(5):
+                con.execute("INSERT INTO Updates VALUES ('Application Update')")
+        self.assertTrue(wait_for(lambda: self.count() == 0))
+
+        self.watcher.unregister(handle)
+        self.assertTrue(wait_for(lambda: self.watcher._thread is None))
+        with sqlite3.connect(self.path, autocommit=True) as con:
+            con.execute("INSERT INTO Updates VALUES ('Application Update')")
+        time.sleep(0.3)
+        self.assertEqual(self.count(), 1)
+
+    def test_own_writes_are_not_reapplied(self):
+        handle = self.watcher.register(self.path, ["UPDATE Updates SET Source='Resource'"])
+        connection = self.watcher._watched[handle].pooled.connection
+        changes = connection.total_changes
+        time.sleep(0.5)
+        self.assertEqual(connection.total_changes, changes)
+        self.watcher.unregister(handle)
+
+    def test_conditional_statement(self):
+        statement = database.ConditionalStatement(
+            "DELETE FROM Updates WHERE Source='Application Update'",
+            needed="SELECT 1 FROM Updates WHERE Source='Application Update' LIMIT 1",
+        )
+        handle = self.watcher.register(self.path, [statement])
+        connection = self.watcher._watched[handle].pooled.connection
+        self.assertEqual(self.count(), 0)
+        changes = connection.total_changes
+
+        with sqlite3.connect(self.path, autocommit=True) as con:
+            con.execute("INSERT INTO Updates VALUES ('Resource')")
+        time.sleep(0.5)
+        # Applied again, but there was nothing to delete so it didn't write
+        self.assertEqual(connection.total_changes, changes)
+
+        with sqlite3.connect(self.path, autocommit=True) as con:
+            con.execute("INSERT INTO Updates VALUES ('Application Update')")
+        self.assertTrue(wait_for(lambda: self.count() == 1))
+        self.watcher.unregister(handle)
+
+    def test_missing_database(self):
+        with self.assertRaises(FileNotFoundError):
+            self.watcher.register(self.path + ".missing", ["DELETE FROM Updates"])
+        self.assertFalse(Path(self.path + ".missing").exists())
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tempdir.name) / "PreferencesManager.db"
+        with sqlite3.connect(self.path, autocommit=True) as con:
+            con.execute("CREATE TABLE Preferences (Type TEXT, Data TEXT)")
+            con.execute("INSERT INTO Preferences VALUES ('AppLocalPreferences', '<data />')")
+        self.pool = database.ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.tempdir.cleanup()
+
+    def test_reuses_connections(self):
+        with self.pool.connection(self.path) as first:
+            pass
+        with self.pool.connection(self.path) as second:
+            self.assertIs(first, second)
+            with self.pool.connection(self.path) as third:
+                self.assertIsNot(second, third)
+
+    def test_read_only(self):
+        with self.pool.connection(self.path, read_only=True) as con:
+            self.assertEqual(con.execute("SELECT Data FROM Preferences").fetchone()[0], '<data />')
+            with self.assertRaises(sqlite3.OperationalError):
+                con.execute("DELETE FROM Preferences")
+
+    def test_replaced_database(self):
+        with self.pool.connection(self.path) as first:
+            pass
+        replacement = self.path.with_name("new.db")
+        with sqlite3.connect(replacement, autocommit=True) as con:
+            con.execute("CREATE TABLE Preferences (Type TEXT, Data TEXT)")
+        replacement.replace(self.path)
+        with self.pool.connection(self.path) as second:
+            self.assertIsNot(first, second)
+            self.assertEqual(second.execute("SELECT COUNT(*) FROM Preferences").fetchone()[0], 0)
+
+    def test_missing_database(self):
+        missing = self.path.with_name("missing.db")
+        with self.assertRaises(sqlite3.OperationalError):
+            self.pool.acquire(missing)
+        self.assertFalse(missing.exists())
+
+    def test_preferences_manager(self):
+        app_dir = Path(self.tempdir.name) / "Logos"
+        prefs_dir = app_dir / "Documents" / "user" / "LocalUserPreferences"
+        prefs_dir.mkdir(parents=True)
+        self.path.replace(prefs_dir / "PreferencesManager.db")
+        with patch.object(database, 'pool', self.pool):
+            with database.LocalUserPreferencesManager(app_dir, "user", read_only=True) as db:
+                self.assertEqual(db.app_local_preferences, '<data />')
+
+
+class TestDatabaseHealth(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tempdir.name) / "Logos"
+        user_data = self.root / "Data" / "user"
+        self.updates = user_data / "UpdateManager" / "Updates.db"
+        self.cloud = user_data / "CloudResourceManager" / "CloudResources.db"
+        self.updates.parent.mkdir(parents=True)
+        self.cloud.parent.mkdir(parents=True)
+        with sqlite3.connect(self.updates, autocommit=True) as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("CREATE TABLE Updates (UpdateId INTEGER, Source TEXT)")
+            con.execute("CREATE TABLE UpdateUrls (UpdateId INTEGER, Url TEXT)")
+            con.execute("CREATE TABLE Resources (ResourceId TEXT, UpdateId INTEGER, Status INTEGER)")
+            con.execute("INSERT INTO Updates VALUES (1, 'Resource')")
+            con.execute("INSERT INTO UpdateUrls VALUES (1, 'https://example.com')")
+            con.execute("INSERT INTO Resources VALUES ('LLS:1', 1, 0)")
+        with sqlite3.connect(self.cloud, autocommit=True) as con:
+            con.execute("CREATE TABLE TransitionStates (ResourceId TEXT)")
+            con.execute("INSERT INTO TransitionStates VALUES ('LLS:1')")
+        # Not databases, or not ones we check for orphans
+        (self.root / "Data" / "user" / "notes.db").write_text("not a database")
+        (self.root / "Data" / "user" / "resource.lbxlls").write_bytes(b"SQLite format 3\x00")
+        with sqlite3.connect(self.root / "Data" / "user" / "Other.db", autocommit=True) as con:
+            con.execute("CREATE TABLE Items (Id INTEGER)")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_healthy(self):
+        report = database.check_databases(self.root)
+        self.assertEqual(
+            sorted(Path(d.path).name for d in report.databases),
+            ["CloudResources.db", "Other.db", "Updates.db"],
+        )
+        self.assertEqual(report.problems, [])
+        by_name = {Path(d.path).name: d for d in report.databases}
+        self.assertTrue(by_name["Updates.db"].wal)
+        self.assertFalse(by_name["CloudResources.db"].wal)
+        self.assertEqual(by_name["CloudResources.db"].skipped, [])
+
+    def test_orphans(self):
+        with sqlite3.connect(self.updates, autocommit=True) as con:
+            con.execute("INSERT INTO UpdateUrls VALUES (2, 'https://example.com')")
+            con.execute("INSERT INTO Resources VALUES ('LLS:2', 3, 0)")
+        with sqlite3.connect(self.cloud, autocommit=True) as con:
+            con.execute("INSERT INTO TransitionStates VALUES ('LLS:4')")
+        report = database.check_databases(self.root)
+        by_name = {Path(d.path).name: d for d in report.problems}
+        self.assertEqual(by_name["Updates.db"].orphans, {
+            "UpdateUrls without an Update": 1,
+            "Resources with a missing UpdateId": 1,
+        })
+        self.assertEqual(by_name["CloudResources.db"].orphans, {
+            "TransitionStates for a resource UpdateManager doesn't have": 1,
+        })
+
+    def test_does_not_block_writers(self):
+        # A rollback journal database, read without locks
+        with sqlite3.connect(self.cloud, timeout=0) as writer:
+            writer.execute("BEGIN EXCLUSIVE")
+            health = database.check_database(self.cloud)
+            writer.execute("INSERT INTO TransitionStates VALUES ('LLS:1')")
+            writer.commit()
+        assert health is not None
+        self.assertTrue(health.healthy)
+
+    def test_missing_table(self):
+        with sqlite3.connect(self.cloud, autocommit=True) as con:
+            con.execute("DROP TABLE TransitionStates")
+        health = database.check_database(self.cloud)
+        assert health is not None
+        self.assertEqual(len(health.skipped), 1)
+        self.assertTrue(health.healthy)
+
+    def test_corrupt(self):
+        other = self.root / "Data" / "user" / "Other.db"
+        with sqlite3.connect(other, autocommit=True) as con:
+            con.execute("CREATE INDEX ItemsId ON Items (Id)")
+            con.executemany("INSERT INTO Items VALUES (?)", ((i,) for i in range(1000)))
+            con.execute("PRAGMA writable_schema=ON")
+            # Point the index at the table's root page
+            con.execute(
+                "UPDATE sqlite_schema SET rootpage=(SELECT rootpage FROM sqlite_schema WHERE name='Items')"
+                " WHERE name='ItemsId'"
+            )
+        health = database.check_database(other)
+        assert health is not None
+        self.assertIsNone(health.error)
+        self.assertTrue(health.quick_check)
+
+    def test_timeout(self):
+        with sqlite3.connect(self.updates, autocommit=True) as con:
+            con.executemany("INSERT INTO Updates VALUES (?, 'Resource')", ((i,) for i in range(10000)))
+        health = database.check_database(self.updates, timeout=-1)
+        assert health is not None
+        self.assertIn("timed out", health.error)
@@ -0,0 +1,127 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from ou_dedetai import installer
+from ou_dedetai.installer import InstallStep
+
+
+class TestRunInstallSteps(unittest.TestCase):
+    def test_steps_run_in_order_on_the_calling_thread(self):
+        order = []
+
+        def step(name):
+            def run(app):
+                self.assertIs(threading.current_thread(), threading.main_thread())
+                order.append(name)
+            return run
+
+        steps = [
+            InstallStep("first", step("first")),
+            InstallStep("b", step("b"), ["first"]),
+            InstallStep("a", step("a"), ["first"]),
+            InstallStep("last", step("last"), ["a", "b"]),
+        ]
+        app = Mock()
+        timings = installer.run_install_steps(app, steps)
+        self.assertEqual(order, ["first", "b", "a", "last"])
+        self.assertEqual(set(timings), {"first", "a", "b", "last"})
+        self.assertEqual(app.installer_step, app.installer_step_count)
+
+    def test_skipped_step_cancels_its_prefetch(self):
+        steps = [InstallStep(
+            "download",
+            Mock(),
+            is_done=lambda app: True,
+            downloads=lambda app: [("http://example.com/file.msi", "file.msi")],
+        )]
+        with patch.object(installer.network, 'cancel_prefetch') as cancel_prefetch:
+            installer.run_install_steps(Mock(), steps)
+        cancel_prefetch.assert_called_once_with("http://example.com/file.msi", "file.msi")
+
+    def test_exit_is_not_delayed(self):
+        def exit_step(app):
+            raise SystemExit
+
+        later = Mock()
+        steps = [InstallStep("exit", exit_step), InstallStep("later", later, ["exit"])]
+        with self.assertRaises(SystemExit):
+            installer.run_install_steps(Mock(), steps)
+        later.assert_not_called()
+
+    def test_done_steps_are_skipped(self):
+        run = Mock()
+        steps = [InstallStep("done", run, is_done=lambda app: True)]
+        self.assertEqual(installer.run_install_steps(Mock(), steps), {"done": 0.0})
+        run.assert_not_called()
+
+    def test_unchanged_fingerprint_is_skipped(self):
+        with tempfile.TemporaryDirectory() as d:
+            app = Mock()
+            app.conf.install_dir = d
+            run = Mock()
+            inputs = {"version": 1}
+            steps = [InstallStep("step", run, fingerprint=lambda app: inputs)]
+            installer.run_install_steps(app, steps)
+            installer.run_install_steps(app, steps)
+            self.assertEqual(run.call_count, 1)
+            inputs["version"] = 2
+            installer.run_install_steps(app, steps)
+            self.assertEqual(run.call_count, 2)
+            ledger = installer.InstallLedger.for_app(app)
+            self.assertTrue(ledger.is_current("step", {"version": 2}))
+
+    def test_missing_output_reruns_step(self):
+        with tempfile.TemporaryDirectory() as d:
+            app = Mock()
+            app.conf.install_dir = d
+            output = Path(d) / "output"
+            run = Mock(side_effect=lambda app: output.touch())
+            steps = [InstallStep("step", run, fingerprint=lambda app: {}, outputs=lambda app: [output])]
+            installer.run_install_steps(app, steps)
+            installer.run_install_steps(app, steps)
+            self.assertEqual(run.call_count, 1)
+            output.unlink()
+            installer.run_install_steps(app, steps)
+            self.assertEqual(run.call_count, 2)
+
+    def test_unverified_outcome_is_not_recorded(self):
+        with tempfile.TemporaryDirectory() as d:
+            app = Mock()
+            app.conf.install_dir = d
+            run = Mock()
+            steps = [InstallStep("step", run, fingerprint=lambda app: {}, outputs=lambda app: None)]
+            installer.run_install_steps(app, steps)
+            installer.run_install_steps(app, steps)
+            self.assertEqual(run.call_count, 2)
+
+    def test_failure_stops_later_steps(self):
+        later = Mock()
+
+        def fail(app):
+            raise RuntimeError("failed")
+
+        steps = [InstallStep("fail", fail), InstallStep("later", later, ["fail"])]
+        with self.assertRaises(RuntimeError):
+            installer.run_install_steps(Mock(), steps)
+        later.assert_not_called()
+
+    def test_unknown_requirement(self):
+        with self.assertRaises(ValueError):
+            installer.run_install_steps(Mock(), [InstallStep("a", Mock(), ["missing"])])
+
+    def test_requirement_listed_later(self):
+        run = Mock()
+        steps = [InstallStep("a", run, ["b"]), InstallStep("b", run)]
+        with self.assertRaises(ValueError):
+            installer.run_install_steps(Mock(), steps)
+        run.assert_not_called()
+
+    def test_install_steps_are_valid(self):
+        names = [step.name for step in installer.INSTALL_STEPS]
+        self.assertEqual(len(names), len(set(names)))
+        for i, step in enumerate(installer.INSTALL_STEPS):
+            # Listed in an order that could run sequentially
+            self.assertTrue(set(step.requires) <= set(names[:i]), step.name)
@@ -0,0 +1,92 @@
+import gzip
+import logging
+import queue
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import ou_dedetai.msg as msg
+
+
+def make_record(message, level=logging.DEBUG):
+    return logging.makeLogRecord({
+        "name": "test",
+        "levelno": level,
+        "levelname": logging.getLevelName(level),
+        "msg": message,
+    })
+
+
+class TestQueuedLogging(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.log_path = Path(self.tempdir.name) / "app.log"
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_batched_writes(self):
+        file_h = msg.GzippedRotatingFileHandler(self.log_path, encoding='UTF8')
+        file_h.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+        log_queue: queue.Queue = queue.Queue(msg.LOG_QUEUE_SIZE)
+        listener = msg.BatchingQueueListener(log_queue, file_h)
+        queue_h = msg.BoundedQueueHandler(log_queue)
+        for i in range(100):
+            queue_h.handle(make_record(f"line {i}"))
+        with patch.object(file_h, 'flush', wraps=file_h.flush) as flush:
+            listener.start()
+            listener.stop()
+        # All of it fits in one batch
+        self.assertEqual(flush.call_count, 1)
+        file_h.close()
+        lines = self.log_path.read_text().splitlines()
+        self.assertEqual(lines, [f"DEBUG: line {i}" for i in range(100)])
+
+    def test_rollover_on_listener_thread(self):
+        file_h = msg.GzippedRotatingFileHandler(self.log_path, maxBytes=1000, backupCount=2)
+        log_queue: queue.Queue = queue.Queue(msg.LOG_QUEUE_SIZE)
+        listener = msg.BatchingQueueListener(log_queue, file_h)
+        queue_h = msg.BoundedQueueHandler(log_queue)
+        rollover_threads = []
+        do_rollover = file_h.doRollover
+
+        def record_thread():
+            rollover_threads.append(threading.current_thread())
+            do_rollover()
+
+        listener.start()
+        with patch.object(file_h, 'doRollover', side_effect=record_thread):
+            for i in range(3):
+                queue_h.handle(make_record("x" * 600))
+                # One record per batch
+                log_queue.join()
+        listener.stop()
+        file_h.close()
+        self.assertEqual(len(rollover_threads), 2)
+        self.assertNotIn(threading.current_thread(), rollover_threads)
+        with gzip.open(f"{self.log_path}.1.gz", 'rt') as f:
+            self.assertEqual(f.read(), "x" * 600 + "\n")
+
+    def test_full_queue_drops_debug(self):
+        log_queue: queue.Queue = queue.Queue(2)
+        queue_h = msg.BoundedQueueHandler(log_queue)
+        for i in range(4):
+            queue_h.handle(make_record(f"line {i}"))
+        self.assertEqual(queue_h.dropped, 2)
+        log_queue.get_nowait()
+        log_queue.get_nowait()
+        queue_h.handle(make_record("after"))
+        messages = [log_queue.get_nowait().getMessage() for _ in range(2)]
+        self.assertEqual(messages, ["Log buffer was full, dropped 2 message(s)", "after"])
+        self.assertEqual(queue_h.dropped, 0)
+
+    def test_full_queue_waits_for_warnings(self):
+        log_queue: queue.Queue = queue.Queue(1)
+        queue_h = msg.BoundedQueueHandler(log_queue)
+        queue_h.handle(make_record("first"))
+        threading.Timer(0.1, log_queue.get_nowait).start()
+        queue_h.handle(make_record("warning", logging.WARNING))
+        self.assertEqual(queue_h.dropped, 0)
+        self.assertEqual(log_queue.get_nowait().getMessage(), "warning")
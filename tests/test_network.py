@@ -1,6 +1,10 @@
+import http.server
 import tempfile
+import threading
+import time
 import unittest
 from pathlib import Path
+from unittest.mock import Mock, patch
 from requests.exceptions import MissingSchema
 
 import ou_dedetai.network as network
@@ -39,4 +43,319 @@ class TestNetwork(unittest.TestCase):
         self.assertIsNotNone(URLOBJ.size)
 
     def test_urlprops_get_md5(self):
-        self.assertIsNone(URLOBJ.md5)
\ No newline at end of file
+        self.assertIsNone(URLOBJ.md5)
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Serves server.data, honoring byte ranges unless server.empty_ranges is set"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _headers(self) -> bytes:
+        data = self.server.data  # type: ignore[attr-defined]
+        byte_range = self.headers.get('Range')
+        if byte_range is None:
+            self.send_response(200)
+            body = data
+        else:
+            self.server.ranges.append(byte_range)  # type: ignore[attr-defined]
+            start, end = byte_range.removeprefix('bytes=').split('-')
+            body = data[int(start):int(end) + 1]
+            if self.server.empty_ranges:  # type: ignore[attr-defined]
+                body = b''
+            self.send_response(206)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body) if self.command == 'GET' else len(data)))
+        self.end_headers()
+        return body
+
+    def do_HEAD(self):
+        self._headers()
+
+    def do_GET(self):
+        self.wfile.write(self._headers())
+
+
+def serve(test: unittest.TestCase, data: bytes, empty_ranges: bool = False) -> http.server.ThreadingHTTPServer:
+    """Serves data from a local RangeHandler until the test ends"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.data = data  # type: ignore[attr-defined]
+    server.ranges = []  # type: ignore[attr-defined]
+    server.empty_ranges = empty_ranges  # type: ignore[attr-defined]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    return server
+
+
+def server_url(server: http.server.ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}/file.msi"
+
+
+class TestSegmentedDownload(unittest.TestCase):
+    def test_plan_segments_covers_range(self):
+        segments = network._plan_segments(10, 110, 4)
+        self.assertEqual(len(segments), 4)
+        self.assertEqual(segments[0].start, 10)
+        self.assertEqual(segments[-1].end, 109)
+        for a, b in zip(segments, segments[1:]):
+            self.assertEqual(a.end + 1, b.start)
+
+    def test_plan_segments_small_file(self):
+        segments = network._plan_segments(0, 2, 4)
+        self.assertEqual(len(segments), 2)
+        self.assertEqual(network._plan_segments(5, 5, 4), [])
+
+    def test_segments_round_trip(self):
+        with tempfile.TemporaryDirectory() as d:
+            target = Path(d) / 'file.msi'
+            target.touch()
+            segments = network._plan_segments(0, 100, 2)
+            segments[0].done = 50
+            network._write_segments(target, 'http://example.com/file.msi', 100, segments)
+            loaded = network._load_segments(target, 'http://example.com/file.msi', 100)
+            self.assertEqual(loaded, segments)
+            self.assertTrue(loaded[0].complete)
+            self.assertFalse(loaded[1].complete)
+            self.assertIsNone(network._load_segments(target, 'http://example.com/other.msi', 100))
+
+    def test_segmented_download(self):
+        data = bytes(range(256)) * 1024
+        self.server = serve(self, data)
+        url = server_url(self.server)
+        with tempfile.TemporaryDirectory() as d:
+            target = Path(d) / 'file.msi'
+            read_back = []
+            update_from_disk = network.DownloadHasher.update_from_disk
+
+            def count_reads(hasher, until):
+                read_back.append(max(0, until - hasher.size))
+                update_from_disk(hasher, until)
+
+            with patch.object(network.DownloadHasher, 'update_from_disk', count_reads):
+                result = network._net_get_segmented(network.UrlProps(url), target, len(data))
+            self.assertTrue(result)
+            self.assertEqual(target.read_bytes(), data)
+            # The first segment was hashed while streaming
+            first = network._plan_segments(0, len(data), network.SEGMENTED_DOWNLOAD_CONNECTIONS)[0]
+            self.assertEqual(sum(read_back), len(data) - (first.end + 1))
+            self.assertFalse(network._segments_path(target).exists())
+            self.assertEqual(network._read_md5_state(target), network.FileProps(target).md5)
+            self.assertEqual(len(self.server.ranges), network.SEGMENTED_DOWNLOAD_CONNECTIONS)
+
+    def test_segmented_download_resumes(self):
+        data = bytes(range(256)) * 1024
+        self.server = serve(self, data)
+        url = server_url(self.server)
+        with tempfile.TemporaryDirectory() as d:
+            target = Path(d) / 'file.msi'
+            segments = network._plan_segments(0, len(data), 2)
+            # The first segment finished, the second got 100 bytes in
+            segments[0].done = segments[0].end + 1
+            segments[1].done = 100
+            target.write_bytes(data[:segments[1].start + 100] + bytes(len(data) - segments[1].start - 100))
+            network._write_segments(target, url, len(data), segments)
+            result = network._net_get_segmented(network.UrlProps(url), target, len(data))
+            self.assertTrue(result)
+            self.assertEqual(target.read_bytes(), data)
+            self.assertEqual(self.server.ranges, [f"bytes={segments[1].start + 100}-{len(data) - 1}"])
+
+    def test_segmented_download_unreadable_segments(self):
+        data = bytes(range(256)) * 1024
+        self.server = serve(self, data)
+        url = server_url(self.server)
+        with tempfile.TemporaryDirectory() as d:
+            target = Path(d) / 'file.msi'
+            # Preallocated, then the sidecar was cut off mid-write
+            target.write_bytes(bytes(len(data)))
+            network._segments_path(target).write_text('{"url": ')
+            result = network._net_get_segmented(network.UrlProps(url), target, len(data))
+            self.assertTrue(result)
+            self.assertEqual(target.read_bytes(), data)
+
+    def test_interrupted_download_is_incomplete(self):
+        with tempfile.TemporaryDirectory() as d:
+            target = Path(d) / 'file.msi'
+            app = Mock()
+            app.conf._network.url_size.return_value = 100
+            target.write_bytes(bytes(50))
+            self.assertTrue(network._download_incomplete('http://example.com/file.msi', target, app))
+            target.write_bytes(bytes(100))
+            self.assertFalse(network._download_incomplete('http://example.com/file.msi', target, app))
+            network._write_segments(target, 'http://example.com/file.msi', 100, [])
+            self.assertTrue(network._download_incomplete('http://example.com/file.msi', target, app))
+
+    def test_segmented_download_empty_range(self):
+        data = bytes(range(256)) * 1024
+        self.server = serve(self, data, empty_ranges=True)
+        url = server_url(self.server)
+        with tempfile.TemporaryDirectory() as d:
+            target = Path(d) / 'file.msi'
+            # Falls back to a single stream instead of asking again forever
+            result = network._net_get_segmented(network.UrlProps(url), target, len(data))
+            self.assertIs(result, False)
+            self.assertEqual(len(self.server.ranges), network.SEGMENTED_DOWNLOAD_CONNECTIONS)
+            self.assertFalse(target.exists())
+
+    def test_download_hasher_matches_file_md5(self):
+        with tempfile.TemporaryDirectory() as d:
+            f = Path(d) / 'file.json'
+            f.write_text('{\n}\n')
+            hasher = network.DownloadHasher(f)
+            hasher.update(b'{\n')
+            hasher.update_from_disk(4)
+            hasher.save()
+            self.assertEqual(network._read_md5_state(f), network.FileProps(f).md5)
+            f.write_text('{}')
+            self.assertIsNone(network._read_md5_state(f))
+
+
+class TestVerifiedFiles(unittest.TestCase):
+    def test_verified_files_invalidated_on_change(self):
+        with tempfile.TemporaryDirectory() as d:
+            f = Path(d) / 'file.msi'
+            f.write_text('data')
+            with patch.object(network.constants, 'VERIFIED_FILES_PATH', str(Path(d) / 'verified.json')):
+                network.VerifiedFiles().add(f, 'md5sum')
+                # Reload from disk to make sure it persisted
+                self.assertEqual(network.VerifiedFiles.load().md5(f), 'md5sum')
+                f.write_text('changed')
+                self.assertIsNone(network.VerifiedFiles.load().md5(f))
+
+
+class TestDownloadStore(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tempdir.name)
+        self.store_dir = self.dir / 'store'
+        for name, value in [
+            ('DOWNLOAD_STORE_DIR', str(self.store_dir)),
+            ('VERIFIED_FILES_PATH', str(self.dir / 'verified.json')),
+        ]:
+            patcher = patch.object(network.constants, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.app = Mock()
+        self.app.conf._network.verified_files = network.VerifiedFiles()
+        self.app.conf._network.url_md5.return_value = None
+        self.app.conf._network.url_size.return_value = 4
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_store_requires_recorded_md5(self):
+        url = 'http://example.com/file.msi'
+        store_path = network._store_path(url, self.app)
+        store_path.parent.mkdir(parents=True)
+        # Right size, but nothing says what's in it
+        store_path.write_text('data')
+        self.assertFalse(network._verified_store_file(store_path, url, self.app))
+
+        download = self.dir / 'file.msi'
+        download.write_text('data')
+        network._add_to_store(download, store_path, network.FileProps(download).md5, self.app)
+        self.assertTrue(network._verified_store_file(store_path, url, self.app))
+
+        # Changed after it was stored, even though the size is the same
+        store_path.write_text('DATA')
+        self.assertFalse(network._verified_store_file(store_path, url, self.app))
+
+    def test_prune_unlinked_entries(self):
+        self.store_dir.mkdir()
+        unused = self.store_dir / 'url-unused'
+        unused.write_text('data')
+        in_use = self.store_dir / 'url-in-use'
+        in_use.write_text('data')
+        (self.dir / 'file.msi').hardlink_to(in_use)
+
+        network.prune_download_store()
+        self.assertTrue(unused.exists())
+
+        later = time.time() + (network.DOWNLOAD_STORE_MAX_AGE_DAYS + 1) * 24 * 60 * 60
+        with patch.object(network.time, 'time', return_value=later):
+            network.prune_download_store()
+        self.assertFalse(unused.exists())
+        self.assertTrue(in_use.exists())
+
+
+class TestHttpSession(unittest.TestCase):
+    def test_session_is_per_thread(self):
+        http = network.HttpSession()
+        sessions = []
+        t = threading.Thread(target=lambda: sessions.append(http.session))
+        t.start()
+        t.join()
+        self.assertIs(http.session, http.session)
+        self.assertIsNot(http.session, sessions[0])
+        # Both share the same connection pool
+        self.assertIs(http.session.get_adapter("https://"), sessions[0].get_adapter("https://"))
+
+    def test_network_requests_share_one_pool(self):
+        self.assertIs(network.NetworkRequests.http(), network.NetworkRequests.http())
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_download_waits_for_prefetch(self):
+        app = Mock()
+        app.conf.download_dir = '/tmp'
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_download(*args, **kwargs):
+            started.set()
+            release.wait(5)
+            return True
+
+        with patch.object(network, '_reuse_download', side_effect=slow_download) as download:
+            network.prefetch('http://example.com/file.msi', 'file.msi', app)
+            # A second prefetch of the same file is ignored
+            network.prefetch('http://example.com/file.msi', 'file.msi', app)
+            started.wait(5)
+            release.set()
+            download.side_effect = None
+            download.return_value = True
+            network.logos_reuse_download('http://example.com/file.msi', 'file.msi', '/tmp', app)
+            self.assertEqual(download.call_count, 2)
+            self.assertTrue(download.call_args_list[0].kwargs['background'])
+            app.exit.assert_not_called()
+
+    def test_cancel_prefetches(self):
+        app = Mock()
+        app.conf.download_dir = '/tmp'
+        started = threading.Event()
+        cancels = []
+
+        def download(*args, cancel, **kwargs):
+            cancels.append(cancel)
+            started.set()
+            if not cancel.wait(5):
+                return True
+            raise network.DownloadCancelled()
+
+        with patch.object(network, '_reuse_download', side_effect=download):
+            network.prefetch('http://example.com/a.msi', 'a.msi', app)
+            started.wait(5)
+            start = time.monotonic()
+            network.cancel_prefetches()
+            self.assertTrue(cancels[0].is_set())
+            self.assertEqual(network._prefetches, {})
+            # A new prefetch gets a new executor
+            started.clear()
+            network.prefetch('http://example.com/b.msi', 'b.msi', app)
+            started.wait(5)
+            network.cancel_prefetch('http://example.com/b.msi', 'b.msi')
+            self.assertTrue(cancels[1].is_set())
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_cancelled_download_keeps_partial_file(self):
+        data = bytes(range(256)) * 1024
+        url = server_url(serve(self, data))
+        cancel = threading.Event()
+        cancel.set()
+        with tempfile.TemporaryDirectory() as d:
+            target = Path(d) / 'file.msi'
+            target.write_bytes(data[:100])
+            with self.assertRaises(network.DownloadCancelled):
+                network._net_get(url, target, cancel=cancel)
+            self.assertEqual(target.read_bytes(), data[:100])
@@ -0,0 +1,80 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from ou_dedetai import registry
+from ou_dedetai.registry import RegistryValue
+
+USER_REG = '''WINE REGISTRY Version 2
+;; All keys relative to \\\\User\\\\S-1-5-21-0-0-0-1000
+
+#arch=win64
+
+[Control Panel\\\\Desktop] 1700000000
+#time=1da1b2c3d4e5f60
+"FontSmoothing"="2"
+"FontSmoothingGamma"=dword:00000578
+"Wallpaper"=str(2):"%SystemRoot%\\\\web.bmp"
+
+[Software\\\\Wine\\\\Fonts] 1700000000
+#time=1da1b2c3d4e5f60
+"Codepages"="1252,437"
+"Blob"=hex:01,02,\\
+  03,04
+@="default"
+
+[Software\\\\Wine\\\\Quoted] 1700000000
+"Path"="C:\\\\Program Files\\\\\\"x\\"\\x00e9"
+'''
+
+
+class TestRegistry(unittest.TestCase):
+    def test_parse_hive(self):
+        keys = registry.parse_hive(USER_REG)
+        desktop = keys["control panel\\desktop"]
+        self.assertEqual(desktop["fontsmoothing"], RegistryValue("REG_SZ", "2"))
+        self.assertEqual(desktop["fontsmoothinggamma"], RegistryValue("REG_DWORD", 0x578))
+        self.assertEqual(desktop["wallpaper"], RegistryValue("REG_EXPAND_SZ", "%SystemRoot%\\web.bmp"))
+        fonts = keys["software\\wine\\fonts"]
+        self.assertEqual(fonts["blob"], RegistryValue("REG_BINARY", b"\x01\x02\x03\x04"))
+        self.assertEqual(fonts[""].data, "default")
+        self.assertEqual(keys["software\\wine\\quoted"]["path"].data, 'C:\\Program Files\\"x"\u00e9')
+
+    def test_read_value(self):
+        with tempfile.TemporaryDirectory() as prefix:
+            (Path(prefix) / "user.reg").write_text(USER_REG)
+            self.assertEqual(
+                registry.read_value(prefix, "HKCU\\Software\\Wine\\Fonts", "Codepages"),
+                (True, RegistryValue("REG_SZ", "1252,437"))
+            )
+            self.assertEqual(registry.read_value(prefix, "HKCU\\Software\\Missing", "A"), (True, None))
+            # No system.reg
+            self.assertEqual(registry.read_value(prefix, "HKLM\\Software", "A"), (False, None))
+
+    def test_write_values(self):
+        with tempfile.TemporaryDirectory() as prefix:
+            hive = Path(prefix) / "user.reg"
+            hive.write_text(USER_REG)
+            self.assertTrue(registry.write_values(prefix, {
+                "HKEY_CURRENT_USER\\Control Panel\\Desktop": {
+                    "FontSmoothing": RegistryValue("REG_SZ", "0"),
+                    "FontSmoothingType": RegistryValue("REG_DWORD", 2),
+                },
+                "HKEY_CURRENT_USER\\Software\\Logos4\\Logging": {
+                    "Enabled": RegistryValue("REG_DWORD", 1),
+                },
+            }))
+            keys = registry.parse_hive(hive.read_text())
+            desktop = keys["control panel\\desktop"]
+            self.assertEqual(desktop["fontsmoothing"].data, "0")
+            self.assertEqual(desktop["fontsmoothingtype"].data, 2)
+            self.assertEqual(desktop["wallpaper"].data, "%SystemRoot%\\web.bmp")
+            self.assertEqual(keys["software\\wine\\fonts"]["blob"].data, b"\x01\x02\x03\x04")
+            self.assertEqual(keys["software\\logos4\\logging"]["enabled"].data, 1)
+            # The cached parse is refreshed after the write
+            self.assertEqual(
+                registry.read_value(prefix, "HKCU\\Software\\Logos4\\Logging", "Enabled")[1],
+                RegistryValue("REG_DWORD", 1)
+            )
+            # Can't edit a hive that doesn't exist
+            self.assertFalse(registry.write_values(prefix, {"HKLM\\Software": {}}))
@@ -0,0 +1,61 @@
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from ou_dedetai import system
+
+
+class TestProcessExitWatcher(unittest.TestCase):
+    def test_wait_returns_when_process_exits(self):
+        watcher = system.ProcessExitWatcher()
+        process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(0.2)"])
+        start = time.monotonic()
+        self.assertTrue(watcher.wait([process.pid], timeout=10))
+        self.assertLess(time.monotonic() - start, 5)
+        process.wait()
+
+    def test_wait_times_out(self):
+        watcher = system.ProcessExitWatcher()
+        self.assertFalse(watcher.wait([], timeout=0.05))
+
+    def test_wake(self):
+        watcher = system.ProcessExitWatcher()
+        threading.Timer(0.1, watcher.wake).start()
+        self.assertTrue(watcher.wait([], timeout=10))
+        # The wake up was consumed
+        self.assertFalse(watcher.wait([], timeout=0.05))
+
+
+class TestGetPids(unittest.TestCase):
+    marker = "C:\\ou_dedetai_test\\Logos.exe"
+
+    def start_process(self) -> subprocess.Popen:
+        process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(10)", self.marker])
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        # Give the interpreter a moment to exec
+        time.sleep(0.2)
+        return process
+
+    def test_get_pids_by_cmdline(self):
+        process = self.start_process()
+        result = system.get_pids_by_cmdline([self.marker, "C:\\missing.exe"])
+        self.assertEqual([p.pid for p in result[self.marker]], [process.pid])
+        self.assertEqual(result["C:\\missing.exe"], [])
+
+    def test_only_whole_arguments_match(self):
+        self.start_process()
+        prefix = self.marker.removesuffix(".exe")
+        self.assertEqual(system.get_pids_by_cmdline([prefix]), {prefix: []})
+
+    def test_without_proc(self):
+        process = self.start_process()
+        with patch.object(system.Path, 'is_dir', return_value=False):
+            result = system.get_pids_by_cmdline([self.marker])
+        self.assertEqual([p.pid for p in result[self.marker]], [process.pid])
+
+    def test_no_queries(self):
+        self.assertEqual(system.get_pids_by_cmdline([]), {})
@@ -1,8 +1,9 @@
+import os
 import queue
 import subprocess
 import tempfile
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 from pathlib import Path
 
 import ou_dedetai.constants as constants
@@ -68,9 +69,21 @@ class TestAppUtils(unittest.TestCase):
         self.app.conf.download_dir = TESTDATADIR
         self.assertEqual(len(utils.find_appimage_files(self.app)), 0)
 
-    @unittest.skip("Not practical.")
     def test_find_wine_binary_files(self):
-        pass
+        with tempfile.TemporaryDirectory() as d:
+            good = Path(d) / 'good'
+            bad = Path(d) / 'bad'
+            for path, version in [(good, 'wine-10.0'), (bad, 'wine-8.0')]:
+                path.mkdir()
+                (path / 'wine64').write_text(f"#!/bin/sh\necho {version}\n")
+                (path / 'wine64').chmod(0o755)
+            self.app.conf._overrides.custom_binary_path = str(bad)
+            self.app.conf.faithlife_product_version = '10'
+            with patch.dict(os.environ, {'PATH': str(good)}):
+                binaries = utils.find_wine_binary_files(self.app, '40.0.0.0')
+                # Extra directories are searched without changing PATH
+                self.assertEqual(os.environ['PATH'], str(good))
+            self.assertEqual(binaries, [str(good / 'wine64')])
 
     def test_get_wine_options(self):
         # TODO: Make more tests to fully test function.
@@ -255,6 +268,33 @@ class TestGeneralUtils(unittest.TestCase):
     def test_get_path_size_notexists(self):
         self.assertEqual(0, utils.get_path_size('./no_dir'))
 
+    def test_scan_tree_size_matches_du(self):
+        dirs = [TESTDATADIR, REPODIR / 'snap']
+        # Apparent size of every file and directory, hardlinks counted once
+        cmd = ['du', '-sbc', *(str(d) for d in dirs)]
+        size_du = int(subprocess.check_output(cmd).decode().splitlines()[-1].split()[0])
+        self.assertEqual(utils.scan_tree(dirs).size, size_du)
+
+    def test_scan_tree(self):
+        with tempfile.TemporaryDirectory() as td:
+            d = Path(td)
+            (d / 'a' / 'b').mkdir(parents=True)
+            (d / 'c').mkdir()
+            (d / 'top.txt').write_text("1")
+            (d / 'a' / 'b' / 'file.bin').write_bytes(b"x" * 1000)
+            os.link(d / 'a' / 'b' / 'file.bin', d / 'c' / 'link.bin')
+            os.mkfifo(d / 'c' / 'fifo')
+            dir_bytes = sum(p.stat().st_size for p in (d, d / 'a', d / 'a' / 'b', d / 'c'))
+
+            scan = utils.scan_tree([d, d / 'missing'])
+            self.assertEqual(scan.dirs[0], d)
+            self.assertLess(scan.dirs.index(d / 'a'), scan.dirs.index(d / 'a' / 'b'))
+            self.assertEqual(
+                sorted(f.path.name for f in scan.files),
+                ['file.bin', 'link.bin', 'top.txt']
+            )
+            self.assertEqual(scan.size, dir_bytes + 1 + 1000)
+
     # @unittest.skip("Unused function")
     # def test_get_procs_using_file(self):
     #     with tempfile.TemporaryFile() as tf:
@@ -303,6 +343,19 @@ class TestGeneralUtils(unittest.TestCase):
         result = utils.is_relative_path(p)
         self.assertTrue(result)
 
+    def test_link_or_copy(self):
+        with tempfile.TemporaryDirectory() as d:
+            src = Path(d) / 'src.bin'
+            src.write_bytes(b'data')
+            dst_dir = Path(d) / 'dst'
+            dst_dir.mkdir()
+            (dst_dir / 'src.bin').write_text('stale')
+            utils.link_or_copy(src, dst_dir)
+            self.assertEqual((dst_dir / 'src.bin').read_bytes(), b'data')
+            # Linking onto itself is a no-op
+            utils.link_or_copy(src, dst_dir / 'src.bin')
+            self.assertEqual(src.read_bytes(), b'data')
+
     def test_parse_bool_bad(self):
         for s in ["False", "FALSE", "No", "N", "n", "0"]:
             self.assertFalse(utils.parse_bool(s))
@@ -0,0 +1,85 @@
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from ou_dedetai import wine
+
+
+class TestRegistryTransaction(unittest.TestCase):
+    def test_edits_merge_into_one_document(self):
+        registry = wine.RegistryTransaction()
+        self.assertFalse(registry)
+        registry.set_string("HKCU\\Software\\Wine\\Direct3D", "renderer", "gl")
+        registry.set_dword("HKEY_CURRENT_USER\\Software\\Logos4\\Logging", "Enabled", 1)
+        # Later edits of the same value win
+        registry.set_string("HKEY_CURRENT_USER\\Software\\Wine\\Direct3D", "renderer", "gdi")
+        registry.set_string("HKCU\\Software\\Test", "path", 'C:\\a "b"')
+        self.assertEqual(
+            registry.to_reg(),
+            'REGEDIT4\n'
+            '\n'
+            '[HKEY_CURRENT_USER\\Software\\Wine\\Direct3D]\n'
+            '"renderer"="gdi"\n'
+            '\n'
+            '[HKEY_CURRENT_USER\\Software\\Logos4\\Logging]\n'
+            '"Enabled"=dword:00000001\n'
+            '\n'
+            '[HKEY_CURRENT_USER\\Software\\Test]\n'
+            '"path"="C:\\\\a \\"b\\""\n'
+        )
+
+    def test_is_applied_reads_values_back(self):
+        registry = wine.RegistryTransaction()
+        registry.set_string("HKCU\\Software\\Wine\\DllOverrides", "winemenubuilder.exe", "")
+        registry.set_dword("HKCU\\Control Panel\\Desktop", "FontSmoothingType", 2)
+        values = {"winemenubuilder.exe": "", "FontSmoothingType": "0x2"}
+        with patch.object(wine, 'get_registry_value', lambda key, name, app: values[name]):
+            self.assertTrue(registry.is_applied(Mock()))
+            values["FontSmoothingType"] = "0x1"
+            self.assertFalse(registry.is_applied(Mock()))
+
+
+class TestIcuDataFiles(unittest.TestCase):
+    def test_lists_files_copied_into_windows_dir(self):
+        with tempfile.TemporaryDirectory() as d:
+            source = Path(d) / "source"
+            (source / "icu-win" / "windows" / "globalization").mkdir(parents=True)
+            (source / "icu-win" / "windows" / "globalization" / "icudtl.dat").write_text("icu")
+            (source / "icu-win" / "README").write_text("readme")
+            with tarfile.open(Path(d) / "icu-1.0.tar.gz", "w:gz") as tar:
+                tar.add(source / "icu-win", "./icu-win")
+            app = Mock()
+            app.conf.wine_prefix = f"{d}/prefix"
+            app.conf.download_dir = d
+            with patch.object(wine, 'get_icu_download', return_value=("url", "icu-1.0.tar.gz")):
+                self.assertEqual(
+                    wine.get_icu_data_files(app),
+                    [Path(d) / "prefix" / "drive_c" / "windows" / "globalization" / "icudtl.dat"]
+                )
+                app.conf.download_dir = f"{d}/missing"
+                self.assertIsNone(wine.get_icu_data_files(app))
+
+
+class TestWineReleaseCache(unittest.TestCase):
+    def test_release_is_cached_until_binary_changes(self):
+        with tempfile.TemporaryDirectory() as d:
+            binary = Path(d) / "wine64"
+            counter = Path(d) / "count"
+            binary.write_text(f"#!/bin/sh\necho x >> {counter}\necho wine-9.10\n")
+            binary.chmod(0o755)
+            with (
+                patch.object(wine.constants, 'WINE_RELEASES_CACHE_PATH', str(Path(d) / "releases.json")),
+                patch.object(wine, '_release_cache', None),
+            ):
+                releases = wine.get_wine_releases([str(binary), str(binary)])
+                self.assertEqual(releases[str(binary)][0], wine.WineRelease(9, 10, 'devel'))
+                self.assertEqual(wine.get_wine_release(str(binary))[0], wine.WineRelease(9, 10, 'devel'))
+                self.assertEqual(len(counter.read_text().splitlines()), 1)
+                # Loaded from disk by a new cache
+                self.assertIsNotNone(wine.WineReleaseCache.load().get(str(binary)))
+
+                binary.write_text(f"#!/bin/sh\necho x >> {counter}\necho wine-10.0\n")
+                self.assertEqual(wine.get_wine_release(str(binary))[0], wine.WineRelease(10, 0, 'stable'))
+                self.assertEqual(len(counter.read_text().splitlines()), 2)